@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Requests served here resolve through ecom/urls_asgi.py (see shop.async_views), which
+swaps in async versions of the catalog, product, search and wallet pages.
 """
 
 import os
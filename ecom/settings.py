@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "shop.async_views.asgi_urlconf",  # async read views under ASGI (ecom/urls_asgi.py)
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -48,9 +50,11 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "shop.profiling.QueryProfilerMiddleware",  # inactive unless QUERY_PROFILING
 ]
 
 ROOT_URLCONF = "ecom.urls"
+ASGI_URLCONF = "ecom.urls_asgi"
 
 TEMPLATES = [
     {
@@ -73,13 +77,40 @@ WSGI_APPLICATION = "ecom.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# WAL lets readers run while a writer commits; IMMEDIATE transactions take the write lock up
+# front, so a transaction queues (up to "timeout" seconds) instead of failing with "database is
+# locked" when it later tries to write. synchronous=NORMAL is durable in WAL mode except for the
+# last transactions on power loss. Connections are reused for CONN_MAX_AGE and health-checked.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;"
+    "PRAGMA synchronous=NORMAL;"
+    "PRAGMA cache_size=-20000;"  # KiB
+    "PRAGMA temp_store=MEMORY;"
+    "PRAGMA mmap_size=134217728"
+)
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {"init_command": SQLITE_PRAGMAS, "transaction_mode": "IMMEDIATE", "timeout": 20},
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Optional read replica for catalog and dashboard pages (shop.routers): a SQLite copy of the
+# primary refreshed by `manage.py sync_replica --every <seconds>`
+READ_REPLICA = os.environ.get("ECOM_READ_REPLICA")
+if READ_REPLICA:
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": READ_REPLICA,
+        "OPTIONS": {"init_command": SQLITE_PRAGMAS + ";PRAGMA query_only=ON", "timeout": 20},
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_ROUTERS = ["shop.routers.ReadReplicaRouter"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -130,4 +161,36 @@ LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# Carts, anonymous sessions and fragment versions live only in the cache, so every worker process
+# must share it: Redis (needs the redis package) at ECOM_REDIS_URL, e.g. redis://127.0.0.1:6379/1.
+# Without it the cache is per-process LocMem, which only suits a single development process.
+REDIS_URL = os.environ.get("ECOM_REDIS_URL")
+if REDIS_URL:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": REDIS_URL}}
+else:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "OPTIONS": {"MAX_ENTRIES": 10000}}}
+
+# Sessions live in the cache; only logged-in ones are written (batched) to django_session (shop.sessions)
+SESSION_ENGINE = 'shop.sessions'
+
+# Background jobs (shop.jobs, `manage.py runworker`): per queue, how many batches may run at once
+# across all workers and how many jobs one batch claims
+JOB_QUEUES = {
+    'default': {'concurrency': 4, 'batch': 10},
+    'email': {'concurrency': 1, 'batch': 50},  # one SMTP connection per batch
+}
+
+# Cart stock holds (shop.reservations); expired holds are removed by `manage.py sweep_holds`
+STOCK_HOLD_TTL_SECONDS = 15 * 60
+
+# Background image processing threads (shop.imaging); 0 processes inline after commit
+IMAGE_WORKERS = 2
+
+# Hosts vendor catalog imports may download product images from over https (shop.product_io);
+# empty disables remote images, leaving only images the vendor's products already have
+PRODUCT_IMPORT_IMAGE_HOSTS = []
+
+# Per-view query counts/DB time/N+1 shapes (shop.profiling); logged and sent as Server-Timing
+QUERY_PROFILING = False
 LOGOUT_REDIRECT_URL = 'logout_success' 
\ No newline at end of file
@@ -0,0 +1,13 @@
+# ecom/urls_asgi.py - URLconf for requests served through ecom/asgi.py
+# The read-heavy pages resolve to their async versions (shop.async_views); everything else falls
+# through to the regular URLconf. Names match, so reverse() gives the same URLs either way.
+from django.urls import path
+from shop import async_views
+from . import urls
+
+urlpatterns = [
+    path('', async_views.home, name='home'),
+    path('search/', async_views.search, name='search'),
+    path('p/<slug:slug>/', async_views.product_detail, name='product_detail'),
+    path('wallet/', async_views.wallet_detail, name='wallet_detail'),
+] + urls.urlpatterns
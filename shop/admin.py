@@ -1,6 +1,9 @@
 from django.contrib import admin
+from django.db import transaction
+from django.utils import timezone
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
-from .models import ProductImage, User, Product, Order, OrderItem, Payment, ManualPayment
+from . import counters
+from .models import Job, ProductImage, User, Product, Order, OrderItem, Payment, ManualPayment
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -10,8 +13,10 @@ class UserAdmin(admin.ModelAdmin):
     
     def approve_vendors(self, request, queryset):
         # Only approve vendors, not other users
-        vendors = queryset.filter(role=User.VENDOR)
-        updated = vendors.update(vendor_approved=True)
+        vendors = queryset.filter(role=User.VENDOR, vendor_approved=False)
+        with transaction.atomic():
+            updated = vendors.update(vendor_approved=True)
+            counters.bump(counters.PENDING_VENDORS, -updated)
         self.message_user(request, f"{updated} vendors were approved.")
     approve_vendors.short_description = "Approve selected vendors"
 
@@ -38,4 +43,16 @@ class OrderAdmin(admin.ModelAdmin):
 
 admin.site.register(Payment)
 admin.site.register(ManualPayment)
-admin.site.register(ProductImage)
\ No newline at end of file
+admin.site.register(ProductImage)
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'queue', 'name', 'status', 'attempts', 'run_at', 'finished_at')
+    list_filter = ('queue', 'status')
+    search_fields = ('name',)
+    actions = ['retry_jobs']
+
+    def retry_jobs(self, request, queryset):
+        updated = queryset.filter(status=Job.FAILED).update(status=Job.QUEUED, attempts=0, run_at=timezone.now(), finished_at=None)
+        self.message_user(request, f"{updated} failed jobs were queued again.")
+    retry_jobs.short_description = "Retry selected failed jobs"
@@ -0,0 +1,139 @@
+# shop/api.py - read-only JSON catalog API (/api/v1/) for the mobile app and partner integrations
+# Rows are read with values() over only the columns the requested fields need (?fields=id,name)
+# and serialised as they come: no model instances, no templates. Images are one IN query per
+# response, availability is the same correlated hold sum the HTML pages use. Product lists page
+# newest first with the storefront's keyset cursors (?after=/?before=, echoed back as next and
+# previous). Responses are gzipped for clients that accept it.
+from functools import wraps
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET
+from . import categories
+from .catalog import held_quantity, keyset_page
+from .models import Product, ProductImage
+from .routers import replica_reads
+
+DEFAULT_LIMIT = 24
+MAX_LIMIT = 100
+MAX_BATCH = 100
+# public name -> values() column
+COLUMNS = {
+    'id': 'id', 'slug': 'slug', 'name': 'name', 'description': 'description', 'price_mwk': 'price_mwk',
+    'stock_quantity': 'stock_quantity', 'category': 'category', 'vendor': 'vendor__username',
+    'created_at': 'created_at', 'updated_at': 'updated_at',
+}
+# computed fields and the columns they are built from
+COMPUTED = {'available': ('stock_quantity', 'held'), 'url': ('slug',), 'image': ()}
+FIELDS = list(COLUMNS) + list(COMPUTED)
+DEFAULT_FIELDS = ['id', 'slug', 'name', 'price_mwk', 'category', 'available', 'image', 'url']
+
+
+class InvalidParameter(Exception):
+    pass
+
+
+def _fields(params):
+    if not params.get('fields'):
+        return DEFAULT_FIELDS
+    fields = list(dict.fromkeys(f.strip() for f in params['fields'].split(',') if f.strip()))
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown or not fields:
+        raise InvalidParameter(f'Unknown field(s) {", ".join(unknown) or "(none given)"}; available: {", ".join(FIELDS)}.')
+    return fields
+
+
+def _int(params, name, default, maximum):
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise InvalidParameter(f'{name} must be a number.')
+    if not 1 <= value <= maximum:
+        raise InvalidParameter(f'{name} must be between 1 and {maximum}.')
+    return value
+
+
+def _values(qs, fields):
+    # id always: cursors and image lookups need it
+    columns = {'id'}
+    for f in fields:
+        columns.update(COMPUTED[f] if f in COMPUTED else [COLUMNS[f]])
+    if 'held' in columns:
+        qs = qs.annotate(held=held_quantity())
+    return qs.values(*columns)
+
+
+def _images(ids):
+    # {product id: card url} for each product's first image
+    urls = {}
+    for product_id, card, image in (ProductImage.objects.filter(product_id__in=ids).order_by('product_id', 'id')
+                                    .values_list('product_id', 'card', 'image')):
+        if product_id not in urls:
+            urls[product_id] = default_storage.url(card or image)
+    return urls
+
+
+def _serialise(rows, fields):
+    images = _images([row['id'] for row in rows]) if 'image' in fields else {}
+    data = []
+    for row in rows:
+        item = {}
+        for f in fields:
+            if f == 'available':
+                item[f] = max(0, row['stock_quantity'] - row['held'])
+            elif f == 'url':
+                item[f] = reverse('product_detail', args=[row['slug']])
+            elif f == 'image':
+                item[f] = images.get(row['id'])
+            else:
+                item[f] = row[COLUMNS[f]]
+        data.append(item)
+    return data
+
+
+def api_view(view):
+    # GET only, gzip, replica reads, and InvalidParameter as a 400 JSON error
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except InvalidParameter as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    return require_GET(gzip_page(replica_reads(wrapper)))
+
+
+@api_view
+def products(request):
+    fields = _fields(request.GET)
+    qs = Product.objects.all()
+    if request.GET.get('category'):
+        qs = qs.filter(category=request.GET['category'])
+    page = keyset_page(_values(qs, fields), request.GET, _int(request.GET, 'limit', DEFAULT_LIMIT, MAX_LIMIT))
+    return JsonResponse({
+        'data': _serialise(page.object_list, fields),
+        'next': page.next_cursor, 'previous': page.previous_cursor,
+    })
+
+
+@api_view
+def products_batch(request):
+    # ?ids=3,1,2 -> those products in that order; ids with no product are listed in `missing`
+    try:
+        ids = list(dict.fromkeys(int(i) for i in request.GET.get('ids', '').split(',') if i.strip()))
+    except ValueError:
+        raise InvalidParameter('ids must be a comma-separated list of product ids.')
+    if not 1 <= len(ids) <= MAX_BATCH:
+        raise InvalidParameter(f'Give between 1 and {MAX_BATCH} ids.')
+    fields = _fields(request.GET)
+    found = {row['id']: row for row in _values(Product.objects.filter(id__in=ids), fields)}
+    return JsonResponse({
+        'data': _serialise([found[i] for i in ids if i in found], fields),
+        'missing': [i for i in ids if i not in found],
+    })
+
+
+@api_view
+def category_list(request):
+    return JsonResponse({'data': [{'name': name, 'products': n, 'in_stock': in_stock}
+                                  for name, n, in_stock in categories.nav()]})
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate
 
 
 class ShopConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "shop"
+
+    def ready(self):
+        from . import cart, fragments  # noqa: F401  (merge-on-login and cache-version receivers)
+        post_migrate.connect(install_triggers, sender=self)
+
+
+def install_triggers(sender, using, **kwargs):
+    from . import categories, search
+    search.install_triggers(connections[using])
+    categories.install_triggers(connections[using])
@@ -0,0 +1,86 @@
+# shop/async_views.py - async read path for the catalog, product, search and wallet pages
+# Served instead of their views.py twins when the site runs under ASGI (ecom/asgi.py): the
+# middleware below switches those requests to ecom/urls_asgi.py. Session, user, cache and rows
+# are all loaded through the async APIs before rendering, so a slow database or client ties up
+# a coroutine instead of a worker thread, and template rendering touches no lazy DB state.
+# The middleware stack must stay async-capable for this to pay off (QUERY_PROFILING isn't).
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import Http404
+from django.shortcuts import render
+from django.utils.decorators import sync_and_async_middleware
+from .catalog import akeyset_page, aproduct_count, with_availability
+from .conditional import precondition, stamp
+from .fragments import afragments
+from .models import Product, Wallet
+from .routers import replica_reads
+from .search import search_products
+from .wallet import astatement
+
+
+@sync_and_async_middleware
+def asgi_urlconf(get_response):
+    # the handler chain is only async under ASGI; WSGI requests keep ROOT_URLCONF
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            request.urlconf = settings.ASGI_URLCONF
+            return await get_response(request)
+    else:
+        def middleware(request):
+            return get_response(request)
+    return middleware
+
+
+async def _load_user(request):
+    # resolves request.user (and with it the session) now rather than lazily in the template
+    request.user = await request.auser()
+
+
+@replica_reads
+async def home(request):
+    await _load_user(request)
+    page_obj = await akeyset_page(with_availability(Product.objects.all()), request.GET, 12)
+    not_modified, etag = precondition(request, page_obj.object_list)
+    if not_modified:
+        return stamp(not_modified, etag)
+    cards = await afragments(page_obj, 'card')
+    for p in page_obj:
+        p.card_html = cards.get(p.pk, {}).get('card', '')
+    response = render(request, 'home.html', {'page_obj': page_obj, 'product_count': await aproduct_count()})
+    return stamp(response, etag)
+
+
+@replica_reads
+async def search(request):
+    await _load_user(request)
+    q = request.GET.get('q', '').strip()
+    category = request.GET.get('category') or None
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 1
+    # the FTS query is raw SQL and Django has no async cursor, so it runs on the sync DB thread
+    result = await sync_to_async(search_products)(q, category=category, page=page)
+    return render(request, 'search.html', {'q': q, 'category': category, 'result': result})
+
+
+@replica_reads
+async def product_detail(request, slug):
+    await _load_user(request)
+    obj = await with_availability(Product.objects.all()).filter(slug=slug).afirst()
+    if obj is None:
+        raise Http404('No Product matches the given query.')
+    not_modified, etag = precondition(request, [obj])
+    if not_modified:
+        return stamp(not_modified, etag)
+    parts = (await afragments([obj], 'gallery', 'summary')).get(obj.pk, {})
+    return stamp(render(request, 'product_detail.html', {'object': obj, 'parts': parts}), etag)
+
+
+@login_required
+async def wallet_detail(request):
+    await _load_user(request)
+    wallet, _ = await Wallet.objects.aget_or_create(user=request.user)
+    page_obj = await astatement(wallet, request.GET)
+    return render(request, 'wallet_detail.html', {'wallet': wallet, 'page_obj': page_obj})
@@ -0,0 +1,35 @@
+# shop/bulk.py - set-based write helpers shared by the housekeeping jobs and the maintained totals
+from django.db import connections, router
+from django.db.models import Subquery
+
+
+def delete_in_batches(queryset, batch_size):
+    # bounded DELETE ... WHERE pk IN (SELECT pk ... LIMIT n) statements until a short one, so a purge
+    # never holds the write lock for long; returns how many rows were deleted
+    removed = 0
+    while True:
+        batch = queryset.values('pk')[:batch_size]
+        deleted, _ = queryset.model._base_manager.filter(pk__in=Subquery(batch)).delete()
+        removed += deleted
+        if deleted < batch_size:
+            return removed
+
+
+def insert_or_add(model, columns, unique, add, rows):
+    # INSERT ... ON CONFLICT (unique) DO UPDATE SET c = c + excluded.c for each column in `add`, one
+    # executemany over `rows` (tuples in `columns` order). For counters that concurrent writers move
+    # by a delta; bulk_create(update_conflicts=True) can only overwrite.
+    if not rows:
+        return
+    conn = connections[router.db_for_write(model)]
+    qn = conn.ops.quote_name
+    table = qn(model._meta.db_table)
+    sql = 'INSERT INTO {t} ({cols}) VALUES ({params}) ON CONFLICT ({uniq}) DO UPDATE SET {sets}'.format(
+        t=table,
+        cols=', '.join(qn(c) for c in columns),
+        params=', '.join(['%s'] * len(columns)),
+        uniq=', '.join(qn(c) for c in unique),
+        sets=', '.join(f'{qn(c)} = {table}.{qn(c)} + excluded.{qn(c)}' for c in add),
+    )
+    with conn.cursor() as cur:
+        cur.executemany(sql, rows)
@@ -0,0 +1,132 @@
+# shop/cart.py - server-side cart
+# The cart lives in the cache as a compact list of [product_id, qty, unit_price_mwk, name] rows,
+# so rendering it reads no product rows. Logged-in carts are also written to SavedCart, which is
+# authoritative: requests that change the cart or check it out load it from there (fresh=True),
+# so a cache copy left behind by another worker is never saved over newer lines or ordered;
+# pages that only show the cart read the cache. Anonymous carts are keyed by a short token kept in the
+# session (written once, not on every click; with shop.sessions that session never reaches the
+# database) and merged into the user's cart on login.
+import secrets
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.dispatch import receiver
+from .checkout import CheckoutError
+from .models import SavedCart
+from .reservations import place_holds, release
+
+SESSION_KEY = 'cart_key'
+CART_TTL = 7 * 24 * 3600
+MAX_QTY = 99
+
+
+def user_cart_key(user):
+    return f'u{user.pk}'
+
+
+def cart_key(request):
+    if request.user.is_authenticated:
+        return user_cart_key(request.user)
+    key = request.session.get(SESSION_KEY)
+    if key is None:
+        key = request.session[SESSION_KEY] = secrets.token_urlsafe(12)
+    return key
+
+
+class Cart:
+    def __init__(self, key, user=None, lines=None):
+        self.key = key
+        self.user = user
+        self.lines = lines or {}  # {product_id: (qty, unit_price_mwk, name)}
+
+    @classmethod
+    def for_request(cls, request, fresh=False):
+        user = request.user if request.user.is_authenticated else None
+        return cls.load(cart_key(request), user, fresh)
+
+    @classmethod
+    def load(cls, key, user=None, fresh=False):
+        rows = None if fresh and user is not None else cache.get(cls._cache_key(key))
+        if rows is None and user is not None:
+            rows = SavedCart.objects.filter(user=user).values_list('lines', flat=True).first() or []
+            cache.set(cls._cache_key(key), rows, CART_TTL)
+        return cls(key, user, {pid: (qty, price, name) for pid, qty, price, name in rows or []})
+
+    @staticmethod
+    def _cache_key(key):
+        return f'cart:{key}'
+
+    def save(self):
+        rows = [[pid, qty, price, name] for pid, (qty, price, name) in self.lines.items()]
+        cache.set(self._cache_key(self.key), rows, CART_TTL)
+        if self.user is not None:
+            SavedCart.objects.update_or_create(user=self.user, defaults={'lines': rows})
+
+    def quantity(self, product_id):
+        return self.lines.get(product_id, (0,))[0]
+
+    def apply(self, changes):
+        # changes: {product_id: new total qty}, 0 removes. One hold transaction and one cart
+        # write for the whole batch; returns the per-line errors for lines left unchanged.
+        changes = {pid: min(qty, MAX_QTY) for pid, qty in changes.items()}
+        wanted = {pid: qty for pid, qty in changes.items() if qty > 0}
+        dropped = [pid for pid, qty in changes.items() if qty <= 0]
+        held, errors = place_holds(self.key, wanted)
+        for p in held:
+            self.lines[p.pk] = (wanted[p.pk], p.price_mwk, p.name)
+        missing = set(wanted) - {p.pk for p in held} - {e.product.pk for e in errors}
+        if missing:
+            errors.append(CheckoutError('One of the products is no longer available.'))
+        if dropped:
+            release(self.key, dropped)
+            for pid in dropped:
+                self.lines.pop(pid, None)
+        self.save()
+        return errors
+
+    def add(self, product_id, qty):
+        return self.apply({product_id: self.quantity(product_id) + qty})
+
+    def refresh(self, products):
+        # re-snapshot from current rows (e.g. after checkout.CartChanged); drops deleted products
+        gone = [pid for pid in self.lines if pid not in products]
+        for pid, (qty, _, _) in list(self.lines.items()):
+            if pid in products:
+                self.lines[pid] = (qty, products[pid].price_mwk, products[pid].name)
+        if gone:
+            release(self.key, gone)
+            for pid in gone:
+                del self.lines[pid]
+        self.save()
+
+    def clear(self):
+        self.lines = {}
+        self.save()
+
+    def items(self):
+        return [(pid, qty, price) for pid, (qty, price, _) in self.lines.items()]
+
+    def display_lines(self):
+        return [{'product_id': pid, 'name': name, 'qty': qty, 'unit_price': price, 'line_total': qty * price}
+                for pid, (qty, price, name) in self.lines.items()]
+
+    @property
+    def total(self):
+        return sum(qty * price for qty, price, _ in self.lines.values())
+
+    def __len__(self):
+        return len(self.lines)
+
+
+@receiver(user_logged_in)
+def merge_on_login(sender, request, user, **kwargs):
+    session = getattr(request, 'session', None)
+    anon_key = session.pop(SESSION_KEY, None) if session is not None else None
+    if not anon_key:
+        return
+    anon = Cart.load(anon_key)
+    cache.delete(Cart._cache_key(anon_key))
+    if not anon.lines:
+        return
+    release(anon_key)  # free the anonymous holds first so they don't count against the merge
+    cart = Cart.load(user_cart_key(user), user, fresh=True)
+    cart.apply({pid: cart.quantity(pid) + qty for pid, (qty, _, _) in anon.lines.items()})
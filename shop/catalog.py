@@ -0,0 +1,162 @@
+# shop/catalog.py - keyset pagination and batched image loading for product listings
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.core.cache import cache
+from django.db.models import OuterRef, Prefetch, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import Product, ProductImage, StockHold
+
+PRODUCT_COUNT_KEY = 'catalog:product_count'
+PRODUCT_COUNT_TTL = 300  # seconds; the catalog total is shown as an approximate figure
+
+
+def product_count():
+    return cache.get_or_set(PRODUCT_COUNT_KEY, Product.objects.count, PRODUCT_COUNT_TTL)
+
+
+async def aproduct_count():
+    count = await cache.aget(PRODUCT_COUNT_KEY)
+    if count is None:
+        count = await Product.objects.acount()
+        await cache.aset(PRODUCT_COUNT_KEY, count, PRODUCT_COUNT_TTL)
+    return count
+
+
+def with_primary_image(qs):
+    # one IN (...) query for the images of every product on the page; read via Product.primary_image
+    return qs.prefetch_related(
+        Prefetch('images', queryset=ProductImage.objects.order_by('id'), to_attr='image_list')
+    )
+
+
+def held_quantity(exclude_cart=None):
+    # correlated SUM of active holds over the (product, expires_at, quantity) index
+    holds = StockHold.objects.active().filter(product=OuterRef('pk'))
+    if exclude_cart is not None:
+        holds = holds.exclude(cart_key=exclude_cart)
+    total = holds.order_by().values('product').annotate(n=Sum('quantity')).values('n')
+    return Coalesce(Subquery(total), Value(0))
+
+
+def with_availability(qs):
+    # read via Product.available_quantity
+    return qs.annotate(held_quantity=held_quantity())
+
+
+def _cursor(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def _pk(row):
+    # model instances, or values() dicts, which must include id
+    return row['id'] if isinstance(row, dict) else row.pk
+
+
+class KeysetPage:
+    # Page of a queryset ordered by -id. `after` walks towards older rows, `before` towards newer
+    # ones, so every page is an index range scan on the primary key with no OFFSET and no COUNT.
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    @property
+    def next_cursor(self):
+        return _pk(self.object_list[-1]) if self.has_next else None
+
+    @property
+    def previous_cursor(self):
+        return _pk(self.object_list[0]) if self.has_previous else None
+
+
+def _keyset_query(qs, params, per_page):
+    after, before = _cursor(params.get('after')), _cursor(params.get('before'))
+    if before is not None:
+        return qs.filter(pk__gt=before).order_by('pk')[:per_page + 1], after, before
+    if after is not None:
+        qs = qs.filter(pk__lt=after)
+    return qs.order_by('-pk')[:per_page + 1], after, before
+
+
+def _keyset_result(rows, per_page, after, before):
+    if before is not None:
+        return KeysetPage(rows[:per_page][::-1], has_next=True, has_previous=len(rows) > per_page)
+    return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_previous=after is not None)
+
+
+def keyset_page(qs, params, per_page):
+    qs, after, before = _keyset_query(qs, params, per_page)
+    return _keyset_result(list(qs), per_page, after, before)
+
+
+async def akeyset_page(qs, params, per_page):
+    qs, after, before = _keyset_query(qs, params, per_page)
+    return _keyset_result([row async for row in qs], per_page, after, before)
+
+
+# (field, id) keysets, for listings not ordered by id alone: orders newest first by created_at (ids
+# don't follow it for backdated or imported rows), products by price. Cursors are "<value>.<id>"
+# with the value written as an integer (datetimes as microseconds since the epoch).
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _pair_cursor(value, decode):
+    try:
+        key, pk = (int(part) for part in value.split('.'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return decode(key), pk
+
+
+class PairKeysetPage(KeysetPage):
+    def __init__(self, object_list, has_next, has_previous, field, encode):
+        super().__init__(object_list, has_next, has_previous)
+        self._cursor = lambda row: f'{encode(getattr(row, field))}.{row.pk}'
+
+    @property
+    def next_cursor(self):
+        return self._cursor(self.object_list[-1]) if self.has_next else None
+
+    @property
+    def previous_cursor(self):
+        return self._cursor(self.object_list[0]) if self.has_previous else None
+
+
+def pair_keyset_page(qs, params, per_page, field, descending=True, encode=int, decode=int):
+    # like keyset_page, over an index ending in (field, id); `after` walks in listing order
+    after, before = _pair_cursor(params.get('after'), decode), _pair_cursor(params.get('before'), decode)
+    ahead, behind = ('lt', 'gt') if descending else ('gt', 'lt')
+    order = (f'-{field}', '-pk') if descending else (field, 'pk')
+    reverse = (field, 'pk') if descending else (f'-{field}', '-pk')
+
+    def past(cursor, op):
+        value, pk = cursor
+        return Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'pk__{op}': pk})
+
+    if before is not None:
+        rows = list(qs.filter(past(before, behind)).order_by(*reverse)[:per_page + 1])
+        return PairKeysetPage(rows[:per_page][::-1], True, len(rows) > per_page, field, encode)
+    if after is not None:
+        qs = qs.filter(past(after, ahead))
+    rows = list(qs.order_by(*order)[:per_page + 1])
+    return PairKeysetPage(rows[:per_page], len(rows) > per_page, after is not None, field, encode)
+
+
+def dated_keyset_page(qs, params, per_page):
+    return pair_keyset_page(qs, params, per_page, 'created_at', encode=lambda at: (at - EPOCH) // timedelta(microseconds=1),
+                            decode=lambda micros: EPOCH + timedelta(microseconds=micros))
@@ -0,0 +1,81 @@
+# shop/categories.py - category browse pages
+# CategoryCount holds the number of products (and of products in stock) per category. On SQLite,
+# triggers on shop_product keep it current through every insert, delete and category or stock
+# change, including bulk_create/update() and admin edits, so the category navigation reads one row
+# per category instead of running GROUP BY over the catalog. Stock updates only touch it when a
+# product runs out or comes back. Other backends count with GROUP BY and cache it for NAV_TTL.
+# Listings page with keysets over the (category, -id) and (category, price_mwk) indexes.
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Q
+from . import triggers
+from .catalog import keyset_page, pair_keyset_page, with_availability
+from .models import CategoryCount, Product
+
+COUNT_TABLE = CategoryCount._meta.db_table
+NAV_KEY = 'categories:nav'
+NAV_TTL = 300
+PER_PAGE = 24
+SORTS = {'newest': 'Newest', 'price': 'Price: low to high', '-price': 'Price: high to low'}
+
+_ADD = f"""INSERT INTO {COUNT_TABLE}(name, products, in_stock) VALUES (new.category, 1, new.stock_quantity > 0)
+        ON CONFLICT(name) DO UPDATE SET products = products + 1, in_stock = in_stock + excluded.in_stock;"""
+_REMOVE = f"""UPDATE {COUNT_TABLE} SET products = products - 1, in_stock = in_stock - (old.stock_quantity > 0)
+        WHERE name = old.category;
+        DELETE FROM {COUNT_TABLE} WHERE name = old.category AND products <= 0;"""
+
+TRIGGER_SQL = [
+    f"""CREATE TRIGGER IF NOT EXISTS {COUNT_TABLE}_ai AFTER INSERT ON shop_product BEGIN
+        {_ADD}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {COUNT_TABLE}_ad AFTER DELETE ON shop_product BEGIN
+        {_REMOVE}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {COUNT_TABLE}_au AFTER UPDATE ON shop_product
+    WHEN old.category IS NOT new.category OR (old.stock_quantity > 0) IS NOT (new.stock_quantity > 0)
+    BEGIN
+        {_REMOVE}
+        {_ADD}
+    END""",
+]
+
+
+def uses_triggers(conn=connection):
+    return conn.vendor == 'sqlite'
+
+
+def install_triggers(conn=connection):
+    triggers.install(conn, COUNT_TABLE, TRIGGER_SQL)
+
+
+def rebuild(conn=connection):
+    with conn.cursor() as cur:
+        cur.execute(f'DELETE FROM {COUNT_TABLE}')
+        cur.execute(f"""INSERT INTO {COUNT_TABLE}(name, products, in_stock)
+            SELECT category, COUNT(*), SUM(CASE WHEN stock_quantity > 0 THEN 1 ELSE 0 END)
+            FROM shop_product GROUP BY category""")
+
+
+def nav():
+    # [(category, products, in_stock)] by name
+    if uses_triggers():
+        return list(CategoryCount.objects.filter(products__gt=0).order_by('name')
+                    .values_list('name', 'products', 'in_stock'))
+    return cache.get_or_set(NAV_KEY, lambda: list(
+        Product.objects.values_list('category').annotate(n=Count('id'), s=Count('id', filter=Q(stock_quantity__gt=0)))
+        .order_by('category')), NAV_TTL)
+
+
+def browse(category, filters, params, per_page=PER_PAGE):
+    # filters: cleaned CategoryFilterForm data; params carries the after/before cursor
+    qs = with_availability(Product.objects.filter(category=category))
+    if filters.get('min_price') is not None:
+        qs = qs.filter(price_mwk__gte=filters['min_price'])
+    if filters.get('max_price') is not None:
+        qs = qs.filter(price_mwk__lte=filters['max_price'])
+    if filters.get('in_stock'):
+        qs = qs.filter(stock_quantity__gt=0)
+    sort = filters.get('sort') or 'newest'
+    if sort == 'newest':
+        return keyset_page(qs, params, per_page)
+    return pair_keyset_page(qs, params, per_page, 'price_mwk', descending=sort == '-price')
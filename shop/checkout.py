@@ -0,0 +1,101 @@
+# shop/checkout.py - order placement
+# This is the only place product rows are locked. Cart prices are snapshots (see cart.Cart), so
+# the locked rows are compared with them first and any drift aborts the order. Every stock
+# decrement is a single conditional UPDATE (stock_quantity >= qty), so a short line aborts the
+# whole order instead of clamping stock at zero, and the order lines and per-vendor sub-orders
+# go in with one bulk INSERT each.
+# Units held by other carts (see reservations) are not sellable; the buyer's own holds are
+# consumed by the order. Wallet orders are debited in the same transaction, and the admin counters
+# (unpaid COD orders, low-stock products) move with it.
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from . import counters
+from .catalog import held_quantity
+from .rollups import after_commit, record_orders, record_payments
+from .models import Product, Order, OrderItem, Payment, StockHold, VendorOrder, WalletEntry
+from .wallet import InsufficientFunds, get_wallet, post_entry
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    def __init__(self):
+        super().__init__('Your cart is empty.')
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, product):
+        self.product = product
+        super().__init__(f'Sorry, there is not enough stock left for {product.name}.')
+
+
+class CartChanged(CheckoutError):
+    def __init__(self, products):
+        self.products = products  # current rows by id; ids missing here were deleted
+        super().__init__('Some items in your cart changed since you added them. Please review your order.')
+
+
+def place_order(customer, items, shipping_address, payment_method, cart_key=None):
+    # items: [(product_id, qty, unit_price_mwk)] with the prices the customer was shown
+    items = sorted(item for item in items if item[1] > 0)
+    if not items:
+        raise EmptyCart()
+    with transaction.atomic():
+        # id order keeps the lock order stable between concurrent orders
+        products = {p.pk: p for p in Product.objects.select_for_update().filter(
+            pk__in=[pid for pid, _, _ in items]).order_by('pk')}
+        if any(pid not in products or products[pid].price_mwk != price for pid, _, price in items):
+            raise CartChanged(products)
+        lines = [(products[pid], qty) for pid, qty, _ in items]
+        total = sum(p.price_mwk * qty for p, qty in lines)
+        now = timezone.now()  # stock changes move updated_at, which the page ETags cover (see conditional)
+        for p, qty in lines:
+            updated = Product.objects.filter(
+                pk=p.pk, stock_quantity__gte=held_quantity(exclude_cart=cart_key) + qty,
+            ).update(stock_quantity=F('stock_quantity') - qty, updated_at=now)
+            if not updated:
+                raise OutOfStock(p)
+        # the rows are locked, so their stock_quantity is the level each decrement started from
+        counters.bump(counters.LOW_STOCK_PRODUCTS, sum(counters.low_stock_change(p.stock_quantity, p.stock_quantity - qty)
+                                                       for p, qty in lines))
+        paid = payment_method == 'wallet'
+        order = Order.objects.create(
+            customer=customer,
+            shipping_address=shipping_address,
+            payment_method=payment_method,
+            payment_status='paid' if paid else 'pending',
+            total_amount_mwk=total,
+            line_count=len(lines),
+            item_count=sum(qty for _, qty in lines),
+        )
+        if paid:
+            try:
+                post_entry(get_wallet(customer).pk, -total, WalletEntry.ORDER, order=order)
+            except InsufficientFunds:
+                raise CheckoutError('Your wallet balance is too low for this order.')
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=p, quantity=qty, unit_price_mwk=p.price_mwk) for p, qty in lines
+        ])
+        subtotals = {}
+        for p, qty in lines:
+            subtotals[p.vendor_id] = subtotals.get(p.vendor_id, 0) + p.price_mwk * qty
+        VendorOrder.objects.bulk_create([
+            VendorOrder(order=order, vendor_id=vendor_id, subtotal_mwk=subtotal, status='paid' if paid else 'pending')
+            for vendor_id, subtotal in subtotals.items()
+        ])
+        if paid:
+            Payment.objects.create(order=order, provider='wallet', amount_mwk=total, status='success')
+        elif payment_method == 'cod':
+            Payment.objects.create(order=order, provider='cod', amount_mwk=total, status='pending')
+            counters.bump(counters.UNPAID_COD)
+        else:
+            Payment.objects.create(order=order, provider='manual', amount_mwk=total, status='initiated')
+        if cart_key is not None:
+            StockHold.objects.filter(cart_key=cart_key, product_id__in=[p.pk for p, _ in lines]).delete()
+        after_commit(record_orders, [order.pk])
+        if paid:
+            after_commit(record_payments, [order.pk])
+    return order
@@ -0,0 +1,59 @@
+# shop/conditional.py - ETags for catalog and product pages
+# The ETag is computed from the same rows the page renders (fetched once per request and reused
+# by the view), so a 304 costs one indexed query and no template work. Besides the products'
+# updated_at it covers what else the HTML depends on: available quantities (stock and holds move
+# without a Product save), the viewer, and the CSRF cookie the page's forms are tied to. No
+# Last-Modified is sent: no single timestamp moves with all of that, and a client sending only
+# If-Modified-Since would keep a page with stale availability. Requests with queued flash
+# messages always get a full page.
+import hashlib
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
+
+
+def _etag(request, products):
+    if not hasattr(request, '_etag'):
+        if len(get_messages(request)):
+            request._etag = None
+        else:
+            user = request.user
+            state = (
+                user.pk, getattr(user, 'role', ''), user.is_staff, request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+                [(p.pk, p.updated_at.isoformat(), p.available_quantity) for p in products],
+            )
+            request._etag = hashlib.sha256(repr(state).encode()).hexdigest()[:32]
+    return request._etag
+
+
+def conditional_products(get_products):
+    # get_products(request, *args, **kwargs) returns the products the view will render and must
+    # memoise them on the request so the view reuses the same rows
+    def etag(request, *args, **kwargs):
+        return _etag(request, get_products(request, *args, **kwargs))
+
+    def decorator(view):
+        # no-cache: always revalidate; shared caches may still store the page per Vary: Cookie
+        return cache_control(no_cache=True)(vary_on_cookie(condition(etag_func=etag)(view)))
+    return decorator
+
+
+def precondition(request, products):
+    # the same check for views that load their rows themselves (the async views, which can't
+    # hand the decorator a sync loader): returns the 304 response or None, plus the ETag to pass
+    # to stamp() along with whichever response is returned
+    etag = _etag(request, products)
+    etag = etag and quote_etag(etag)
+    return get_conditional_response(request, etag=etag), etag
+
+
+def stamp(response, etag):
+    if etag:
+        response.headers.setdefault('ETag', etag)
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
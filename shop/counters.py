@@ -0,0 +1,50 @@
+# shop/counters.py - maintained totals for the admin dashboard
+# Each counter is a Counter row moved by the write that changes what it counts, in that write's
+# transaction (bump: one INSERT ... ON CONFLICT DO UPDATE SET value = value + delta), so the
+# dashboard reads every total with one query instead of counting tables. SOURCES defines what each
+# counter counts and doubles as its drill-down list. recount() rebuilds the rows from the tables;
+# it runs as a periodic job to absorb writes made outside the instrumented paths (Django admin,
+# shell, scripts).
+from django.conf import settings
+from django.db import transaction
+from .bulk import insert_or_add
+from .models import Counter, ManualPayment, Order, Product, User
+
+LOW_STOCK = getattr(settings, 'LOW_STOCK_THRESHOLD', 5)  # units at or below which a product is low
+PENDING_VENDORS, SUBMITTED_RECEIPTS, UNPAID_COD, LOW_STOCK_PRODUCTS = (
+    'pending_vendors', 'submitted_receipts', 'unpaid_cod', 'low_stock')
+
+SOURCES = {
+    PENDING_VENDORS: lambda: User.objects.filter(role=User.VENDOR, vendor_approved=False),
+    SUBMITTED_RECEIPTS: lambda: ManualPayment.objects.filter(status='submitted'),
+    UNPAID_COD: lambda: Order.objects.filter(payment_method='cod').exclude(payment_status='paid'),
+    LOW_STOCK_PRODUCTS: lambda: Product.objects.filter(stock_quantity__lte=LOW_STOCK),
+}
+
+
+def bump(name, delta=1):
+    if delta:
+        insert_or_add(Counter, ('name', 'value'), ('name',), ('value',), [(name, delta)])
+
+
+def _low(stock):
+    return stock is not None and stock <= LOW_STOCK
+
+
+def low_stock_change(before=None, after=None):
+    # +1 when a product's stock enters the low band, -1 when it leaves it;
+    # None is a product that didn't exist before or doesn't after
+    return _low(after) - _low(before)
+
+
+def read():
+    totals = dict.fromkeys(SOURCES, 0)
+    totals.update(Counter.objects.filter(name__in=SOURCES).values_list('name', 'value'))
+    return totals
+
+
+def recount():
+    # SQLite runs this IMMEDIATE, so no bump lands between a count and its write
+    with transaction.atomic():
+        for name, rows in SOURCES.items():
+            Counter.objects.update_or_create(name=name, defaults={'value': rows().count()})
@@ -0,0 +1,93 @@
+# shop/finance.py - streamed order/payment exports for reconciliation
+# Each export walks its table by primary key in CHUNK-row slices inside the date range, reading
+# plain values() rows (no model instances); order lines are fetched for a whole slice of orders
+# with one IN query. Nothing is held beyond one slice, so memory is flat for any range. Line and
+# unit counts are Order's own columns. CSV text cells that a spreadsheet would run as formulas
+# (product names, payer names) are quoted.
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from .models import ManualPayment, Order, OrderItem, Payment
+from .streaming import chunked, csv_lines, jsonl_lines
+
+CHUNK = 2000
+
+ORDER_COLUMNS = ['id', 'created_at', 'customer_id', 'customer__username', 'total_amount_mwk', 'payment_method',
+                 'payment_status', 'delivery_status', 'line_count', 'item_count']
+ITEM_COLUMNS = ['order_id', 'order__created_at', 'id', 'product_id', 'product__name', 'product__vendor_id',
+                'quantity', 'unit_price_mwk', 'line_total_mwk']
+PAYMENT_COLUMNS = ['id', 'created_at', 'order_id', 'provider', 'amount_mwk', 'status', 'order__payment_method']
+MANUAL_COLUMNS = ['id', 'created_at', 'order_id', 'order__total_amount_mwk', 'wallet_id', 'amount_mwk', 'payer_name',
+                  'msisdn', 'method', 'reference_code', 'status', 'reviewed_by__username', 'reviewed_at']
+KINDS = ['orders', 'items', 'payments', 'manual']
+
+
+def day_range(start, end):
+    # inclusive local dates -> [start 00:00, day after end 00:00)
+    return (timezone.make_aware(datetime.combine(start, time.min)),
+            timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+
+
+def _slices(qs, columns):
+    last = 0
+    while True:
+        rows = list(qs.filter(id__gt=last).order_by('id').values(*columns)[:CHUNK])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]['id']
+
+
+def _items_by_order(order_ids):
+    items = {}
+    for item in OrderItem.objects.filter(order_id__in=order_ids).order_by('order_id', 'id').values(
+            'order_id', 'id', 'product_id', 'product__name', 'product__vendor_id', 'quantity', 'unit_price_mwk'):
+        item['line_total_mwk'] = item['quantity'] * item['unit_price_mwk']
+        items.setdefault(item['order_id'], []).append(item)
+    return items
+
+
+def _order_slices(start, end):
+    return _slices(Order.objects.filter(created_at__gte=start, created_at__lt=end), ORDER_COLUMNS)
+
+
+def order_rows(start, end, with_items=False):
+    for rows in _order_slices(start, end):
+        if with_items:
+            items = _items_by_order([r['id'] for r in rows])
+            for row in rows:
+                row['items'] = [{k: v for k, v in line.items() if k != 'order_id'} for line in items.get(row['id'], [])]
+        yield from rows
+
+
+def item_rows(start, end):
+    # driven by the order slices, so the date range is resolved on Order's created_at index
+    for rows in _order_slices(start, end):
+        items = _items_by_order([r['id'] for r in rows])
+        for row in rows:
+            for item in items.get(row['id'], []):
+                yield dict(item, order__created_at=row['created_at'])
+
+
+def payment_rows(start, end):
+    for rows in _slices(Payment.objects.filter(created_at__gte=start, created_at__lt=end), PAYMENT_COLUMNS):
+        yield from rows
+
+
+def manual_rows(start, end):
+    for rows in _slices(ManualPayment.objects.filter(created_at__gte=start, created_at__lt=end), MANUAL_COLUMNS):
+        yield from rows
+
+
+def export_lines(kind, start, end, fmt):
+    # JSONL orders carry their lines inline; CSV stays flat (use the items export for lines)
+    start, end = day_range(start, end)
+    if kind == 'orders':
+        rows, columns = order_rows(start, end, with_items=fmt == 'jsonl'), ORDER_COLUMNS
+    else:
+        rows, columns = {
+            'items': (item_rows, ITEM_COLUMNS),
+            'payments': (payment_rows, PAYMENT_COLUMNS),
+            'manual': (manual_rows, MANUAL_COLUMNS),
+        }[kind]
+        rows = rows(start, end)
+    return chunked(jsonl_lines(rows) if fmt == 'jsonl' else csv_lines(columns, rows, formula_safe=True))
@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm
+from .categories import SORTS
 from .models import ManualPayment
 
 User = get_user_model()
@@ -22,11 +23,56 @@ class VendorSignUpForm(UserCreationForm):
         model = User
         fields = ('username','email','phone_number','address')
 
+class CartAddForm(forms.Form):
+    product_id = forms.IntegerField(min_value=1)
+    qty = forms.IntegerField(min_value=1, max_value=99, initial=1)
+
 class CheckoutForm(forms.Form):
     shipping_address = forms.CharField(widget=forms.Textarea(attrs={'rows':3}))
-    payment_method = forms.ChoiceField(choices=[('cod','Cash on Delivery'),('manual','Manual Deposit')])
+    payment_method = forms.ChoiceField(choices=[('cod','Cash on Delivery'),('manual','Manual Deposit'),('wallet','Wallet Balance')])
     msisdn = forms.CharField(required=False, help_text='Phone number for payment reference (optional)')
 
+# a top-up is a manual payment against the wallet, credited only once a reviewer approves it
+class WalletTopUpForm(forms.ModelForm):
+    amount_mwk = forms.IntegerField(label='Amount (MWK)', min_value=100, max_value=10_000_000)
+
+    class Meta:
+        model = ManualPayment
+        fields = ['amount_mwk','payer_name','msisdn','method','reference_code','receipt_image']
+
+# one row of a vendor catalog import (see product_io); slug uniqueness is handled by the upsert
+class ProductRowForm(forms.Form):
+    slug = forms.SlugField(max_length=50)
+    name = forms.CharField(max_length=160)
+    description = forms.CharField(required=False)
+    price_mwk = forms.IntegerField(min_value=0)
+    stock_quantity = forms.IntegerField(min_value=0)
+    category = forms.CharField(max_length=80)
+    images = forms.CharField(required=False)
+
+class ProductImportForm(forms.Form):
+    file = forms.FileField(help_text='CSV with a header row, or JSONL (one product object per line)')
+
+class FinanceExportForm(forms.Form):
+    kind = forms.ChoiceField(choices=[('orders','Orders'),('items','Order items'),('payments','Payments'),('manual','Manual payments')],
+                             widget=forms.Select(attrs={'class':'form-select'}))
+    start = forms.DateField(widget=forms.DateInput(attrs={'type':'date','class':'form-control'}))
+    end = forms.DateField(widget=forms.DateInput(attrs={'type':'date','class':'form-control'}))
+    format = forms.ChoiceField(choices=[('csv','CSV'),('jsonl','JSONL')], widget=forms.Select(attrs={'class':'form-select'}))
+
+    def clean(self):
+        data = super().clean()
+        if data.get('start') and data.get('end') and data['start'] > data['end']:
+            raise forms.ValidationError('Start date must be on or before the end date.')
+        return data
+
+# category page filters (see categories.browse); every field is optional
+class CategoryFilterForm(forms.Form):
+    min_price = forms.IntegerField(min_value=0, required=False, widget=forms.NumberInput(attrs={'class':'form-control','placeholder':'Min'}))
+    max_price = forms.IntegerField(min_value=0, required=False, widget=forms.NumberInput(attrs={'class':'form-control','placeholder':'Max'}))
+    in_stock = forms.BooleanField(required=False, widget=forms.CheckboxInput(attrs={'class':'form-check-input'}))
+    sort = forms.ChoiceField(choices=list(SORTS.items()), required=False, widget=forms.Select(attrs={'class':'form-select'}))
+
 class ManualPaymentForm(forms.ModelForm):
     class Meta:
         model = ManualPayment
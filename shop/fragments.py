@@ -0,0 +1,127 @@
+# shop/fragments.py - versioned cache of rendered product fragments
+# Fragment keys embed Product.fragment_version, which every save of the Product or of one of its
+# images (receivers below) and every catalog import sets to a new number in the same transaction as
+# the change. Pages already read the product rows, so the version comes with them: no cache
+# lookup, and every worker agrees on it whatever cache it runs with. Old fragments are never read
+# again and simply age out, with no cache-wide flush. Misses are rendered from rows read on the
+# primary, even under @replica_reads, so they are at least as new as the version that keys them.
+# Availability and the add-to-cart form (CSRF token) change without a product save and stay
+# outside the fragments.
+import time
+from collections import Counter
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from .catalog import with_primary_image
+from .models import Product, ProductImage
+
+FRAGMENT_TTL = 24 * 3600
+TEMPLATES = {
+    'card': 'fragments/product_card.html',
+    'gallery': 'fragments/product_gallery.html',
+    'summary': 'fragments/product_summary.html',
+}
+STATS_KEY = 'fragments:{}'
+STATS_FLUSH_EVERY = 100  # lookups counted in-process before being added to the shared totals
+_unflushed = Counter()
+
+
+def new_version():
+    # never reuses a number, even after a restore from backup
+    return time.time_ns()
+
+
+def bump(*product_ids):
+    Product.objects.filter(pk__in=product_ids).update(fragment_version=new_version())
+
+
+def _count(hits, misses):
+    _unflushed.update(hits=hits, misses=misses)
+    if sum(_unflushed.values()) >= STATS_FLUSH_EVERY:
+        for name in ('hits', 'misses'):
+            n = _unflushed.pop(name, 0)
+            if n:
+                cache.add(STATS_KEY.format(name), 0, None)
+                cache.incr(STATS_KEY.format(name), n)
+
+
+def stats():
+    hits, misses = (cache.get(STATS_KEY.format(n), 0) + _unflushed[n] for n in ('hits', 'misses'))
+    return {'hits': hits, 'misses': misses, 'ratio': hits / (hits + misses) if hits + misses else None}
+
+
+def _keys(products, kinds):
+    return {f'fragment:{kind}:{p.pk}:{p.fragment_version}': (p.pk, kind) for p in products for kind in kinds}
+
+
+def _hits(keys, cached, product_ids, kinds):
+    html = {}
+    for key, value in cached.items():
+        pid, kind = keys[key]
+        html.setdefault(pid, {})[kind] = value
+    missing = [pid for pid in product_ids if len(html.get(pid, ())) < len(kinds)]
+    _count(hits=len(product_ids) - len(missing), misses=len(missing))
+    return html, missing
+
+
+def _missing_products(product_ids):
+    # images are prefetched from the same database as the products (router instance hint)
+    return with_primary_image(Product.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=product_ids))
+
+
+def _render(products, kinds):
+    return {p.pk: {kind: render_to_string(TEMPLATES[kind], {'p': p}) for kind in kinds} for p in products}
+
+
+def _entries(keys, rendered):
+    return {key: rendered[pid][kind] for key, (pid, kind) in keys.items() if pid in rendered}
+
+
+def _safe(html):
+    return {pid: {kind: mark_safe(h) for kind, h in parts.items()} for pid, parts in html.items()}
+
+
+def fragments(products, *kinds):
+    # {product_id: {kind: html}} for the page's product rows; misses are rendered from freshly read
+    # rows, two queries in all
+    products = list(products)
+    keys = _keys(products, kinds)
+    html, missing = _hits(keys, cache.get_many(keys), [p.pk for p in products], kinds)
+    if missing:
+        rendered = _render(_missing_products(missing), kinds)
+        cache.set_many(_entries(keys, rendered), FRAGMENT_TTL)
+        html.update(rendered)
+    return _safe(html)
+
+
+async def afragments(products, *kinds):
+    # fragments() for async views: cache and rows are read without blocking the event loop
+    products = list(products)
+    keys = _keys(products, kinds)
+    html, missing = _hits(keys, await cache.aget_many(keys), [p.pk for p in products], kinds)
+    if missing:
+        products = [p async for p in _missing_products(missing)]
+        rendered = _render(products, kinds)
+        await cache.aset_many(_entries(keys, rendered), FRAGMENT_TTL)
+        html.update(rendered)
+    return _safe(html)
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, **kwargs):
+    # written by the same INSERT/UPDATE as the change itself
+    instance.fragment_version = new_version()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'fragment_version' not in update_fields:
+        bump(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def product_image_changed(sender, instance, **kwargs):
+    bump(instance.product_id)
@@ -0,0 +1,107 @@
+# shop/idempotency.py - duplicate-submit suppression for POSTs that create things
+# The client sends a key (Idempotency-Key header, or the idempotency_key field the forms render)
+# and the first request with it claims an IdempotencyKey row before doing any work. The view runs
+# outside any transaction of ours, so it keeps its own short ones (checkout's order transaction
+# holds the SQLite write lock only for the order writes, not file I/O or rendering), and its
+# response is stored in one UPDATE once it returns. A crash in between leaves a pending claim that
+# is taken over after PENDING_TIMEOUT. Replays get the stored response without running the view; a
+# duplicate arriving while the first is still running waits for it (up to WAIT). Responses that
+# don't complete the action (form errors, out of stock) release the key so the client can retry.
+# Keys expire after TTL and are deleted in batches by purge_expired() (a periodic job).
+import secrets
+import time
+from datetime import timedelta
+from functools import wraps
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from .bulk import delete_in_batches
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+FIELD = 'idempotency_key'
+TTL = timedelta(hours=24)
+PENDING_TIMEOUT = timedelta(minutes=2)  # a claim this old with no response was left by a crashed request
+WAIT = 5  # seconds a duplicate waits for the first request to finish
+POLL = 0.1
+PURGE_BATCH = 1000
+
+
+def new_key():
+    return secrets.token_urlsafe(16)
+
+
+def _completed(response):
+    # the success responses of the wrapped views: a redirect to the result, or 201 Created
+    return response.status_code == 201 or 300 <= response.status_code < 400
+
+
+def _claim(user, key, path, seen):
+    # the row if we now own the key, else None. seen is the row as just read, if there was one
+    now = timezone.now()
+    if seen is None:
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(user=user, key=key, path=path, created_at=now, expires_at=now + TTL)
+        except IntegrityError:
+            return None
+    abandoned = seen.status_code is None and seen.created_at < now - PENDING_TIMEOUT
+    if not (abandoned or seen.expires_at < now):
+        return None
+    # conditional on the row we saw, so only one of several duplicates takes it over
+    takeover = IdempotencyKey.objects.filter(pk=seen.pk, created_at=seen.created_at)
+    if takeover.update(path=path, status_code=None, location='', content_type='', body='', created_at=now,
+                       expires_at=now + TTL):
+        return IdempotencyKey.objects.get(pk=seen.pk)
+    return None
+
+
+def _replay(record):
+    response = HttpResponse(record.body, status=record.status_code, content_type=record.content_type or None)
+    if record.location:
+        response['Location'] = record.location
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER) or request.POST.get(FIELD)
+        if request.method != 'POST' or not key or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        key = key[:64]
+        deadline = time.monotonic() + WAIT
+        while True:
+            seen = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            live = seen is not None and seen.expires_at >= timezone.now()
+            if live and seen.path != request.path:
+                return HttpResponse('This idempotency key was used for a different request.', status=422)
+            if live and seen.status_code is not None:
+                return _replay(seen)
+            record = _claim(request.user, key, request.path, seen)
+            if record is not None:
+                break
+            if time.monotonic() >= deadline:
+                return HttpResponse('A request with this idempotency key is still being processed.', status=409)
+            time.sleep(POLL)  # the first request is still running
+
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            record.delete()
+            raise
+        if not _completed(response):
+            record.delete()
+            return response
+        with transaction.atomic():
+            IdempotencyKey.objects.filter(pk=record.pk).update(
+                status_code=response.status_code, location=response.get('Location', ''),
+                content_type=response.get('Content-Type', '') if response.content else '',
+                body=response.content.decode(response.charset, 'replace'))
+        return response
+    return wrapper
+
+
+def purge_expired(batch_size=PURGE_BATCH):
+    return delete_in_batches(IdempotencyKey.objects.filter(expires_at__lt=timezone.now()), batch_size)
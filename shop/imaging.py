@@ -0,0 +1,72 @@
+# shop/imaging.py - image recompression + the local background worker pool
+# Uploads are stored as-is inside the request; resizing/recompressing happens afterwards on a
+# small thread pool (Pillow releases the GIL while decoding/encoding), started only once the
+# upload's transaction has committed so the worker always sees the row.
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+WORKERS = getattr(settings, 'IMAGE_WORKERS', 2)  # 0 runs jobs inline on commit
+_pool = None
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='imaging')
+    return _pool
+
+
+def run_job(func, *args):
+    # pool threads hold their own DB connections; recycle them like a request would
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('image job %s%r failed', func.__name__, args)
+    finally:
+        close_old_connections()
+
+
+def submit_on_commit(func, *args):
+    if WORKERS:
+        transaction.on_commit(lambda: _executor().submit(run_job, func, *args))
+    else:
+        transaction.on_commit(partial(run_job, func, *args))
+
+
+def sha256(field_file):
+    h = hashlib.sha256()
+    with field_file.open('rb') as f:
+        for chunk in f.chunks():
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load(field_file):
+    with field_file.open('rb') as f:
+        img = Image.open(f)
+        img.load()
+    img = ImageOps.exif_transpose(img)  # phone photos are often stored sideways + an EXIF flag
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
+
+def jpeg(img, max_px, quality=80):
+    img = img.copy()
+    img.thumbnail((max_px, max_px), Image.LANCZOS)  # only ever shrinks
+    buf = BytesIO()
+    img.save(buf, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return ContentFile(buf.getvalue())
+
+
+def derived_name(name, suffix=''):
+    return f'{os.path.splitext(name)[0]}{suffix}.jpg'
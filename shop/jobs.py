@@ -0,0 +1,164 @@
+# shop/jobs.py - durable background jobs, stored in the database
+# enqueue() inserts a Job row in the caller's transaction, so a job exists exactly when the write
+# that asked for it committed. `manage.py runworker` claims due jobs in batches (one UPDATE per
+# batch, under a lease), runs each batch on a thread and records the outcome; failures go back
+# to the queue with exponential backoff until max_attempts. JOB_QUEUES caps how many batches of a
+# queue run at once across all workers and how many jobs a batch takes. Functions marked @batched
+# get the whole batch in one call (send_mail_batch: many messages, one SMTP connection).
+# A worker that dies leaves its jobs leased until locked_until and they are then claimed again,
+# so job functions must be safe to run twice.
+import logging
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+from itertools import count, groupby
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .bulk import delete_in_batches
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+QUEUES = getattr(settings, 'JOB_QUEUES', {'default': {'concurrency': 4, 'batch': 10}})
+LEASE = timedelta(minutes=5)
+BACKOFF_BASE = 10  # seconds before the first retry; doubles per attempt
+BACKOFF_MAX = 3600
+KEEP_FINISHED = timedelta(days=7)
+PURGE_BATCH = 1000
+# housekeeping the workers schedule themselves: {job name: seconds between runs}
+PERIODIC = {
+    'shop.sessions.purge_expired': 600,
+    'shop.idempotency.purge_expired': 600,
+    'shop.reservations.sweep_expired': 300,
+    'shop.jobs.purge_finished': 3600,
+    'shop.counters.recount': 3600,
+}
+_tokens = count(1)
+
+
+def job_name(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, *args, queue='default', delay=0, max_attempts=5):
+    # args must be JSON-serialisable; pass ids, not model instances
+    return Job.objects.create(queue=queue, name=job_name(func), args=list(args), max_attempts=max_attempts,
+                              run_at=timezone.now() + timedelta(seconds=delay))
+
+
+def batched(func):
+    # the worker calls func([args, ...]) once for all claimed jobs of this function
+    func.batched = True
+    return func
+
+
+def _due(queue, now):
+    # queued, or running under a lease that ran out (its worker died)
+    return Job.objects.filter(queue=queue, run_at__lte=now).filter(
+        Q(status=Job.QUEUED) | Q(status=Job.RUNNING, locked_until__lt=now))
+
+
+def claim(queue, worker):
+    # one batch for this worker, or [] if the queue is at its concurrency limit or has nothing due.
+    # SQLite runs this transaction IMMEDIATE, so counting and claiming can't interleave between workers.
+    limits = QUEUES[queue]
+    now = timezone.now()
+    token = f'{worker}:{next(_tokens)}'
+    with transaction.atomic():
+        running = (Job.objects.filter(queue=queue, status=Job.RUNNING, locked_until__gte=now)
+                   .values('locked_by').distinct().count())
+        if running >= limits.get('concurrency', 1):
+            return []
+        ids = list(_due(queue, now).order_by('run_at', 'id').values_list('id', flat=True)[:limits.get('batch', 1)])
+        _due(queue, now).filter(id__in=ids).update(
+            status=Job.RUNNING, locked_by=token, locked_until=now + LEASE, attempts=F('attempts') + 1)
+    return list(Job.objects.filter(locked_by=token, status=Job.RUNNING).order_by('name', 'id'))
+
+
+def _backoff(attempts):
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+
+def _failed(job, error):
+    now = timezone.now()
+    mine = Job.objects.filter(pk=job.pk, locked_by=job.locked_by, status=Job.RUNNING)
+    if job.attempts >= job.max_attempts:
+        logger.error('job %s %s failed for good after %d attempts', job.pk, job.name, job.attempts)
+        mine.update(status=Job.FAILED, last_error=error, finished_at=now, locked_until=None)
+    else:
+        logger.warning('job %s %s failed (attempt %d), retrying', job.pk, job.name, job.attempts)
+        mine.update(status=Job.QUEUED, last_error=error, locked_until=None,
+                    run_at=now + timedelta(seconds=_backoff(job.attempts)))
+
+
+def run_batch(jobs):
+    # runs in a worker thread; each job succeeds or fails on its own, except that a @batched
+    # function succeeds or fails for its whole group
+    close_old_connections()
+    try:
+        done = []
+        for name, group in groupby(jobs, key=lambda job: job.name):
+            group = list(group)
+            try:
+                func = import_string(name)
+            except ImportError:
+                for job in group:
+                    _failed(job, traceback.format_exc())
+                continue
+            if getattr(func, 'batched', False):
+                calls = [(group, lambda: func([job.args for job in group]))]
+            else:
+                calls = [([job], lambda job=job: func(*job.args)) for job in group]
+            for batch, call in calls:
+                try:
+                    call()
+                except Exception:
+                    for job in batch:
+                        _failed(job, traceback.format_exc())
+                else:
+                    done += batch
+        if done:
+            Job.objects.filter(pk__in=[job.pk for job in done], status=Job.RUNNING).filter(
+                locked_by=jobs[0].locked_by).update(status=Job.DONE, finished_at=timezone.now(), locked_until=None)
+    finally:
+        close_old_connections()
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def schedule_periodic():
+    # (re)queues each PERIODIC job that isn't already waiting, due one interval after its last run
+    waiting = set(Job.objects.filter(name__in=PERIODIC, status__in=[Job.QUEUED, Job.RUNNING])
+                  .values_list('name', flat=True))
+    last = dict(Job.objects.filter(name__in=PERIODIC, status=Job.DONE).values('name')
+                .annotate(at=Max('finished_at')).values_list('name', 'at'))
+    now = timezone.now()
+    Job.objects.bulk_create([
+        Job(name=name, run_at=max(now, last[name] + timedelta(seconds=every)) if last.get(name) else now, max_attempts=1)
+        for name, every in PERIODIC.items() if name not in waiting
+    ])
+
+
+def purge_finished():
+    # finished jobs are kept a week for inspection; failed ones stay until deleted by hand
+    return delete_in_batches(Job.objects.filter(status=Job.DONE, finished_at__lt=timezone.now() - KEEP_FINISHED),
+                             PURGE_BATCH)
+
+
+@batched
+def send_mail_batch(messages):
+    # [[subject, body, from_email, recipient_list], ...] over one connection
+    with get_connection() as connection:
+        connection.send_messages([EmailMessage(subject, body, from_email, to) for subject, body, from_email, to in messages])
+
+
+def queue_mail(subject, body, from_email, recipient_list):
+    return enqueue(send_mail_batch, subject, body, from_email, list(recipient_list), queue='email')
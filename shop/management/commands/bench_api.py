@@ -0,0 +1,104 @@
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from shop.models import Product
+from .loadtest import summarise
+
+PAGE = 12  # products on a home page
+
+
+def _cases(rng, ids, n):
+    # the same catalog pages as HTML and as JSON: [(name, url, params, extra headers)]
+    cases = []
+    for _ in range(n):
+        after = {'after': rng.choice(ids)}
+        batch = ','.join(str(i) for i in rng.sample(ids, PAGE))
+        cases += [
+            ('html_home', reverse('home'), after, {}),
+            ('api_products', reverse('api_products'), dict(after, limit=PAGE), {}),
+            ('api_products_gzip', reverse('api_products'), dict(after, limit=PAGE), {'Accept-Encoding': 'gzip'}),
+            ('api_products_sparse', reverse('api_products'), dict(after, limit=PAGE, fields='id,name,price_mwk'), {}),
+            ('api_batch', reverse('api_products_batch'), {'ids': batch}, {}),
+        ]
+    return cases
+
+
+def run(cases):
+    client = Client(raise_request_exception=False)
+    timings, errors = defaultdict(list), defaultdict(int)
+    sizes, products = defaultdict(int), defaultdict(int)
+    for name, url, params, headers in cases:
+        started = time.perf_counter()
+        response = client.get(url, params, headers=headers)
+        timings[name].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors[name] += 1
+            continue
+        sizes[name] += len(response.content)
+        if name == 'html_home':
+            products[name] += response.content.count(b'name="product_id"')  # one add-to-cart form per card
+        elif response.get('Content-Encoding') == 'gzip':
+            products[name] += PAGE  # not decoded; the same page as api_products
+        else:
+            products[name] += len(json.loads(response.content)['data'])
+    return (dict(timings), dict(errors)), sizes, products
+
+
+class Command(BaseCommand):
+    help = ('Fetch the same catalog pages as rendered HTML (home) and from the JSON API (full, gzipped, '
+            'sparse fields and batch lookup) in-process and report latency, time and bytes per product, '
+            'and the speedup over HTML. Read-only.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300, help='per endpoint')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='write the results as JSON (default: bench-api-<timestamp>.json)')
+        parser.add_argument('--compare', help='earlier JSON result to show per-product deltas against')
+
+    def handle(self, *args, **opts):
+        rng = random.Random(opts['seed'])
+        ids = list(Product.objects.order_by('?').values_list('id', flat=True)[:500])
+        if len(ids) < PAGE * 2:
+            raise CommandError('Needs a catalog; run manage.py seed_data first.')
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        cases = _cases(rng, ids, opts['requests'])
+        run(cases[:len(cases) // 10])  # warm the fragment cache and connections on the same pages
+        started = time.perf_counter()
+        result, sizes, products = run(cases)
+        elapsed = time.perf_counter() - started
+        endpoints = summarise([result], elapsed)
+        for name, e in endpoints.items():
+            n = products[name] or 1
+            e['products'] = products[name]
+            e['us_per_product'] = round(sum(result[0][name]) / n * 1e6, 1)
+            e['bytes_per_product'] = round(sizes[name] / n)
+        html = endpoints['html_home']['us_per_product']
+        for e in endpoints.values():
+            e['speedup'] = round(html / e['us_per_product'], 2) if e['us_per_product'] else None
+
+        report = {
+            'started_at': timezone.now().isoformat(), 'database': connection.vendor,
+            'products': Product.objects.count(), 'page': PAGE, 'endpoints': endpoints,
+        }
+        previous = {}
+        if opts['compare']:
+            with open(opts['compare']) as f:
+                previous = json.load(f)['endpoints']
+        self.stdout.write(f'{"endpoint":<22}{"reqs":>6}{"err":>5}{"p50":>9}{"p95":>9}{"us/prod":>10}{"B/prod":>8}{"vs html":>9}')
+        for name, e in endpoints.items():
+            line = (f'{name:<22}{e["requests"]:>6}{e["errors"]:>5}{e["p50_ms"]:>9}{e["p95_ms"]:>9}'
+                    f'{e["us_per_product"]:>10}{e["bytes_per_product"]:>8}{e["speedup"]:>8}x')
+            if name in previous:
+                line += f'   us/prod {e["us_per_product"] - previous[name]["us_per_product"]:+.1f}'
+            self.stdout.write(line)
+        path = opts['output'] or f'bench-api-{int(time.time())}.json'
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {path}'))
@@ -0,0 +1,195 @@
+import asyncio
+import io
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from shop.models import Product, User
+from .loadtest import summarise
+
+
+def _requests(rng, n, slugs, words):
+    # the same mix for both handlers: catalog, product, search and wallet pages
+    paths = []
+    for i in range(n):
+        kind = ('home', 'product_detail', 'search', 'wallet')[i % 4]
+        if kind == 'home':
+            paths.append((kind, reverse('home'), ''))
+        elif kind == 'product_detail':
+            paths.append((kind, reverse('product_detail', args=[rng.choice(slugs)]), ''))
+        elif kind == 'search':
+            paths.append((kind, reverse('search'), f'q={rng.choice(words)}'))
+        else:
+            paths.append((kind, reverse('wallet_detail'), ''))
+    return paths
+
+
+def _record(timings, errors, kind, started, status):
+    timings[kind].append(time.perf_counter() - started)
+    if status is None or status >= 400:
+        errors[kind] += 1
+
+
+def run_asgi(paths, concurrency, cookie, delay):
+    # one event loop, `concurrency` clients each sending its share of requests back to back
+    app = get_asgi_application()
+    timings, errors = defaultdict(list), defaultdict(int)
+
+    async def request(path, query):
+        status, done = None, asyncio.Event()
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+        sent_body = False
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                if delay:
+                    await asyncio.sleep(delay)  # a slow client only parks this coroutine
+                if not message.get('more_body'):
+                    done.set()
+
+        await app(scope, receive, send)
+        return status
+
+    async def client(share):
+        for kind, path, query in share:
+            started = time.perf_counter()
+            _record(timings, errors, kind, started, await request(path, query))
+
+    async def main():
+        await asyncio.gather(*(client(paths[i::concurrency]) for i in range(concurrency)))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    return (dict(timings), dict(errors)), time.perf_counter() - started
+
+
+def run_wsgi(paths, concurrency, cookie, delay, threads):
+    # `concurrency` client threads sharing `threads` handler threads, like a threaded WSGI server;
+    # latency includes waiting for a free handler thread
+    app = get_wsgi_application()
+    timings, errors = defaultdict(list), defaultdict(int)
+    slots = threading.BoundedSemaphore(threads)
+
+    def request(path, query):
+        status = []
+        environ = {
+            'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': 'localhost', 'HTTP_COOKIE': cookie, 'REMOTE_ADDR': '127.0.0.1',
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+        with slots:
+            body = app(environ, lambda s, headers, exc_info=None: status.append(int(s.split()[0])))
+            try:
+                for _ in body:
+                    if delay:
+                        time.sleep(delay)  # a slow client holds the handler thread
+            finally:
+                body.close()
+        return status[0] if status else None
+
+    def client(share):
+        for kind, path, query in share:
+            started = time.perf_counter()
+            _record(timings, errors, kind, started, request(path, query))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(client, [paths[i::concurrency] for i in range(concurrency)]))
+    return (dict(timings), dict(errors)), time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = ('Serve the same mix of home, product_detail, search and wallet requests in-process through the '
+            'ASGI handler (async views) and the WSGI handler (sync views on a thread pool) at several '
+            'concurrency levels and report throughput and p50/p95/p99 per endpoint. Read-only.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,8,32', help='comma-separated client counts')
+        parser.add_argument('--requests', type=int, default=400, help='per handler and concurrency level')
+        parser.add_argument('--wsgi-threads', type=int, default=4, help='handler threads on the WSGI side')
+        parser.add_argument('--client-delay', type=float, default=0, help='ms each response takes to reach the client')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='write the results as JSON (default: bench-asgi-<timestamp>.json)')
+        parser.add_argument('--compare', help='earlier JSON result to show p95 deltas against')
+
+    def handle(self, *args, **opts):
+        rng = random.Random(opts['seed'])
+        slugs = list(Product.objects.order_by('?').values_list('slug', flat=True)[:200])
+        customer = User.objects.filter(role=User.CUSTOMER, is_staff=False).first()
+        if not slugs or customer is None:
+            raise CommandError('Needs products and a customer; run manage.py seed_data first.')
+        words = [w for name in Product.objects.filter(slug__in=slugs[:50]).values_list('name', flat=True)
+                 for w in name.split()[:1] if w.isalnum()] or ['a']
+        login = Client()
+        login.force_login(customer)
+        cookie = '; '.join(f'{k}={v.value}' for k, v in login.cookies.items())
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        delay = opts['client_delay'] / 1000
+        levels = [int(c) for c in opts['concurrency'].split(',') if c.strip()]
+
+        runs = {}
+        for concurrency in levels:
+            paths = _requests(rng, opts['requests'], slugs, words)
+            for handler in ('wsgi', 'asgi'):
+                if handler == 'asgi':
+                    result, elapsed = run_asgi(paths, concurrency, cookie, delay)
+                else:
+                    result, elapsed = run_wsgi(paths, concurrency, cookie, delay, opts['wsgi_threads'])
+                runs[f'{handler}@{concurrency}'] = {
+                    'elapsed_s': round(elapsed, 2), 'rps': round(len(paths) / elapsed, 1),
+                    'endpoints': summarise([result], elapsed),
+                }
+
+        report = {
+            'started_at': timezone.now().isoformat(), 'database': connection.vendor,
+            'products': Product.objects.count(), 'wsgi_threads': opts['wsgi_threads'],
+            'client_delay_ms': opts['client_delay'], 'runs': runs,
+        }
+        previous = {}
+        if opts['compare']:
+            with open(opts['compare']) as f:
+                previous = json.load(f)['runs']
+        self.stdout.write(f'{"run":<10}{"endpoint":<16}{"reqs":>6}{"err":>5}{"rps":>8}{"p50":>9}{"p95":>9}{"p99":>9}')
+        for run, r in runs.items():
+            self.stdout.write(f'{run:<10}{"(all)":<16}{sum(e["requests"] for e in r["endpoints"].values()):>6}'
+                              f'{sum(e["errors"] for e in r["endpoints"].values()):>5}{r["rps"]:>8}')
+            for name, e in r['endpoints'].items():
+                line = (f'{"":<10}{name:<16}{e["requests"]:>6}{e["errors"]:>5}{e["rps"]:>8}'
+                        f'{e["p50_ms"]:>9}{e["p95_ms"]:>9}{e["p99_ms"]:>9}')
+                before = previous.get(run, {}).get('endpoints', {}).get(name)
+                if before:
+                    line += f'   p95 {e["p95_ms"] - before["p95_ms"]:+.2f}ms'
+                self.stdout.write(line)
+        path = opts['output'] or f'bench-asgi-{int(time.time())}.json'
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {path}'))
@@ -0,0 +1,183 @@
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from shop.checkout import OutOfStock, place_order
+from shop.models import Product, User
+from shop.routers import REPLICA, copy_database
+from .loadtest import summarise
+
+# basic: the old settings (rollback journal, no pragmas, a connection per request)
+# wal: the production profile from settings.py
+# replica: wal plus catalog/dashboard reads from a copy re-synced every --sync-every seconds
+MODES = ('basic', 'wal', 'replica')
+
+
+def _configure(mode, primary, replica):
+    # runs in each forked worker before it opens a connection; wrappers read these dicts on connect
+    default = connections.settings[DEFAULT_DB_ALIAS]
+    default['NAME'] = primary
+    if mode == 'basic':
+        default.update(OPTIONS={}, CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=False)
+    if mode == 'replica':
+        connections.settings[REPLICA] = {
+            **default, 'NAME': replica,
+            'OPTIONS': {'init_command': settings.SQLITE_PRAGMAS + ';PRAGMA query_only=ON', 'timeout': 20},
+        }
+    else:
+        connections.settings.pop(REPLICA, None)
+    connections.close_all()
+
+
+def _reader(index, vendor_id, slugs, words, deadline):
+    rng = random.Random(index)
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)  # 5xx are counted, not printed
+    shopper, vendor = Client(raise_request_exception=False), Client(raise_request_exception=False)
+    vendor.force_login(User.objects.get(pk=vendor_id))
+    timings, errors = defaultdict(list), defaultdict(int)
+
+    def hit(name, client, url, data=None):
+        started = time.perf_counter()
+        response = client.get(url, data)
+        timings[name].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors[name] += 1
+
+    while time.monotonic() < deadline:
+        hit('home', shopper, reverse('home'))
+        hit('product_detail', shopper, reverse('product_detail', args=[rng.choice(slugs)]))
+        hit('search', shopper, reverse('search'), {'q': rng.choice(words)})
+        hit('dashboard_vendor', vendor, reverse('dashboard_vendor'))
+    return dict(timings), dict(errors)
+
+
+def _writer(index, customer_id, products, deadline):
+    rng = random.Random(index)
+    customer = User.objects.get(pk=customer_id)
+    placed = rejected = failed = 0
+    while time.monotonic() < deadline:
+        pk, price = rng.choice(products)
+        try:
+            place_order(customer, [(pk, 1, price)], shipping_address='bench', payment_method='cod')
+        except OutOfStock:
+            rejected += 1
+        except OperationalError:  # database is locked
+            failed += 1
+        else:
+            placed += 1
+    return {'placed': placed, 'rejected': rejected, 'failed': failed}
+
+
+def _syncer(primary, replica, every, deadline):
+    syncs = 0
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        copy_database(primary, replica)
+        syncs += 1
+        time.sleep(max(0, every - (time.monotonic() - started)))
+    return {'syncs': syncs}
+
+
+def _worker(job):
+    role, mode, primary, replica, args = job
+    _configure(mode, primary, replica)
+    try:
+        return role, {'reader': _reader, 'writer': _writer, 'syncer': _syncer}[role](*args)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Measure read throughput (home, product_detail, search, dashboard_vendor) while other processes '
+            'place orders, under the old SQLite settings, the WAL profile and WAL plus the read replica. '
+            'Runs on temporary copies of the database; the configured one is only read.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--duration', type=float, default=20, help='seconds per mode')
+        parser.add_argument('--sync-every', type=float, default=2, help='replica refresh interval (seconds)')
+        parser.add_argument('--modes', default=','.join(MODES))
+        parser.add_argument('--output', help='write the results as JSON (default: bench-db-<timestamp>.json)')
+        parser.add_argument('--compare', help='earlier JSON result to show read rps deltas against')
+
+    def handle(self, *args, **opts):
+        modes = [m for m in opts['modes'].split(',') if m]
+        if set(modes) - set(MODES):
+            raise CommandError(f'Modes are {", ".join(MODES)}.')
+        customers = list(User.objects.filter(role=User.CUSTOMER, is_staff=False).values_list('pk', flat=True)[:opts['writers']])
+        vendor = User.objects.filter(role=User.VENDOR, vendor_approved=True, product__isnull=False).first()
+        products = list(Product.objects.filter(stock_quantity__gt=100).order_by('?').values_list('pk', 'price_mwk', 'slug')[:200])
+        if not customers or vendor is None or not products:
+            raise CommandError('Needs customers, vendors and stocked products; run manage.py seed_data first.')
+        slugs = [slug for _, _, slug in products]
+        words = [name.split()[0] for name in Product.objects.filter(slug__in=slugs[:50]).values_list('name', flat=True)
+                 if name.split() and name.split()[0].isalnum()] or ['a']
+        source = str(connections.settings[DEFAULT_DB_ALIAS]['NAME'])
+        report = {
+            'started_at': timezone.now().isoformat(), 'readers': opts['readers'], 'writers': opts['writers'],
+            'duration_s': opts['duration'], 'products': Product.objects.count(), 'modes': {},
+        }
+        connections.close_all()
+        with tempfile.TemporaryDirectory() as tmp:
+            for mode in modes:
+                primary, replica = os.path.join(tmp, f'{mode}.sqlite3'), os.path.join(tmp, f'{mode}-replica.sqlite3')
+                copy_database(source, primary)
+                with sqlite3.connect(primary) as conn:
+                    conn.execute('PRAGMA journal_mode=%s' % ('DELETE' if mode == 'basic' else 'WAL'))
+                if mode == 'replica':
+                    copy_database(primary, replica)
+                deadline = time.monotonic() + opts['duration'] + 1  # workers start within the first second
+                jobs = [('reader', mode, primary, replica, (i, vendor.pk, slugs, words, deadline))
+                        for i in range(opts['readers'])]
+                jobs += [('writer', mode, primary, replica, (i, customers[i % len(customers)], [p[:2] for p in products], deadline))
+                         for i in range(opts['writers'])]
+                if mode == 'replica':
+                    jobs.append(('syncer', mode, primary, replica, (primary, replica, opts['sync_every'], deadline)))
+                started = time.perf_counter()
+                with multiprocessing.get_context('fork').Pool(len(jobs)) as pool:
+                    results = pool.map(_worker, jobs)
+                elapsed = time.perf_counter() - started
+                reads = summarise([r for role, r in results if role == 'reader'], elapsed)
+                writes = defaultdict(int)
+                for role, r in results:
+                    if role != 'reader':
+                        for k, n in r.items():
+                            writes[k] += n
+                report['modes'][mode] = {
+                    'elapsed_s': round(elapsed, 2),
+                    'read_rps': round(sum(e['requests'] for e in reads.values()) / elapsed, 1),
+                    'read_errors': sum(e['errors'] for e in reads.values()),
+                    'orders_per_s': round(writes['placed'] / elapsed, 1),
+                    'writes': dict(writes), 'endpoints': reads,
+                }
+
+        previous = {}
+        if opts['compare']:
+            with open(opts['compare']) as f:
+                previous = json.load(f)['modes']
+        self.stdout.write(f'{"mode":<9}{"endpoint":<18}{"reqs":>7}{"err":>5}{"rps":>8}{"p50":>9}{"p95":>9}{"p99":>9}')
+        for mode, m in report['modes'].items():
+            line = (f'{mode:<9}{"(reads)":<18}{"":>7}{m["read_errors"]:>5}{m["read_rps"]:>8}'
+                    f'   orders/s {m["orders_per_s"]}  lock failures {m["writes"].get("failed", 0)}')
+            if mode in previous:
+                line += f'   read rps {m["read_rps"] - previous[mode]["read_rps"]:+.1f}'
+            self.stdout.write(line)
+            for name, e in m['endpoints'].items():
+                self.stdout.write(f'{"":<9}{name:<18}{e["requests"]:>7}{e["errors"]:>5}{e["rps"]:>8}'
+                                  f'{e["p50_ms"]:>9}{e["p95_ms"]:>9}{e["p99_ms"]:>9}')
+        path = opts['output'] or f'bench-db-{int(time.time())}.json'
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {path}'))
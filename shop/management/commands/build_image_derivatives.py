@@ -0,0 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from shop.imaging import WORKERS, run_job
+from shop.models import ProductImage
+
+
+def build(pk):
+    image = ProductImage.objects.filter(pk=pk).first()
+    if image is not None:
+        image.build_derivatives()
+
+
+class Command(BaseCommand):
+    help = 'Generate thumb/card/full derivatives for product images that lack them, in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(WORKERS, 1))
+        parser.add_argument('--all', action='store_true', help='Regenerate every image, not just missing ones.')
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.all() if options['all'] else ProductImage.objects.filter(full='')
+        ids = list(images.order_by('id').values_list('id', flat=True))
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            list(pool.map(lambda pk: run_job(build, pk), ids))
+        left = ProductImage.objects.filter(id__in=ids, full='').count()
+        self.stdout.write(f'Built derivatives for {len(ids) - left} of {len(ids)} images.')
@@ -0,0 +1,23 @@
+import sys
+from datetime import date
+from django.core.management.base import BaseCommand
+from shop.finance import KINDS, export_lines
+
+
+class Command(BaseCommand):
+    help = 'Stream orders, order items, payments or manual payments created in a date range as CSV/JSONL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=KINDS)
+        parser.add_argument('--start', type=date.fromisoformat, required=True, help='YYYY-MM-DD, inclusive')
+        parser.add_argument('--end', type=date.fromisoformat, required=True, help='YYYY-MM-DD, inclusive')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--output', '-o', help='default: stdout')
+
+    def handle(self, *args, **opts):
+        out = open(opts['output'], 'w', encoding='utf-8', newline='') if opts['output'] else sys.stdout
+        try:
+            out.writelines(export_lines(opts['kind'], opts['start'], opts['end'], opts['format']))
+        finally:
+            if out is not sys.stdout:
+                out.close()
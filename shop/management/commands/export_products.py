@@ -0,0 +1,24 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from shop.models import User
+from shop.product_io import export_lines
+
+
+class Command(BaseCommand):
+    help = 'Stream a vendor\'s products as CSV or JSONL (the import format).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('vendor', help='vendor username')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--output', '-o', help='default: stdout')
+
+    def handle(self, *args, **opts):
+        vendor = User.objects.filter(username=opts['vendor'], role=User.VENDOR).first()
+        if vendor is None:
+            raise CommandError(f'No vendor named {opts["vendor"]}.')
+        out = open(opts['output'], 'w', encoding='utf-8', newline='') if opts['output'] else sys.stdout
+        try:
+            out.writelines(export_lines(vendor, opts['format']))
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from shop.models import User
+from shop.product_io import BATCH_SIZE, guess_format, import_products, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Stream a CSV or JSONL catalog file into a vendor\'s products, upserting by slug.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('vendor', help='vendor username')
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='default: from the file extension')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **opts):
+        vendor = User.objects.filter(username=opts['vendor'], role=User.VENDOR).first()
+        if vendor is None:
+            raise CommandError(f'No vendor named {opts["vendor"]}.')
+        with open(opts['path'], 'rb') as f:
+            rows = read_rows(f, opts['format'] or guess_format(opts['path']))
+            report = import_products(vendor, rows, opts['batch_size'])
+        for line, slug, message in report.errors:
+            self.stderr.write(f'line {line} ({slug}): {message}')
+        self.stdout.write(f'{report.created} created, {report.updated} updated, {report.unchanged} unchanged, '
+                          f'{report.failed} rejected.')
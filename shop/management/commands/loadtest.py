@@ -0,0 +1,131 @@
+import json
+import logging
+import multiprocessing
+import random
+import statistics
+import time
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Max, Min
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from shop.models import Product, User
+
+PERCENTILES = (50, 95, 99)
+
+
+def _sample_slugs(rng, n):
+    bounds = Product.objects.aggregate(lo=Min('id'), hi=Max('id'))
+    ids = {rng.randint(bounds['lo'], bounds['hi']) for _ in range(n)}
+    return list(Product.objects.filter(id__in=ids, stock_quantity__gt=0).values_list('id', 'slug'))
+
+
+def _worker(args):
+    # one shopper and one vendor session per process, driven through the full middleware stack
+    index, customer_id, vendor_id, duration, checkout_every = args
+    connections.close_all()  # never share the parent's sqlite handle across fork
+    rng = random.Random(index)
+    products = _sample_slugs(rng, 500)
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)  # 5xx are counted, not printed
+    shopper, vendor = Client(raise_request_exception=False), Client(raise_request_exception=False)
+    shopper.force_login(User.objects.get(pk=customer_id))
+    vendor.force_login(User.objects.get(pk=vendor_id))
+    timings, errors = defaultdict(list), defaultdict(int)
+
+    def hit(name, client, method, url, data=None):
+        started = time.perf_counter()
+        response = getattr(client, method)(url, data)
+        timings[name].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors[name] += 1
+
+    deadline = time.monotonic() + duration
+    iteration = 0
+    while time.monotonic() < deadline:
+        iteration += 1
+        pk, slug = rng.choice(products)
+        hit('home', shopper, 'get', reverse('home'))
+        hit('product_detail', shopper, 'get', reverse('product_detail', args=[slug]))
+        hit('add_to_cart', shopper, 'post', reverse('add_to_cart'), {'product_id': pk, 'qty': 1})
+        hit('checkout', shopper, 'get', reverse('checkout'))
+        if iteration % checkout_every == 0:
+            hit('checkout_submit', shopper, 'post', reverse('checkout'),
+                {'shipping_address': 'load test', 'payment_method': 'cod'})
+        hit('dashboard_vendor', vendor, 'get', reverse('dashboard_vendor'))
+        hit('vendor_orders', vendor, 'get', reverse('vendor_orders'))
+    connections.close_all()
+    return dict(timings), dict(errors)
+
+
+def _percentile(sorted_values, pct):
+    # nearest-rank
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarise(results, elapsed):
+    timings, errors = defaultdict(list), defaultdict(int)
+    for worker_timings, worker_errors in results:
+        for name, values in worker_timings.items():
+            timings[name] += values
+        for name, n in worker_errors.items():
+            errors[name] += n
+    report = {}
+    for name, values in timings.items():
+        values.sort()
+        report[name] = {
+            'requests': len(values), 'errors': errors[name], 'rps': round(len(values) / elapsed, 1),
+            'mean_ms': round(statistics.fmean(values) * 1000, 2),
+            **{f'p{p}_ms': round(_percentile(values, p) * 1000, 2) for p in PERCENTILES},
+        }
+    return report
+
+
+class Command(BaseCommand):
+    help = ('Drive home, product_detail, add_to_cart, checkout and the vendor pages from several '
+            'processes through the WSGI handler and report throughput and p50/p95/p99 per endpoint. '
+            'Places real COD orders: run it against a seeded copy of the database (manage.py seed_data).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=30, help='seconds')
+        parser.add_argument('--checkout-every', type=int, default=5, help='submit an order every Nth iteration')
+        parser.add_argument('--output', help='write the results as JSON (default: loadtest-<timestamp>.json)')
+        parser.add_argument('--compare', help='earlier JSON result to show p95 deltas against')
+
+    def handle(self, *args, **opts):
+        customers = list(User.objects.filter(role=User.CUSTOMER, is_staff=False).values_list('pk', flat=True)[:opts['workers']])
+        vendors = list(User.objects.filter(role=User.VENDOR, vendor_approved=True, product__isnull=False)
+                       .distinct().values_list('pk', flat=True)[:opts['workers']])
+        if not customers or not vendors or not Product.objects.exists():
+            raise CommandError('Needs customers, vendors and products; run manage.py seed_data first.')
+        jobs = [(i, customers[i % len(customers)], vendors[i % len(vendors)], opts['duration'], opts['checkout_every'])
+                for i in range(opts['workers'])]
+        connections.close_all()
+
+        started = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(opts['workers']) as pool:
+            results = pool.map(_worker, jobs)
+        elapsed = time.perf_counter() - started
+
+        report = {
+            'started_at': timezone.now().isoformat(), 'elapsed_s': round(elapsed, 2), 'workers': opts['workers'],
+            'database': connection.vendor, 'products': Product.objects.count(),
+            'endpoints': summarise(results, elapsed),
+        }
+        previous = {}
+        if opts['compare']:
+            with open(opts['compare']) as f:
+                previous = json.load(f)['endpoints']
+        self.stdout.write(f'{"endpoint":<18}{"reqs":>7}{"err":>5}{"rps":>8}{"p50":>9}{"p95":>9}{"p99":>9}')
+        for name, r in report['endpoints'].items():
+            line = f'{name:<18}{r["requests"]:>7}{r["errors"]:>5}{r["rps"]:>8}{r["p50_ms"]:>9}{r["p95_ms"]:>9}{r["p99_ms"]:>9}'
+            if name in previous:
+                line += f'   p95 {r["p95_ms"] - previous[name]["p95_ms"]:+.2f}ms'
+            self.stdout.write(line)
+        path = opts['output'] or f'loadtest-{int(time.time())}.json'
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {path}'))
@@ -0,0 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from shop.imaging import WORKERS, run_job
+from shop.receipts import pending, process_receipt
+
+
+class Command(BaseCommand):
+    help = 'Process receipts the background pool has not handled yet (e.g. uploads from before a restart).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(WORKERS, 1))
+
+    def handle(self, *args, **options):
+        ids = list(pending().order_by('id').values_list('id', flat=True))
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            list(pool.map(lambda pk: run_job(process_receipt, pk), ids))
+        self.stdout.write(f'Processed {len(ids) - pending().filter(id__in=ids).count()} of {len(ids)} receipts.')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from shop.rollups import REBUILD_BATCH, rebuild
+
+
+class Command(BaseCommand):
+    help = ('Recompute SalesRollup from order history, streaming orders in id batches within one '
+            'transaction. Run while checkout traffic is low: checkouts wait for the rebuild to commit.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=REBUILD_BATCH)
+
+    def handle(self, *args, **options):
+        last = None
+        for last in rebuild(options['batch_size']):
+            self.stdout.write(f'  rolled up orders through #{last}')
+        self.stdout.write(self.style.SUCCESS('Sales rollups rebuilt.' if last else 'No orders to roll up.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from shop import search
+
+
+class Command(BaseCommand):
+    help = 'Recreate the product search triggers and rebuild the full-text index from shop_product.'
+
+    def handle(self, *args, **options):
+        if not search.uses_fts():
+            self.stdout.write('Full-text index is only used on SQLite; nothing to do.')
+            return
+        search.install()
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS('Product search index rebuilt.'))
@@ -0,0 +1,60 @@
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from shop.jobs import QUEUES, claim, run_batch, schedule_periodic, worker_id
+
+SCHEDULE_EVERY = 60  # seconds between checks that the periodic housekeeping jobs are queued
+
+
+class Command(BaseCommand):
+    help = ('Run background jobs (shop.jobs) until stopped. Several workers can run side by side; '
+            'per-queue concurrency limits hold across all of them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queues', default=','.join(QUEUES), help='comma-separated queues to serve')
+        parser.add_argument('--threads', type=int, default=4, help='batches run at once by this worker')
+        parser.add_argument('--poll', type=float, default=1.0, help='seconds to wait when nothing is due')
+        parser.add_argument('--once', action='store_true', help='exit once nothing is due')
+        parser.add_argument('--no-periodic', action='store_true', help="don't queue the housekeeping jobs")
+
+    def handle(self, *args, **options):
+        queues = [q for q in options['queues'].split(',') if q]
+        unknown = set(queues) - set(QUEUES)
+        if unknown:
+            raise CommandError(f'Unknown queue(s) {", ".join(sorted(unknown))}; configured: {", ".join(QUEUES)}.')
+        worker = worker_id()
+        stopping = []
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stopping.append(True))
+        self.stdout.write(f'Worker {worker} serving {", ".join(queues)}')
+
+        running, scheduled_at, processed = set(), 0, 0
+        with ThreadPoolExecutor(options['threads'], thread_name_prefix='jobs') as pool:
+            while not stopping:
+                if not options['no_periodic'] and time.monotonic() - scheduled_at >= SCHEDULE_EVERY:
+                    schedule_periodic()
+                    scheduled_at = time.monotonic()
+                claimed = False
+                for queue in queues:
+                    if len(running) >= options['threads']:
+                        break
+                    jobs = claim(queue, worker)
+                    if jobs:
+                        claimed = True
+                        processed += len(jobs)
+                        running.add(pool.submit(run_batch, jobs))
+                close_old_connections()
+                if not claimed and not running and options['once']:
+                    break
+                if running:
+                    # a finished batch frees a slot; otherwise look again after the poll interval
+                    finished, running = wait(running, timeout=0 if claimed else options['poll'], return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        if future.exception() is not None:
+                            self.stderr.write(f'Batch failed outside its jobs: {future.exception()!r}')
+                elif not claimed:
+                    time.sleep(options['poll'])
+            wait(running)  # finish the claimed batches before exiting
+        self.stdout.write(f'Worker {worker} stopped after {processed} jobs')
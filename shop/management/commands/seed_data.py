@@ -0,0 +1,146 @@
+import random
+import time
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from PIL import Image
+from shop.catalog import PRODUCT_COUNT_KEY
+from shop.counters import recount
+from shop.imaging import jpeg
+from shop.models import ManualPayment, Order, OrderItem, Payment, Product, ProductImage, User, VendorOrder
+from shop.rollups import rebuild
+
+CATEGORIES = ['Phones', 'Laptops', 'Shoes', 'Clothing', 'Groceries', 'Furniture', 'Books', 'Beauty', 'Toys', 'Garden']
+WORDS = ['Classic', 'Smart', 'Mini', 'Pro', 'Eco', 'Deluxe', 'Solar', 'Travel', 'Family', 'Sport', 'Chitenje', 'Lake']
+NOUNS = ['Phone', 'Charger', 'Sneakers', 'Shirt', 'Rice 5kg', 'Chair', 'Novel', 'Lotion', 'Football', 'Hoe']
+PLACEHOLDERS = 5
+
+
+def _batches(total, size):
+    for start in range(0, total, size):
+        yield start, min(size, total - start)
+
+
+def _placeholder_images():
+    # a few shared JPEGs (with derivatives) instead of one file per seeded product
+    names = []
+    for i in range(PLACEHOLDERS):
+        colour = tuple(random.Random(i).randrange(256) for _ in range(3))
+        img = Image.new('RGB', (1600, 1200), colour)
+        files = {}
+        for size, px in [('image', 1600)] + list(ProductImage.SIZES.items()):
+            name = f'products/seed/placeholder-{i}-{size}.jpg'
+            if not default_storage.exists(name):
+                default_storage.save(name, jpeg(img, px))
+            files[size] = name
+        names.append(files)
+    return names
+
+
+class Command(BaseCommand):
+    help = ('Seed vendors, customers, products (with images), orders and manual payments with batched '
+            'bulk_create. Rows get a unique run tag, so it can be run repeatedly to grow the data set.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendors', type=int, default=50)
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=10000, help='up to ~1M is practical')
+        parser.add_argument('--images', type=int, default=1, help='images per product')
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=90, help='spread order dates over this many days')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=None, help='random seed for repeatable data')
+        parser.add_argument('--skip-rollups', action='store_true')
+
+    def handle(self, *args, **opts):
+        rng = random.Random(opts['seed'])
+        tag = f'seed{int(time.time())}'
+        batch = opts['batch_size']
+        started = time.perf_counter()
+        password = make_password('seed')  # hashing once; per-user hashing would dominate the run
+
+        vendors = User.objects.bulk_create([
+            User(username=f'{tag}-vendor{i}', password=password, role=User.VENDOR, vendor_approved=True,
+                 email=f'{tag}-vendor{i}@example.com') for i in range(opts['vendors'])])
+        customers = User.objects.bulk_create([
+            User(username=f'{tag}-customer{i}', password=password, role=User.CUSTOMER, address=f'Area {i % 50}, Lilongwe')
+            for i in range(opts['customers'])], batch_size=batch)
+        self.stdout.write(f'{len(vendors)} vendors, {len(customers)} customers')
+
+        placeholders = _placeholder_images()
+        for start, n in _batches(opts['products'], batch):
+            with transaction.atomic():
+                products = Product.objects.bulk_create([
+                    Product(vendor=rng.choice(vendors), name=f'{rng.choice(WORDS)} {rng.choice(NOUNS)} {start + i}',
+                            slug=f'{tag}-{start + i}', description=f'{rng.choice(WORDS)} quality, seeded item {start + i}.',
+                            price_mwk=rng.randrange(500, 500000, 50), stock_quantity=rng.randrange(0, 500),
+                            category=rng.choice(CATEGORIES)) for i in range(n)])
+                ProductImage.objects.bulk_create([
+                    ProductImage(product=p, **rng.choice(placeholders)) for p in products for _ in range(opts['images'])])
+            self.stdout.write(f'  products {start + n}/{opts["products"]}')
+        cache.delete(PRODUCT_COUNT_KEY)
+
+        seeded = Product.objects.filter(slug__startswith=f'{tag}-').aggregate(lo=Min('id'), hi=Max('id'))
+        if opts['orders'] and seeded['lo'] is not None:
+            self._orders(rng, tag, opts, customers, seeded)
+            if not opts['skip_rollups']:
+                for _ in rebuild():
+                    pass
+                self.stdout.write('  sales rollups rebuilt')
+        recount()  # bulk inserts skip the write paths that move the admin counters
+        self.stdout.write(self.style.SUCCESS(f'Seeded {tag} in {time.perf_counter() - started:.1f}s'))
+
+    def _orders(self, rng, tag, opts, customers, seeded):
+        now = timezone.now()
+        for start, n in _batches(opts['orders'], opts['batch_size']):
+            wanted = [[rng.randint(seeded['lo'], seeded['hi']) for _ in range(rng.randint(1, 4))] for _ in range(n)]
+            catalog = {pk: (price, vendor) for pk, price, vendor in Product.objects.filter(
+                id__in={pk for line in wanted for pk in line}).values_list('id', 'price_mwk', 'vendor_id')}
+            with transaction.atomic():
+                orders, lines = [], []
+                for pks in wanted:
+                    items = {pk: rng.randint(1, 3) for pk in pks if pk in catalog}
+                    if not items:
+                        continue
+                    method = rng.choice(['cod', 'cod', 'manual'])
+                    paid = rng.random() < 0.6
+                    orders.append(Order(customer=rng.choice(customers), payment_method=method,
+                                        payment_status='paid' if paid else 'pending', shipping_address=f'{tag} address',
+                                        total_amount_mwk=sum(catalog[pk][0] * q for pk, q in items.items()),
+                                        line_count=len(items), item_count=sum(items.values())))
+                    lines.append(items)
+                Order.objects.bulk_create(orders)
+                for order in orders:  # created_at is auto_now_add, so backdate in one bulk UPDATE
+                    order.created_at = now - timedelta(days=rng.uniform(0, opts['days']))
+                Order.objects.bulk_update(orders, ['created_at'])
+
+                items, subs, payments, manual = [], [], [], []
+                for order, order_lines in zip(orders, lines):
+                    subtotals = {}
+                    for pk, qty in order_lines.items():
+                        price, vendor = catalog[pk]
+                        items.append(OrderItem(order=order, product_id=pk, quantity=qty, unit_price_mwk=price))
+                        subtotals[vendor] = subtotals.get(vendor, 0) + price * qty
+                    status = 'paid' if order.payment_status == 'paid' else 'pending'
+                    subs += [VendorOrder(order=order, vendor_id=v, subtotal_mwk=s, status=status, created_at=order.created_at)
+                             for v, s in subtotals.items()]
+                    if order.payment_method == 'cod':
+                        payments.append(Payment(order=order, provider='cod', amount_mwk=order.total_amount_mwk,
+                                                status='success' if status == 'paid' else 'pending'))
+                    else:
+                        payments.append(Payment(order=order, provider='manual', amount_mwk=order.total_amount_mwk))
+                        manual.append(ManualPayment(
+                            order=order, payer_name=order.customer.username, msisdn=f'0999{rng.randrange(10**6):06d}',
+                            method=rng.choice(['bank_deposit', 'mobile_money']), reference_code=f'{tag}-{order.pk}',
+                            status='approved' if status == 'paid' else 'submitted'))
+                OrderItem.objects.bulk_create(items)
+                VendorOrder.objects.bulk_create(subs)
+                VendorOrder.objects.bulk_update(subs, ['created_at'])
+                Payment.objects.bulk_create(payments)
+                ManualPayment.objects.bulk_create(manual)
+            self.stdout.write(f'  orders {start + n}/{opts["orders"]}')
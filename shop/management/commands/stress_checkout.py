@@ -0,0 +1,78 @@
+import multiprocessing
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.db.models import Sum
+from shop.checkout import OutOfStock, place_order
+from shop.models import Order, OrderItem, Payment, Product, User
+
+RETRIES = 20
+
+
+def _worker(args):
+    customer_id, product_id, orders, qty = args
+    connections.close_all()  # never share the parent's sqlite handle across fork
+    customer = User.objects.get(pk=customer_id)
+    price = Product.objects.values_list('price_mwk', flat=True).get(pk=product_id)
+    placed = rejected = failed = 0
+    for _ in range(orders):
+        for attempt in range(RETRIES):
+            try:
+                place_order(customer, [(product_id, qty, price)], shipping_address='stress', payment_method='cod')
+            except OutOfStock:
+                rejected += 1
+            except OperationalError:  # database is locked
+                time.sleep(0.01 * (attempt + 1))
+                continue
+            else:
+                placed += 1
+            break
+        else:
+            failed += 1
+    connections.close_all()
+    return placed, rejected, failed
+
+
+class Command(BaseCommand):
+    help = ('Hammer place_order from several processes against one product and verify that '
+            'stock is never oversold. Runs against the configured database; rows are removed afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--orders', type=int, default=50, help='orders attempted per worker')
+        parser.add_argument('--stock', type=int, default=200)
+        parser.add_argument('--qty', type=int, default=1, help='units per order')
+        parser.add_argument('--keep', action='store_true', help='keep the generated rows')
+
+    def handle(self, *args, **opts):
+        tag = f'stress-{int(time.time() * 1000)}'
+        vendor = User.objects.create_user(f'{tag}-vendor', role=User.VENDOR, vendor_approved=True)
+        customer = User.objects.create_user(f'{tag}-customer')
+        product = Product.objects.create(vendor=vendor, name=tag, slug=tag, price_mwk=1000,
+                                         stock_quantity=opts['stock'], category='stress')
+        jobs = [(customer.pk, product.pk, opts['orders'], opts['qty'])] * opts['workers']
+        connections.close_all()
+
+        started = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(opts['workers']) as pool:
+            results = pool.map(_worker, jobs)
+        elapsed = time.perf_counter() - started
+
+        placed, rejected, failed = (sum(r[i] for r in results) for i in range(3))
+        product.refresh_from_db()
+        sold = OrderItem.objects.filter(product=product).aggregate(n=Sum('quantity'))['n'] or 0
+        self.stdout.write(f'attempted={len(jobs) * opts["orders"]} placed={placed} rejected={rejected} '
+                          f'failed={failed} remaining_stock={product.stock_quantity} sold={sold}')
+        self.stdout.write(f'{placed / elapsed:.1f} orders/sec over {elapsed:.2f}s')
+
+        ok = sold == opts['stock'] - product.stock_quantity and sold == placed * opts['qty'] and sold <= opts['stock']
+        if not opts['keep']:
+            orders = Order.objects.filter(customer=customer)
+            Payment.objects.filter(order__in=orders).delete()
+            orders.delete()
+            product.delete()
+            customer.delete()
+            vendor.delete()
+        if not ok:
+            raise CommandError('Stock accounting mismatch: oversold or lost units.')
+        self.stdout.write(self.style.SUCCESS('No oversell.'))
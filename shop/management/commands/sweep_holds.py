@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from shop.reservations import SWEEP_BATCH, sweep_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired cart stock holds in bounded batches. Safe to run from cron every minute.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH)
+
+    def handle(self, *args, **options):
+        removed = sweep_expired(options['batch_size'])
+        self.stdout.write(f'Removed {removed} expired holds.')
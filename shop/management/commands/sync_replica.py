@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from shop.routers import REPLICA, copy_database
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary database into the read replica (ECOM_READ_REPLICA), once or every N seconds.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, help='keep syncing at this interval (seconds)')
+
+    def handle(self, *args, **options):
+        if REPLICA not in connections.settings:
+            raise CommandError('No replica configured; set ECOM_READ_REPLICA to the replica file path.')
+        source = str(connections.settings[DEFAULT_DB_ALIAS]['NAME'])
+        target = str(connections.settings[REPLICA]['NAME'])
+        while True:
+            started = time.perf_counter()
+            copy_database(source, target)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'Synced {target} in {elapsed:.2f}s')
+            if not options['every']:
+                return
+            time.sleep(max(0, options['every'] - elapsed))
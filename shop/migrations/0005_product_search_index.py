@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    from shop import search
+    search.install(schema_editor.connection)
+    search.rebuild(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    from shop import search
+    if not search.uses_fts(schema_editor.connection):
+        return
+    for suffix in ('_ai', '_ad', '_au'):
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {search.FTS_TABLE}{suffix}")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {search.FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop", "0004_productimage"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def backfill_vendor_orders(apps, schema_editor):
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    VendorOrder = apps.get_model('shop', 'VendorOrder')
+    rows = (
+        OrderItem.objects.values('order_id', 'product__vendor_id', 'order__payment_status')
+        .annotate(subtotal=Sum(F('quantity') * F('unit_price_mwk')))
+        .order_by('order_id')
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=2000):
+        batch.append(VendorOrder(
+            order_id=row['order_id'],
+            vendor_id=row['product__vendor_id'],
+            subtotal_mwk=row['subtotal'],
+            status='paid' if row['order__payment_status'] == 'paid' else 'pending',
+        ))
+        if len(batch) >= 2000:
+            VendorOrder.objects.bulk_create(batch)
+            batch = []
+    VendorOrder.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_savedcart'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subtotal_mwk', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(default='pending', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vendor_orders', to='shop.order')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='vendor_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['vendor', '-id'], name='vendororder_vendor_id_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'vendor'), name='vendororder_order_vendor_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_vendor_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_vendororder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('grain', models.CharField(choices=[('vendor', 'Vendor'), ('category', 'Category'), ('product', 'Product')], max_length=8)),
+                ('key', models.CharField(blank=True, max_length=80)),
+                ('category', models.CharField(blank=True, max_length=80)),
+                ('revenue_mwk', models.PositiveBigIntegerField(default=0)),
+                ('paid_revenue_mwk', models.PositiveBigIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('vendor', 'grain', 'key', 'day'), name='salesrollup_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:48
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def open_ledgers(apps, schema_editor):
+    # existing balances become an opening entry so the ledger sums to the balance
+    Wallet = apps.get_model('shop', 'Wallet')
+    WalletEntry = apps.get_model('shop', 'WalletEntry')
+    for wallet in Wallet.objects.filter(balance_mwk__gt=0).iterator():
+        WalletEntry.objects.create(wallet=wallet, amount_mwk=wallet.balance_mwk, kind='opening')
+        Wallet.objects.filter(pk=wallet.pk).update(entry_count=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_salesrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='entry_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='WalletEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount_mwk', models.IntegerField()),
+                ('kind', models.CharField(max_length=16)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='wallet_entries', to='shop.order')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='shop.wallet')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WalletSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance_mwk', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('entry', models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='shop.walletentry')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='snapshots', to='shop.wallet')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='walletentry',
+            index=models.Index(fields=['wallet', '-id'], name='walletentry_wallet_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='walletsnapshot',
+            index=models.Index(fields=['wallet', '-entry'], name='walletsnap_wallet_entry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='walletsnapshot',
+            index=models.Index(fields=['wallet', '-created_at'], name='walletsnap_wallet_time_idx'),
+        ),
+        migrations.RunPython(open_ledgers, migrations.RunPython.noop),
+    ]
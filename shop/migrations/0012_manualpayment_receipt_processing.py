@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_manualpayment_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='manualpayment',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='shop.manualpayment'),
+        ),
+        migrations.AddField(
+            model_name='manualpayment',
+            name='receipt_processed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='manualpayment',
+            name='receipt_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='manualpayment',
+            name='receipt_thumb',
+            field=models.ImageField(blank=True, upload_to='receipts/'),
+        ),
+    ]
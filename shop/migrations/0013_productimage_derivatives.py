@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_manualpayment_receipt_processing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='card',
+            field=models.ImageField(blank=True, editable=False, upload_to='products/'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='full',
+            field=models.ImageField(blank=True, editable=False, upload_to='products/'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='thumb',
+            field=models.ImageField(blank=True, editable=False, upload_to='products/'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def count_all(apps, schema_editor):
+    # same definitions as shop.counters.SOURCES
+    User = apps.get_model('shop', 'User')
+    ManualPayment = apps.get_model('shop', 'ManualPayment')
+    Order = apps.get_model('shop', 'Order')
+    Product = apps.get_model('shop', 'Product')
+    Counter = apps.get_model('shop', 'Counter')
+    Counter.objects.bulk_create([
+        Counter(name='pending_vendors', value=User.objects.filter(role='vendor', vendor_approved=False).count()),
+        Counter(name='submitted_receipts', value=ManualPayment.objects.filter(status='submitted').count()),
+        Counter(name='unpaid_cod', value=Order.objects.filter(payment_method='cod').exclude(payment_status='paid').count()),
+        Counter(name='low_stock', value=Product.objects.filter(
+            stock_quantity__lte=getattr(settings, 'LOW_STOCK_THRESHOLD', 5)).count()),
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_order_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_all, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:49
+
+from django.db import migrations, models
+
+
+def count_categories(apps, schema_editor):
+    from shop import categories
+    categories.install_triggers(schema_editor.connection)
+    categories.rebuild(schema_editor.connection)
+
+
+def drop_triggers(apps, schema_editor):
+    from shop import categories
+    if not categories.uses_triggers(schema_editor.connection):
+        return
+    for suffix in ('_ai', '_ad', '_au'):
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {categories.COUNT_TABLE}{suffix}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryCount',
+            fields=[
+                ('name', models.CharField(max_length=80, primary_key=True, serialize=False)),
+                ('products', models.IntegerField(default=0)),
+                ('in_stock', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price_mwk'], name='product_category_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-id'], name='product_category_id_idx'),
+        ),
+        migrations.RunPython(count_categories, drop_triggers),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_categories'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='manualpayment',
+            name='amount_mwk',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='manualpayment',
+            name='wallet',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='topups', to='shop.wallet'),
+        ),
+    ]
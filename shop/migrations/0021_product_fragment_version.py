@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0020_manualpayment_wallet_topup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='fragment_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
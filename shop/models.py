@@ -1,5 +1,9 @@
+import os
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import Sum
+from django.utils import timezone
+from .imaging import derived_name, jpeg, load
 
 class User(AbstractUser):
     CUSTOMER, VENDOR, ADMIN = 'customer', 'vendor', 'admin'
@@ -27,22 +31,119 @@ class Product(models.Model):
     category = models.CharField(max_length=80)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # keys the cached HTML fragments; renewed by every content change (see fragments.py)
+    fragment_version = models.BigIntegerField(default=0, editable=False)
     def __str__(self): return self.name
 
+    class Meta:
+        # category pages (see categories.py): price sorts and range filters, and newest first
+        indexes = [
+            models.Index(fields=['category', 'price_mwk'], name='product_category_price_idx'),
+            models.Index(fields=['category', '-id'], name='product_category_id_idx'),
+        ]
+
+    @property
+    def primary_image(self):
+        # listings prefetch images into image_list (see catalog.with_primary_image)
+        images = getattr(self, 'image_list', None)
+        if images is None:
+            return self.images.order_by('id').first()
+        return images[0] if images else None
+
+    @property
+    def available_quantity(self):
+        # listings annotate held_quantity (see catalog.with_availability)
+        held = getattr(self, 'held_quantity', None)
+        if held is None:
+            held = self.holds.active().aggregate(n=Sum('quantity'))['n'] or 0
+        return max(0, self.stock_quantity - held)
+
 # New model for product images
 class ProductImage(models.Model):
+    SIZES = {'thumb': 160, 'card': 480, 'full': 1200}  # longest edge, px
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='products/')
+    # resized JPEGs of `image`, written on upload (older rows: manage.py build_image_derivatives)
+    thumb = models.ImageField(upload_to='products/', blank=True, editable=False)
+    card = models.ImageField(upload_to='products/', blank=True, editable=False)
+    full = models.ImageField(upload_to='products/', blank=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        uploaded = bool(self.image) and not self.image._committed
+        super().save(*args, **kwargs)
+        if uploaded:
+            self.build_derivatives()
+
+    def build_derivatives(self):
+        try:
+            img = load(self.image)
+        except OSError:
+            return  # templates fall back to the original
+        base = os.path.basename(self.image.name)
+        for size, px in self.SIZES.items():
+            getattr(self, size).save(derived_name(base, f'_{size}'), jpeg(img, px), save=False)
+        self.save(update_fields=list(self.SIZES))
+
+    # plain name -> url, no storage access
+    @property
+    def thumb_url(self):
+        return (self.thumb or self.image).url
+
+    @property
+    def card_url(self):
+        return (self.card or self.image).url
+
+    @property
+    def full_url(self):
+        return (self.full or self.image).url
+
+class StockHoldQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(expires_at__gt=timezone.now())
+
+    def expired(self):
+        return self.filter(expires_at__lte=timezone.now())
+
+# Cart reservation against Product.stock_quantity, one row per (cart, product)
+class StockHold(models.Model):
+    product = models.ForeignKey(Product, related_name='holds', on_delete=models.CASCADE)
+    cart_key = models.CharField(max_length=64)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    objects = StockHoldQuerySet.as_manager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['cart_key', 'product'], name='stockhold_cart_product_uniq')]
+        indexes = [
+            models.Index(fields=['product', 'expires_at', 'quantity'], name='stockhold_product_exp_idx'),
+            models.Index(fields=['expires_at'], name='stockhold_expires_idx'),
+        ]
+
+# Cart of a logged-in user; the live copy is in the cache (see cart.Cart)
+class SavedCart(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='saved_cart')
+    lines = models.JSONField(default=list)  # [[product_id, qty, unit_price_mwk, name], ...]
+    updated_at = models.DateTimeField(auto_now=True)
 
 class Order(models.Model):
     customer = models.ForeignKey(User, on_delete=models.PROTECT)
     total_amount_mwk = models.PositiveIntegerField(default=0)
+    # written with the items at checkout, so order lists never aggregate OrderItem
+    line_count = models.PositiveIntegerField(default=0)
+    item_count = models.PositiveIntegerField(default=0)  # units
     payment_status = models.CharField(max_length=16, default='pending')  # pending|paid|failed
     delivery_status = models.CharField(max_length=16, default='pending')
-    payment_method = models.CharField(max_length=12, default='cod')      # cod|manual
+    payment_method = models.CharField(max_length=12, default='cod')      # cod|manual|wallet
     shipping_address = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='order_created_at_idx'),  # finance exports
+            models.Index(fields=['customer', '-created_at', '-id'], name='order_customer_created_idx'),  # order history
+        ]
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
@@ -51,6 +152,37 @@ class OrderItem(models.Model):
     @property
     def line_total(self): return self.quantity * self.unit_price_mwk
 
+# Per-vendor slice of an Order, written at checkout so vendor pages never join through items
+class VendorOrder(models.Model):
+    vendor = models.ForeignKey(User, on_delete=models.PROTECT, related_name='vendor_orders')
+    order = models.ForeignKey(Order, related_name='vendor_orders', on_delete=models.CASCADE)
+    subtotal_mwk = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=16, default='pending')  # pending|paid
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['order', 'vendor'], name='vendororder_order_vendor_uniq')]
+        indexes = [models.Index(fields=['vendor', '-id'], name='vendororder_vendor_id_idx')]
+
+# Daily vendor sales at three grains, maintained incrementally (see rollups.py).
+# key is '' for vendor totals, the category name for category rows and the product id for product rows.
+class SalesRollup(models.Model):
+    VENDOR, CATEGORY, PRODUCT = 'vendor', 'category', 'product'
+    GRAIN_CHOICES = [(VENDOR, 'Vendor'), (CATEGORY, 'Category'), (PRODUCT, 'Product')]
+    day = models.DateField()
+    vendor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    grain = models.CharField(max_length=8, choices=GRAIN_CHOICES)
+    key = models.CharField(max_length=80, blank=True)
+    product = models.ForeignKey(Product, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    category = models.CharField(max_length=80, blank=True)
+    revenue_mwk = models.PositiveBigIntegerField(default=0)
+    paid_revenue_mwk = models.PositiveBigIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    order_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['vendor', 'grain', 'key', 'day'], name='salesrollup_uniq')]
+
 class Payment(models.Model):
     order = models.ForeignKey(Order, related_name='payments', on_delete=models.PROTECT, null=True, blank=True)
     provider = models.CharField(max_length=16)  # cod|manual
@@ -58,6 +190,9 @@ class Payment(models.Model):
     status = models.CharField(max_length=16, default='initiated')  # initiated|pending|success|failed
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['created_at'], name='payment_created_at_idx')]
+
 class ManualPayment(models.Model):
     order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.SET_NULL)
     payer_name = models.CharField(max_length=120)
@@ -65,16 +200,120 @@ class ManualPayment(models.Model):
     method = models.CharField(max_length=20)  # bank_deposit|mobile_money|other
     reference_code = models.CharField(max_length=64)
     receipt_image = models.ImageField(upload_to='receipts/', blank=True)
+    # filled in by receipts.process_receipt after the upload
+    receipt_thumb = models.ImageField(upload_to='receipts/', blank=True)
+    receipt_sha256 = models.CharField(max_length=64, blank=True, db_index=True)  # of the original upload
+    receipt_processed_at = models.DateTimeField(null=True, blank=True)
+    duplicate_of = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    # wallet top-ups have no order; approving one credits amount_mwk to the wallet (see review.decide)
+    wallet = models.ForeignKey('Wallet', null=True, blank=True, on_delete=models.PROTECT, related_name='topups')
+    amount_mwk = models.PositiveIntegerField(default=0)
     status = models.CharField(max_length=20, default='submitted')  # submitted|approved|rejected
     reviewed_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
     reviewed_at = models.DateTimeField(null=True, blank=True)
+    # review lease (see review.claim_batch)
+    claimed_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    claimed_until = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='manualpayment_status_idx'),
+            models.Index(fields=['created_at'], name='manualpayment_created_at_idx'),
+        ]
+
 class Wallet(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='wallet')
     balance_mwk = models.PositiveIntegerField(default=0)
+    entry_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"{self.user.username}'s Wallet"
\ No newline at end of file
+        return f"{self.user.username}'s Wallet"
+
+# Append-only wallet ledger; balances only change through wallet.post_entry()
+class WalletEntry(models.Model):
+    OPENING, TOPUP, ORDER = 'opening', 'topup', 'order'
+    wallet = models.ForeignKey(Wallet, related_name='entries', on_delete=models.PROTECT)
+    amount_mwk = models.IntegerField()  # credits positive, debits negative
+    kind = models.CharField(max_length=16)
+    order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.PROTECT, related_name='wallet_entries')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['wallet', '-id'], name='walletentry_wallet_id_idx')]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Wallet entries are immutable.')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Wallet entries are immutable.')
+
+# Balance after `entry`, written every wallet.SNAPSHOT_EVERY entries
+class WalletSnapshot(models.Model):
+    wallet = models.ForeignKey(Wallet, related_name='snapshots', on_delete=models.PROTECT)
+    entry = models.OneToOneField(WalletEntry, on_delete=models.PROTECT, related_name='+')
+    balance_mwk = models.PositiveIntegerField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['wallet', '-entry'], name='walletsnap_wallet_entry_idx'),
+            models.Index(fields=['wallet', '-created_at'], name='walletsnap_wallet_time_idx'),
+        ]
+
+# Durable background job (see jobs.py); `name` is the dotted path of the function to run
+class Job(models.Model):
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+    queue = models.CharField(max_length=32, default='default')
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # claim lease (see jobs.claim); one token per claimed batch
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['queue', 'status', 'run_at'], name='job_queue_status_run_idx'),
+            models.Index(fields=['status', 'finished_at'], name='job_status_finished_idx'),
+        ]
+
+# Outcome of a POST made with an idempotency key (see idempotency.py); status_code is null while
+# the first request is still running
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=64)
+    path = models.CharField(max_length=200)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    location = models.CharField(max_length=200, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    body = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'key'], name='idempotencykey_user_key_uniq')]
+
+# Products per category, kept current by triggers on shop_product (see categories.py). Signed for
+# the same reason as Counter below.
+class CategoryCount(models.Model):
+    name = models.CharField(max_length=80, primary_key=True)
+    products = models.IntegerField(default=0)
+    in_stock = models.IntegerField(default=0)  # products with stock_quantity > 0
+
+# Maintained totals for the admin dashboard (see counters.py). Signed, so a count that drifted
+# below zero can't fail the write that moved it; recount() puts it right.
+class Counter(models.Model):
+    name = models.CharField(max_length=32, primary_key=True)
+    value = models.BigIntegerField(default=0)
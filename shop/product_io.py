@@ -0,0 +1,297 @@
+# shop/product_io.py - streaming vendor catalog import/export
+# Imports read the upload row by row and upsert by slug one batch at a time (one SELECT, one
+# bulk_create, one bulk_update per batch), so memory depends on the batch size, not the file.
+# Unreadable lines are reported like invalid rows; a file that isn't UTF-8 is rejected before any
+# batch is written.
+# Images named in a row are fetched/attached per batch on the imaging pool: either images the
+# vendor's products already have, or https URLs on PRODUCT_IMPORT_IMAGE_HOSTS (none by default),
+# size-capped and checked with Pillow before they are stored. Exports walk the vendor's products
+# in id order in chunks with their images prefetched, yielding CSV/JSONL lines.
+import codecs
+import csv
+import hashlib
+import io
+import json
+import os
+import urllib.error
+import urllib.request
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousOperation, ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image
+from . import counters
+from .catalog import PRODUCT_COUNT_KEY, with_primary_image
+from .forms import ProductRowForm
+from .fragments import bump, new_version
+from .imaging import submit_on_commit
+from .models import Product, ProductImage
+from .streaming import chunked, csv_lines, jsonl_lines
+
+COLUMNS = ['slug', 'name', 'description', 'price_mwk', 'stock_quantity', 'category', 'images']
+UPDATE_FIELDS = ['name', 'description', 'price_mwk', 'stock_quantity', 'category', 'updated_at', 'fragment_version']
+BATCH_SIZE = 1000
+EXPORT_CHUNK = 2000
+MAX_REPORTED_ERRORS = 1000
+DOWNLOAD_TIMEOUT = 15  # seconds per image URL
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+IMAGE_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+IMAGE_SEPARATOR = '|'
+READ_CHUNK = 64 * 1024
+
+
+@dataclass
+class ImportReport:
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)  # (line, slug, message), first MAX_REPORTED_ERRORS only
+
+    def error(self, line, slug, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, slug, message))
+
+
+def _first_bad_line(binary_file):
+    # line number of the first bytes that aren't UTF-8, or None; checked in chunks before any row is
+    # imported, so a mis-encoded file is rejected whole instead of failing after some batches committed
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    line = 1
+    for chunk in iter(lambda: binary_file.read(READ_CHUNK), b''):
+        try:
+            decoder.decode(chunk)
+        except UnicodeDecodeError as e:
+            return line + chunk[:max(e.start, 0)].count(b'\n')
+        line += chunk.count(b'\n')
+    binary_file.seek(0)
+    return None
+
+
+def read_rows(binary_file, fmt):
+    # yields (line number, dict) without reading the whole file; a line that can't be read yields
+    # (line number, message) instead, and a file that isn't UTF-8 yields one such message and nothing else
+    bad_line = _first_bad_line(binary_file)
+    if bad_line is not None:
+        yield bad_line, 'the file is not UTF-8 text (save it as "CSV UTF-8" and upload it again)'
+        return
+    text = io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield reader.line_num + 1, f'unreadable CSV: {e}'  # the failed line isn't counted yet
+                continue
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(text, 1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_num, f'invalid JSON: {e.msg}'
+                    continue
+                yield line_num, row if isinstance(row, dict) else 'not a JSON object'
+
+
+def guess_format(filename):
+    return 'jsonl' if os.path.splitext(filename)[1].lower() in ('.jsonl', '.json', '.ndjson') else 'csv'
+
+
+def clean_row(raw):
+    # ProductRowForm's fields and validators, without building a bound form (and deep-copying
+    # its fields) for every row
+    data, errors = {}, []
+    for name, form_field in ProductRowForm.base_fields.items():
+        try:
+            data[name] = form_field.clean(raw.get(name))
+        except ValidationError as e:
+            errors.append(f'{name}: {" ".join(e.messages)}')
+    return data, errors
+
+
+def import_products(vendor, rows, batch_size=BATCH_SIZE):
+    report = ImportReport()
+    batch = []
+    for line, raw in rows:
+        if isinstance(raw, str):
+            report.error(line, '', raw)
+            continue
+        if isinstance(raw.get('images'), list):
+            if not all(isinstance(source, str) for source in raw['images']):
+                report.error(line, raw.get('slug', ''), 'images: must be a list of strings')
+                continue
+            raw['images'] = IMAGE_SEPARATOR.join(raw['images'])
+        data, errors = clean_row(raw)
+        if errors:
+            report.error(line, raw.get('slug', ''), '; '.join(errors))
+            continue
+        batch.append((line, data))
+        if len(batch) >= batch_size:
+            _import_batch(vendor, batch, report)
+            batch = []
+    if batch:
+        _import_batch(vendor, batch, report)
+    return report
+
+
+def _import_batch(vendor, batch, report):
+    rows = {}
+    for line, data in batch:
+        if data['slug'] in rows:
+            report.error(line, data['slug'], 'slug repeated within the same batch')
+        else:
+            rows[data['slug']] = (line, data)
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {p.slug: p for p in Product.objects.filter(slug__in=list(rows))}
+        creates, updates, unchanged = [], [], []
+        low_stock = 0
+        for slug, (line, data) in rows.items():
+            fields = {f: data[f] for f in UPDATE_FIELDS if f not in ('updated_at', 'fragment_version')}
+            product = existing.get(slug)
+            if product is None:
+                creates.append(Product(vendor=vendor, slug=slug, **fields))
+                low_stock += counters.low_stock_change(after=fields['stock_quantity'])
+            elif product.vendor_id != vendor.pk:
+                report.error(line, slug, 'slug belongs to another vendor')
+            elif any(getattr(product, name) != value for name, value in fields.items()):
+                low_stock += counters.low_stock_change(product.stock_quantity, fields['stock_quantity'])
+                for name, value in fields.items():
+                    setattr(product, name, value)
+                product.updated_at = now
+                product.fragment_version = new_version()
+                updates.append(product)
+            else:
+                unchanged.append(product)
+        Product.objects.bulk_create(creates)
+        _bulk_update(updates)
+        counters.bump(counters.LOW_STOCK_PRODUCTS, low_stock)
+        images = [(p.pk, rows[p.slug][1]['images']) for p in creates + updates + unchanged if rows[p.slug][1]['images']]
+        if images:
+            submit_on_commit(attach_images, vendor.pk, images)
+        # bulk writes send no post_save; updates set fragment_version themselves
+        if creates:
+            transaction.on_commit(lambda: cache.delete(PRODUCT_COUNT_KEY))
+    report.created += len(creates)
+    report.updated += len(updates)
+    report.unchanged += len(unchanged)
+
+
+def _bulk_update(products):
+    # one prepared UPDATE run with executemany; QuerySet.bulk_update builds a CASE expression per
+    # column and row, which costs milliseconds per row in Python at catalog sizes
+    if not products:
+        return
+    qn = connection.ops.quote_name
+    fields = [Product._meta.get_field(name) for name in UPDATE_FIELDS]
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        qn(Product._meta.db_table), ', '.join(f'{qn(f.column)} = %s' for f in fields), qn(Product._meta.pk.column))
+    with connection.cursor() as cur:
+        cur.executemany(sql, [[f.get_db_prep_save(getattr(p, f.attname), connection) for f in fields] + [p.pk]
+                              for p in products])
+
+
+def _allowed_url(url):
+    parts = urlparse(url)
+    return parts.scheme == 'https' and parts.hostname in getattr(settings, 'PRODUCT_IMPORT_IMAGE_HOSTS', ())
+
+
+class _AllowedRedirects(urllib.request.HTTPRedirectHandler):
+    # a redirect is a new fetch, so it has to pass the same check
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if not _allowed_url(newurl):
+            raise urllib.error.HTTPError(newurl, code, 'redirect to a host not allowed for imports', headers, fp)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_opener = urllib.request.build_opener(_AllowedRedirects)
+
+
+def _download(url):
+    with _opener.open(url, timeout=DOWNLOAD_TIMEOUT) as response:
+        data = response.read(MAX_IMAGE_BYTES + 1)
+    if len(data) > MAX_IMAGE_BYTES:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            fmt = img.format
+            img.verify()
+    except Exception:  # Pillow raises a range of types for bytes that aren't an image
+        return None
+    if fmt not in IMAGE_FORMATS:
+        return None
+    # named by content, never by the URL
+    name = f'products/{hashlib.sha256(data).hexdigest()[:32]}.{IMAGE_FORMATS[fmt]}'
+    return default_storage.save(name, ContentFile(data))
+
+
+def _store(source, own_images):
+    # one of the vendor's current product images, or an allowed URL downloaded into products/;
+    # None for anything else (other media, other hosts, file:// and the like)
+    if source in own_images:
+        return source
+    if _allowed_url(source):
+        return _download(source)
+    return None
+
+
+def attach_images(vendor_id, images):
+    # images: [(product_id, 'a.jpg|b.jpg')]; the listed images replace a product's current set
+    # unless they already are exactly that set, or none of them could be stored
+    current = {}
+    own_images = set(ProductImage.objects.filter(product__vendor_id=vendor_id).values_list('image', flat=True))
+    for pid, name in ProductImage.objects.filter(product_id__in=[pid for pid, _ in images]).values_list('product_id', 'image'):
+        current.setdefault(pid, []).append(name)
+    wanted = {}
+    for pid, value in images:
+        sources = [s.strip() for s in value.split(IMAGE_SEPARATOR) if s.strip()]
+        if sources != current.get(pid, []):
+            wanted[pid] = sources
+    new = []
+    for pid, sources in wanted.items():
+        for source in sources:
+            try:
+                name = _store(source, own_images)
+            except (OSError, ValueError, SuspiciousOperation):
+                name = None
+            if name:
+                new.append(ProductImage(product_id=pid, image=name))
+    replaced = {image.product_id for image in new}
+    with transaction.atomic():
+        ProductImage.objects.filter(product_id__in=replaced).delete()
+        ProductImage.objects.bulk_create(new)
+        if replaced:
+            bump(*replaced)
+    for image in new:
+        image.build_derivatives()  # saves the derivative names, which bumps the fragment cache
+
+
+def export_rows(vendor):
+    last = 0
+    while True:
+        chunk = list(with_primary_image(Product.objects.filter(vendor=vendor, id__gt=last)).order_by('id')[:EXPORT_CHUNK])
+        if not chunk:
+            return
+        for p in chunk:
+            yield {'slug': p.slug, 'name': p.name, 'description': p.description, 'price_mwk': p.price_mwk,
+                   'stock_quantity': p.stock_quantity, 'category': p.category,
+                   'images': [img.image.name for img in p.image_list]}
+        last = chunk[-1].pk
+
+
+def export_lines(vendor, fmt):
+    if fmt == 'jsonl':
+        return chunked(jsonl_lines(export_rows(vendor)))
+    rows = (dict(row, images=IMAGE_SEPARATOR.join(row['images'])) for row in export_rows(vendor))
+    return chunked(csv_lines(COLUMNS, rows))
@@ -0,0 +1,105 @@
+# shop/profiling.py - per-request query profiling and N+1 detection
+# profile_queries() wraps every DB connection with an execute_wrapper that counts statements,
+# times them and groups them by shape (the SQL with its %s placeholders, IN lists collapsed), so
+# an N+1 shows up as one shape repeated once per row. QueryProfilerMiddleware records that per
+# URL name when settings.QUERY_PROFILING is on; tests use profile_queries() directly.
+import logging
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+REPEAT_THRESHOLD = 3  # the same shape this many times in one request looks like a loop
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def fingerprint(sql):
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+class QueryProfile:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.count += 1
+            self.shapes[fingerprint(sql)] += 1
+
+    @property
+    def repeated(self):
+        return {shape: n for shape, n in self.shapes.most_common() if n >= REPEAT_THRESHOLD}
+
+    def __str__(self):
+        lines = [f'{self.count} queries in {self.time * 1000:.1f}ms']
+        lines += [f'  x{n}: {shape}' for shape, n in self.shapes.most_common()]
+        return '\n'.join(lines)
+
+
+@contextmanager
+def profile_queries():
+    profile = QueryProfile()
+    with ExitStack() as stack:
+        for conn in connections.all():
+            stack.enter_context(conn.execute_wrapper(profile))
+        yield profile
+
+
+# per URL name, for this process: requests, queries, db seconds, worst query count, repeated shapes
+stats = defaultdict(lambda: {'requests': 0, 'queries': 0, 'db_time': 0.0, 'max_queries': 0, 'repeated': Counter()})
+
+
+def record(name, profile):
+    entry = stats[name]
+    entry['requests'] += 1
+    entry['queries'] += profile.count
+    entry['db_time'] += profile.time
+    entry['max_queries'] = max(entry['max_queries'], profile.count)
+    entry['repeated'].update(profile.repeated.keys())
+    for shape, n in profile.repeated.items():
+        logger.warning('possible N+1 in %s: %d x %s', name, n, shape)
+
+
+class QueryBudgetMixin:
+    # TestCase mixin: fails when a call runs more than `budget` queries or repeats a shape
+    def assertQueryBudget(self, budget, func, *args, **kwargs):
+        with profile_queries() as profile:
+            result = func(*args, **kwargs)
+        if profile.count > budget or profile.repeated:
+            self.fail(f'query budget {budget} exceeded or N+1 shape repeated: {profile}')
+        return result
+
+
+def report():
+    return sorted(((name, dict(entry, repeated=dict(entry['repeated']))) for name, entry in stats.items()),
+                  key=lambda item: -item[1]['db_time'])
+
+
+class QueryProfilerMiddleware:
+    # opt-in with QUERY_PROFILING = True. Queries run while a streaming response is iterated
+    # happen after this returns and are not counted.
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with profile_queries() as profile:
+            response = self.get_response(request)
+        match = request.resolver_match
+        name = match.view_name if match else '<unresolved>'
+        record(name, profile)
+        logger.info('%s %s: %d queries, %.1fms', request.method, name, profile.count, profile.time * 1000)
+        response['Server-Timing'] = f'db;dur={profile.time * 1000:.1f};desc="{profile.count} queries"'
+        return response
@@ -0,0 +1,46 @@
+# shop/receipts.py - background processing of manual payment receipts
+# manual_submit only stores the upload; process_receipt then (on the imaging pool) hashes the
+# original bytes, replaces it with a downscaled JPEG, writes a review thumbnail and links exact
+# resubmissions to the first receipt with the same hash (indexed, so one lookup).
+from django.utils import timezone
+from .imaging import derived_name, jpeg, load, sha256, submit_on_commit
+from .models import ManualPayment
+
+MAX_PX = 1600
+THUMB_PX = 320
+
+
+def enqueue(mp):
+    if mp.receipt_image:
+        submit_on_commit(process_receipt, mp.pk)
+
+
+def pending():
+    return ManualPayment.objects.exclude(receipt_image='').filter(receipt_processed_at__isnull=True)
+
+
+def process_receipt(mp_id):
+    mp = pending().filter(pk=mp_id).first()
+    if mp is None:
+        return
+    image = mp.receipt_image
+    storage = image.storage
+    original = image.name
+    digest = sha256(image)
+    changes = {'receipt_sha256': digest, 'receipt_processed_at': timezone.now()}
+    try:
+        img = load(image)
+    except OSError:
+        img = None  # keep whatever was uploaded; the reviewer still gets the hash/duplicate check
+    if img is not None:
+        changes['receipt_image'] = storage.save(derived_name(original), jpeg(img, MAX_PX))
+        changes['receipt_thumb'] = storage.save(derived_name(original, '_thumb'), jpeg(img, THUMB_PX, quality=70))
+    changes['duplicate_of_id'] = (ManualPayment.objects.filter(receipt_sha256=digest).exclude(pk=mp.pk)
+                                  .order_by('id').values_list('id', flat=True).first())
+    # update() rather than save() so a review decision made meanwhile is never overwritten
+    written = [changes[k] for k in ('receipt_image', 'receipt_thumb') if k in changes]
+    if not pending().filter(pk=mp.pk).update(**changes):
+        for name in written:  # someone else processed it first
+            storage.delete(name)
+    elif written:
+        storage.delete(original)
@@ -0,0 +1,49 @@
+# shop/reservations.py - time-limited stock holds for carts
+# add_to_cart holds units against Product.stock_quantity for HOLD_TTL; what shoppers see as
+# available is stock minus the active holds of everyone else. Expired rows are ignored by every
+# read and removed in bulk by sweep_expired() (manage.py sweep_holds).
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .bulk import delete_in_batches
+from .catalog import held_quantity
+from .checkout import OutOfStock
+from .models import Product, StockHold
+
+HOLD_TTL = timedelta(seconds=getattr(settings, 'STOCK_HOLD_TTL_SECONDS', 15 * 60))
+SWEEP_BATCH = 5000
+
+
+def place_holds(key, wanted):
+    # wanted: {product_id: total qty this cart wants}; existing holds are replaced, not added to.
+    # Returns (held products, [OutOfStock]); ids that no longer exist are simply absent. No row
+    # locks here: holds are advisory and the conditional decrement in place_order is authoritative.
+    if not wanted:
+        return [], []
+    held, errors = [], []
+    expires_at = timezone.now() + HOLD_TTL
+    with transaction.atomic():
+        products = Product.objects.annotate(
+            held_quantity=held_quantity(exclude_cart=key)).filter(pk__in=list(wanted)).order_by('pk')
+        for product in products:
+            if product.available_quantity < wanted[product.pk]:
+                errors.append(OutOfStock(product))
+            else:
+                held.append(product)
+        StockHold.objects.bulk_create(
+            [StockHold(cart_key=key, product=p, quantity=wanted[p.pk], expires_at=expires_at) for p in held],
+            update_conflicts=True, unique_fields=['cart_key', 'product'], update_fields=['quantity', 'expires_at'],
+        )
+    return held, errors
+
+
+def release(key, product_ids=None):
+    holds = StockHold.objects.filter(cart_key=key)
+    if product_ids is not None:
+        holds = holds.filter(product_id__in=product_ids)
+    holds.delete()
+
+
+def sweep_expired(batch_size=SWEEP_BATCH):
+    return delete_in_batches(StockHold.objects.expired(), batch_size)
@@ -0,0 +1,63 @@
+# shop/review.py - manual payment review queue
+# Reviewers lease batches of submitted receipts (claimed_by/claimed_until) so two people never
+# work the same rows; an expired lease makes the rows claimable again. Decisions are applied to
+# a whole batch with a few set-based UPDATEs, and the admin counters move in the same transaction.
+# Approved wallet top-ups are credited to their wallets in that transaction too.
+from datetime import timedelta
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from . import counters
+from .models import ManualPayment, Order, VendorOrder, WalletEntry
+from .rollups import after_commit, record_payments
+from .wallet import post_entry
+
+LEASE = timedelta(minutes=10)
+BATCH_SIZE = 25
+
+
+def _claimable(reviewer, now):
+    return ManualPayment.objects.filter(status='submitted').filter(
+        Q(claimed_until__isnull=True) | Q(claimed_until__lt=now) | Q(claimed_by=reviewer))
+
+
+def claim_batch(reviewer, size=BATCH_SIZE):
+    # renews the reviewer's current lease and tops it up to `size` rows, oldest first
+    now = timezone.now()
+    with transaction.atomic():
+        free = _claimable(reviewer, now).order_by('id').values_list('id', flat=True)
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(free.select_for_update(skip_locked=True)[:size])
+        else:
+            # SQLite serialises writers, so one UPDATE over the subquery is the whole claim
+            ids = free[:size]
+        # repeating the claimable filter makes a concurrent claimer lose the row instead of sharing it
+        _claimable(reviewer, now).filter(id__in=ids).update(claimed_by=reviewer, claimed_until=now + LEASE)
+
+
+def my_batch(reviewer):
+    return (ManualPayment.objects.filter(status='submitted', claimed_by=reviewer, claimed_until__gt=timezone.now())
+            .select_related('order').order_by('id'))
+
+
+def decide(reviewer, ids, approve):
+    # rows leased by another reviewer are skipped; returns how many rows were decided
+    now = timezone.now()
+    with transaction.atomic():
+        decided = _claimable(reviewer, now).filter(id__in=ids).update(
+            status='approved' if approve else 'rejected', reviewed_by=reviewer, reviewed_at=now,
+            claimed_by=None, claimed_until=None)
+        counters.bump(counters.SUBMITTED_RECEIPTS, -decided)
+        if approve and decided:
+            approved = ManualPayment.objects.filter(id__in=ids, reviewed_by=reviewer, reviewed_at=now)
+            for wallet_id, amount in approved.filter(wallet__isnull=False).values_list('wallet_id', 'amount_mwk'):
+                post_entry(wallet_id, amount, WalletEntry.TOPUP)
+            order_ids = approved.filter(order__isnull=False).values('order_id')
+            newly_paid = dict(Order.objects.filter(id__in=order_ids).exclude(payment_status='paid')
+                              .values_list('id', 'payment_method'))
+            if newly_paid:
+                counters.bump(counters.UNPAID_COD, -list(newly_paid.values()).count('cod'))
+                Order.objects.filter(id__in=newly_paid).update(payment_status='paid')
+                VendorOrder.objects.filter(order_id__in=newly_paid).update(status='paid')
+                after_commit(record_payments, list(newly_paid))
+    return decided
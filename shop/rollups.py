@@ -0,0 +1,109 @@
+# shop/rollups.py - incremental vendor sales rollups
+# Each committed order adds its lines into SalesRollup with one upsert per row
+# (INSERT ... ON CONFLICT DO UPDATE SET x = x + excluded.x); payments add to paid_revenue_mwk
+# the same way. Dashboards then read at most a few hundred indexed rows instead of aggregating
+# OrderItem x Product. `manage.py rebuild_sales_rollups` recomputes everything from history.
+from datetime import timedelta
+from functools import partial
+from django.db import connection, transaction
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .bulk import insert_or_add
+from .models import Order, OrderItem, SalesRollup, VendorOrder
+
+GRAINS = {
+    SalesRollup.VENDOR: {},
+    SalesRollup.CATEGORY: {'c': F('product__category')},
+    SalesRollup.PRODUCT: {'p': F('product_id'), 'c': F('product__category')},
+}
+COLUMNS = ('day', 'vendor_id', 'grain', 'key', 'product_id', 'category',
+           'revenue_mwk', 'paid_revenue_mwk', 'units', 'order_count')
+COUNTERS = COLUMNS[6:]
+REBUILD_BATCH = 2000
+
+
+def _rows(items, paid):
+    rows = []
+    for grain, dims in GRAINS.items():
+        qs = items.values(d=TruncDate('order__created_at'), v=F('product__vendor_id'), **dims).annotate(
+            revenue=Sum(F('quantity') * F('unit_price_mwk')),
+            units=Sum('quantity'),
+            orders=Count('order', distinct=True),
+        ).order_by()
+        for r in qs:
+            product_id, category = r.get('p'), r.get('c', '')
+            key = {SalesRollup.PRODUCT: str(product_id), SalesRollup.CATEGORY: category}.get(grain, '')
+            counters = (0, r['revenue'], 0, 0) if paid else (r['revenue'], 0, r['units'], r['orders'])
+            day = connection.ops.adapt_datefield_value(r['d'])
+            rows.append((day, r['v'], grain, key, product_id, category) + counters)
+    return rows
+
+
+def _upsert(rows):
+    insert_or_add(SalesRollup, COLUMNS, ('vendor_id', 'grain', 'key', 'day'), COUNTERS, rows)
+
+
+def record_orders(order_ids):
+    _upsert(_rows(OrderItem.objects.filter(order_id__in=order_ids), paid=False))
+
+
+def record_payments(order_ids, vendor=None):
+    # vendor limits it to one vendor's lines (per-sub-order COD collection)
+    items = OrderItem.objects.filter(order_id__in=order_ids)
+    if vendor is not None:
+        items = items.filter(product__vendor=vendor)
+    _upsert(_rows(items, paid=True))
+
+
+def after_commit(func, *args, **kwargs):
+    # rollups must never fail the write that triggered them; errors are logged by Django
+    transaction.on_commit(partial(func, *args, **kwargs), robust=True)
+
+
+def rebuild(batch_size=REBUILD_BATCH):
+    # streams orders in id ranges so memory stays flat; yields the last order id of each batch.
+    # The delete and every batch are one transaction: under IMMEDIATE it holds the SQLite write
+    # lock throughout, so no order or payment can commit (and record itself) between the delete
+    # and the batch that covers it. Checkouts queue behind it for up to the connection timeout.
+    with transaction.atomic():
+        SalesRollup.objects.all().delete()
+        bounds = Order.objects.aggregate(lo=Min('id'), hi=Max('id'))
+        if bounds['lo'] is None:
+            return
+        paid = VendorOrder.objects.filter(order=OuterRef('order_id'), vendor=OuterRef('product__vendor_id'), status='paid')
+        for start in range(bounds['lo'], bounds['hi'] + 1, batch_size):
+            items = OrderItem.objects.filter(order_id__gte=start, order_id__lt=start + batch_size)
+            _upsert(_rows(items, paid=False) + _rows(items.filter(Exists(paid)), paid=True))
+            yield min(start + batch_size - 1, bounds['hi'])
+
+
+def vendor_sales(vendor, days):
+    start = timezone.localdate() - timedelta(days=days - 1)
+    recent = SalesRollup.objects.filter(vendor=vendor, day__gte=start)
+    by_day = {r['day']: r for r in recent.filter(grain=SalesRollup.VENDOR, key='').values(
+        'day', 'revenue_mwk', 'paid_revenue_mwk', 'units', 'order_count')}
+    series = []
+    for i in range(days):
+        day = start + timedelta(days=i)
+        series.append(by_day.get(day) or {'day': day, 'revenue_mwk': 0, 'paid_revenue_mwk': 0, 'units': 0, 'order_count': 0})
+    peak = max(r['revenue_mwk'] for r in series) or 1
+    for r in series:
+        r['pct'] = round(100 * r['revenue_mwk'] / peak)
+
+    def top(grain, *group):
+        # grouped by the rollup's own identity; names are joined for display only, so two
+        # products sharing a name stay separate entries
+        return list(recent.filter(grain=grain).values(*group).annotate(
+            revenue=Sum('revenue_mwk'), units=Sum('units')).order_by('-revenue')[:5])
+
+    return {
+        'days': days,
+        'series': series,
+        'revenue': sum(r['revenue_mwk'] for r in series),
+        'paid_revenue': sum(r['paid_revenue_mwk'] for r in series),
+        'units': sum(r['units'] for r in series),
+        'orders': sum(r['order_count'] for r in series),
+        'top_categories': top(SalesRollup.CATEGORY, 'key'),
+        'top_products': top(SalesRollup.PRODUCT, 'product_id', 'product__name'),
+    }
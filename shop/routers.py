@@ -0,0 +1,74 @@
+# shop/routers.py - read replica routing
+# Views wrapped in @replica_reads (catalog, search, dashboards) read from the 'replica' alias, a
+# copy of the primary refreshed by `manage.py sync_replica`, so they don't queue behind checkout
+# writes. Everything else stays on the primary: writes and select_for_update (Django routes both
+# through db_for_write), reads inside a transaction, and sessions/users, which must see the
+# request's own writes (a fresh login would look logged out on a stale copy). With no 'replica'
+# alias configured (settings.READ_REPLICA unset) the router is a no-op.
+import sqlite3
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = 'replica'
+PRIMARY_ONLY_APPS = {'admin', 'auth', 'contenttypes', 'sessions'}
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def reading_from_replica():
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_reads(view):
+    if iscoroutinefunction(view):
+        async def wrapper(*args, **kwargs):
+            with reading_from_replica():
+                return await view(*args, **kwargs)
+    else:
+        def wrapper(*args, **kwargs):
+            with reading_from_replica():
+                return view(*args, **kwargs)
+    return wraps(view)(wrapper)
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or REPLICA not in connections.settings:
+            return None
+        if model._meta.app_label in PRIMARY_ONLY_APPS or model._meta.label == settings.AUTH_USER_MODEL:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its schema with the data, from sync_replica
+        return db != REPLICA
+
+
+def copy_database(source, target):
+    # online backup of the whole file in one step: a consistent snapshot of the primary (writers
+    # carry on under WAL) swapped into the replica under its write lock, which its readers wait out
+    src, dst = sqlite3.connect(source), sqlite3.connect(target, timeout=20)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
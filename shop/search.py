@@ -0,0 +1,147 @@
+# shop/search.py - storefront product search
+# On SQLite products are indexed in an FTS5 table (shop_product_fts) that uses shop_product as its
+# external content table; triggers keep it in sync with every insert/update/delete, including
+# bulk_create/update() which bypass model signals. Other backends fall back to icontains.
+import re
+from django.db import connection, connections, router
+from django.db.models import Count, Q
+from . import triggers
+from .catalog import with_primary_image
+from .models import Product
+
+FTS_TABLE = 'shop_product_fts'
+# bm25 column weights for (name, description, category)
+WEIGHTS = (10.0, 1.0, 4.0)
+MAX_TERMS = 8
+
+TABLE_SQL = f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    name, description, category,
+    content='shop_product', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3')"""
+
+TRIGGER_SQL = [
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON shop_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON shop_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END""",
+    # stock/price updates do not touch the index
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON shop_product
+    WHEN old.name IS NOT new.name OR old.description IS NOT new.description OR old.category IS NOT new.category
+    BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO {FTS_TABLE}(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+]
+
+
+def uses_fts(conn=connection):
+    return conn.vendor == 'sqlite'
+
+
+def install(conn=connection):
+    if not uses_fts(conn):
+        return
+    with conn.cursor() as cur:
+        cur.execute(TABLE_SQL)
+    install_triggers(conn)
+
+
+def install_triggers(conn=connection):
+    triggers.install(conn, FTS_TABLE, TRIGGER_SQL)
+
+
+def rebuild(conn=connection):
+    if not uses_fts(conn):
+        return
+    with conn.cursor() as cur:
+        cur.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def terms(q):
+    return re.findall(r'\w+', (q or '').lower())[:MAX_TERMS]
+
+
+def fts_query(words):
+    # every term must match; the last one is a prefix so partially typed words still hit
+    quoted = [f'"{w}"' for w in words]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+class SearchResult:
+    def __init__(self, products, facets, total, page, per_page):
+        self.products = products
+        self.facets = facets  # [(category, count)], most populated first
+        self.total = total
+        self.page = page
+        self.has_previous = page > 1
+        self.has_next = page * per_page < total
+
+    @property
+    def previous_page_number(self):
+        return self.page - 1
+
+    @property
+    def next_page_number(self):
+        return self.page + 1
+
+
+def _fts_hits(words, category, limit, offset):
+    # facets and the requested page of ranked ids in one statement
+    weights = ', '.join(str(w) for w in WEIGHTS)
+    category_sql = 'WHERE p.category = %s' if category else ''
+    sql = f"""
+        WITH hits AS (
+            SELECT rowid AS id, bm25({FTS_TABLE}, {weights}) AS score
+            FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s
+        )
+        SELECT 'f', NULL, p.category, COUNT(*) FROM hits JOIN shop_product p ON p.id = hits.id
+        GROUP BY p.category
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'h', hits.id, NULL, hits.score FROM hits JOIN shop_product p ON p.id = hits.id
+            {category_sql} ORDER BY hits.score, hits.id LIMIT %s OFFSET %s
+        )"""
+    params = [fts_query(words)] + ([category] if category else []) + [limit, offset]
+    facets, ids = [], []
+    with connections[router.db_for_read(Product)].cursor() as cur:  # the replica under @replica_reads
+        cur.execute(sql, params)
+        for kind, pk, cat, value in cur.fetchall():
+            if kind == 'f':
+                facets.append((cat, value))
+            else:
+                ids.append(pk)
+    return facets, ids
+
+
+def _fallback_hits(words, category, limit, offset):
+    cond = Q()
+    for w in words:
+        cond &= Q(name__icontains=w) | Q(description__icontains=w) | Q(category__icontains=w)
+    qs = Product.objects.filter(cond)
+    facets = list(qs.values_list('category').annotate(n=Count('id')))
+    if category:
+        qs = qs.filter(category=category)
+    ids = list(qs.order_by('-id').values_list('id', flat=True)[offset:offset + limit])
+    return facets, ids
+
+
+def search_products(q, category=None, page=1, per_page=24):
+    words = terms(q)
+    if not words:
+        return SearchResult([], [], 0, 1, per_page)
+    page = max(1, page)
+    hits = _fts_hits if uses_fts() else _fallback_hits
+    facets, ids = hits(words, category, per_page, (page - 1) * per_page)
+    facets.sort(key=lambda f: (-f[1], f[0]))
+    counts = dict(facets)
+    total = counts.get(category, 0) if category else sum(counts.values())
+    by_id = with_primary_image(Product.objects.filter(id__in=ids)).in_bulk()
+    products = [by_id[pk] for pk in ids if pk in by_id]
+    return SearchResult(products, facets, total, page, per_page)
@@ -0,0 +1,142 @@
+# shop/sessions.py - cache-first session engine (SESSION_ENGINE = 'shop.sessions')
+# Sessions are read from and written to the cache; django_session is only the durable copy.
+# - a save whose data is byte-for-byte what was loaded is skipped
+# - anonymous sessions (in practice just the cart token, see cart.py) live only in the cache,
+#   like the carts they point to, so browsing and carting never write a session row
+# - logged-in sessions are written through immediately when the login itself changes, otherwise
+#   buffered per process and upserted in batches: at FLUSH_BATCH rows, or by a timer PERSIST_AFTER
+#   seconds after the first buffered change, so a quiet process still persists them
+# Expired rows are removed by purge_expired() in short batches (also what `clearsessions` runs).
+import atexit
+import hashlib
+import logging
+import threading
+from asgiref.sync import sync_to_async
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.contrib.sessions.models import Session
+from django.db import connections
+from django.utils import timezone
+from .bulk import delete_in_batches
+
+logger = logging.getLogger(__name__)
+
+PERSIST_AFTER = 30  # seconds a changed logged-in session may exist only in the cache
+FLUSH_BATCH = 200
+PURGE_BATCH = 1000
+_pending = {}  # {session_key: (session_data, expire_date)} waiting for the next flush
+_timer = None  # flushes _pending PERSIST_AFTER seconds after it stopped being empty
+_lock = threading.Lock()
+
+
+def _upsert(rows):
+    Session.objects.bulk_create(
+        [Session(session_key=key, session_data=data, expire_date=expires) for key, (data, expires) in rows],
+        update_conflicts=True, unique_fields=['session_key'], update_fields=['session_data', 'expire_date'])
+
+
+def _schedule():
+    # with _lock held
+    global _timer
+    if _timer is None:
+        _timer = threading.Timer(PERSIST_AFTER, _flush_on_timer)
+        _timer.daemon = True
+        _timer.start()
+
+
+def flush_pending():
+    global _timer
+    with _lock:
+        rows = list(_pending.items())
+        _pending.clear()
+        if _timer is not None:
+            _timer.cancel()  # a no-op when called from the timer itself
+            _timer = None
+    if not rows:
+        return
+    try:
+        _upsert(rows)
+    except Exception:
+        with _lock:
+            for key, row in rows:
+                _pending.setdefault(key, row)  # a newer save made meanwhile wins
+            _schedule()
+        raise
+
+
+def _flush_on_timer():
+    try:
+        flush_pending()
+    except Exception:
+        logger.exception('flushing deferred sessions failed; retrying in %ss', PERSIST_AFTER)
+    finally:
+        connections.close_all()  # this thread's own connections
+
+
+atexit.register(flush_pending)
+
+
+def _defer(key, data, expires):
+    with _lock:
+        _pending[key] = (data, expires)
+        _schedule()
+        due = len(_pending) >= FLUSH_BATCH
+    if due:
+        flush_pending()
+
+
+def purge_expired(batch_size=PURGE_BATCH):
+    # bounded DELETEs over the expire_date index instead of one table-wide statement
+    return delete_in_batches(Session.objects.filter(expire_date__lt=timezone.now()), batch_size)
+
+
+class SessionStore(CachedDBStore):
+    cache_key_prefix = 'shop.sessions'
+    _loaded = None  # fingerprint and login of the data as loaded; None for a new session
+
+    def _fingerprint(self, data):
+        return hashlib.sha256(self.serializer().dumps(data)).digest(), data.get(SESSION_KEY), data.get(HASH_SESSION_KEY)
+
+    def load(self):
+        data = super().load()
+        self._loaded = self._fingerprint(data)
+        return data
+
+    async def aload(self):
+        data = await super().aload()
+        self._loaded = self._fingerprint(data)
+        return data
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        current = self._fingerprint(data)
+        if not must_create and current == self._loaded:
+            return
+        age = self.get_expiry_age()
+        if must_create:
+            if not self._cache.add(self.cache_key, data, age):
+                raise CreateError
+        else:
+            self._cache.set(self.cache_key, data, age)
+        if current[1] is not None:
+            row = (self.encode(data), self.get_expiry_date())
+            if self._loaded is None or current[1:] != self._loaded[1:]:
+                _upsert([(self.session_key, row)])  # a login must survive losing the cache
+            else:
+                _defer(self.session_key, *row)
+        self._loaded = current
+
+    async def asave(self, must_create=False):
+        await sync_to_async(self.save)(must_create)
+
+    def delete(self, session_key=None):
+        with _lock:
+            _pending.pop(session_key or self.session_key, None)
+        super().delete(session_key)
+
+    @classmethod
+    def clear_expired(cls):
+        purge_expired()
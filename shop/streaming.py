@@ -0,0 +1,49 @@
+# shop/streaming.py - CSV/JSONL line generators for streamed exports
+# Rows go out as soon as they are produced, grouped into ~64KB chunks so a large export is a few
+# thousand writes to the client rather than one per row.
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+
+CHUNK_BYTES = 64 * 1024
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class _Echo:
+    # file-like whose write() returns the line, so csv.writer output can be yielded
+    def write(self, value):
+        return value
+
+
+def _formula_safe(value):
+    # text a spreadsheet would evaluate as a formula gets a leading quote; numbers are left as they are
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_lines(columns, rows, formula_safe=False):
+    # formula_safe for files meant to be opened in a spreadsheet rather than read back in
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        cells = [row[c] for c in columns]
+        yield writer.writerow([_formula_safe(v) for v in cells] if formula_safe else cells)
+
+
+def jsonl_lines(rows):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def chunked(lines, size=CHUNK_BYTES):
+    buf, length = [], 0
+    for line in lines:
+        buf.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(buf)
+            buf, length = [], 0
+    if buf:
+        yield ''.join(buf)
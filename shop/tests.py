@@ -1,3 +1,1119 @@
-from django.test import TestCase
+import csv
+import gzip
+import hashlib
+import io
+import json
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.db.models import Count, Q
+from django.http import HttpResponseRedirect
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import slugify
+from PIL import Image
+from . import (api, categories, counters, finance, fragments, idempotency, imaging, jobs, product_io, receipts, reservations,
+               review, rollups, sessions)
+from .cart import Cart, user_cart_key
+from .catalog import with_availability
+from .checkout import CheckoutError, OutOfStock, place_order
+from .models import (CategoryCount, IdempotencyKey, Job, ManualPayment, Order, OrderItem, Product, ProductImage, SalesRollup,
+                     StockHold, User, WalletEntry)
+from .profiling import QueryBudgetMixin, fingerprint, profile_queries
+from .routers import REPLICA, ReadReplicaRouter, reading_from_replica
+from .search import search_products
+from .wallet import InsufficientFunds, balance_at, get_wallet, post_entry, statement
 
-# Create your tests here.
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    # Budgets for the busiest views. Each page is rendered over enough rows that a per-row query
+    # would both break the budget and show up as a repeated shape.
+    ROWS = 15
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        cls.customer = User.objects.create_user('customer', password='x')
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.products = [
+            Product.objects.create(vendor=cls.vendor, name=f'Product {i}', slug=f'product-{i}', price_mwk=100 + i,
+                                   stock_quantity=1000, category='Phones' if i % 2 else 'Shoes')
+            for i in range(cls.ROWS)
+        ]
+        ProductImage.objects.bulk_create([ProductImage(product=p, image=f'products/{p.slug}.jpg') for p in cls.products])
+        for p in cls.products:
+            order = place_order(cls.customer, [(p.pk, 1, p.price_mwk)], 'Area 47, Lilongwe', 'manual')
+            ManualPayment.objects.create(order=order, payer_name='C', msisdn='0999', method='mobile_money',
+                                         reference_code=f'REF{p.pk}')
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, budget, name):
+        response = self.assertQueryBudget(budget, self.client.get, reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_home(self):
+        self.get(4, 'home')  # page + fragment misses (products, images) + product count
+        self.get(1, 'home')  # warm: the page query only
+
+    def test_category(self):
+        url = reverse('category', args=['Phones'])
+        self.assertQueryBudget(5, self.client.get, url)  # nav, page, fragment misses (products, images)
+        response = self.assertQueryBudget(2, self.client.get, url, {'sort': '-price', 'in_stock': 'on'})
+        self.assertEqual(len(response.context['page_obj']), self.ROWS // 2)
+
+    def test_checkout(self):
+        self.client.force_login(self.customer)
+        cart = Cart.load(user_cart_key(self.customer), self.customer)
+        cart.apply({p.pk: 1 for p in self.products})
+        self.get(2, 'checkout')  # session + user
+
+    def test_vendor_orders(self):
+        self.client.force_login(self.vendor)
+        self.get(3, 'vendor_orders')
+
+    def test_dashboard_customer(self):
+        self.client.force_login(self.customer)
+        self.get(3, 'dashboard_customer')  # user, orders, items with products
+
+    def test_order_detail(self):
+        self.client.force_login(self.customer)
+        order = Order.objects.filter(customer=self.customer).first()
+        response = self.assertQueryBudget(3, self.client.get, reverse('order_detail', args=[order.pk]))
+        self.assertContains(response, order.items.get().product.name)
+
+    def test_dashboard_vendor(self):
+        self.client.force_login(self.vendor)
+        self.get(7, 'dashboard_vendor')
+
+    def test_dashboard_admin(self):
+        self.client.force_login(self.admin)
+        self.get(2, 'dashboard_admin')  # user, counters
+
+    def test_admin_worklists(self):
+        self.client.force_login(self.admin)
+        for name in counters.SOURCES:
+            response = self.assertQueryBudget(3, self.client.get, reverse('admin_worklist', args=[name]))
+            self.assertEqual(response.status_code, 200)
+
+    def test_manual_review(self):
+        self.client.force_login(self.admin)
+        self.client.post(reverse('manual_review'), {'action': 'claim'})
+        self.get(4, 'manual_review')
+
+
+class OrderHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        cls.customer = User.objects.create_user('customer', password='x')
+        product = Product.objects.create(vendor=vendor, name='Kettle', slug='kettle', price_mwk=100, stock_quantity=500)
+        orders = [place_order(cls.customer, [(product.pk, 1 + i % 3, 100)], 'Area 47', 'cod') for i in range(45)]
+        # backdated out of id order, with ties, as seed_data and imports leave them
+        now = timezone.now().replace(microsecond=0)
+        for i, order in enumerate(orders):
+            order.created_at = now - timedelta(hours=(i * 7) % 45 // 2)
+        Order.objects.bulk_update(orders, ['created_at'])
+
+    def test_pages_cover_every_order_once(self):
+        self.client.force_login(self.customer)
+        expected = list(Order.objects.filter(customer=self.customer).order_by('-created_at', '-id'))
+        seen, params, pages = [], {}, []
+        while True:
+            page = self.client.get(reverse('dashboard_customer'), params).context['page_obj']
+            pages.append(page)
+            seen += page.object_list
+            if not page.has_next:
+                break
+            params = {'after': page.next_cursor}
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(pages), 3)
+        back = self.client.get(reverse('dashboard_customer'), {'before': pages[2].previous_cursor}).context['page_obj']
+        self.assertEqual(list(back), list(pages[1]))
+        self.assertEqual([(o.line_count, o.item_count) for o in seen[:3]],
+                         [(1, o.items.get().quantity) for o in seen[:3]])
+
+    def test_anonymous_is_sent_to_login(self):
+        response = self.client.get(reverse('dashboard_customer'))
+        self.assertRedirects(response, f"{reverse('login')}?next={reverse('dashboard_customer')}", fetch_redirect_response=False)
+
+    def test_other_customers_orders_are_hidden(self):
+        other = User.objects.create_user('other', password='x')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('order_detail', args=[Order.objects.first().pk])).status_code, 404)
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        other = User.objects.create_user('other', password='x', role=User.VENDOR, vendor_approved=True)
+        cls.customer = User.objects.create_user('customer', password='x')
+        cls.kettle = Product.objects.create(vendor=vendor, name='Kettle', slug='kettle', price_mwk=100, stock_quantity=5)
+        cls.pot = Product.objects.create(vendor=vendor, name='Pot', slug='pot', price_mwk=250, stock_quantity=2)
+        cls.pan = Product.objects.create(vendor=other, name='Pan', slug='pan', price_mwk=300, stock_quantity=10)
+
+    def stock(self):
+        return dict(Product.objects.values_list('slug', 'stock_quantity'))
+
+    def test_bulk_insert_creates_every_line(self):
+        order = place_order(self.customer, [(self.kettle.pk, 2, 100), (self.pot.pk, 1, 250), (self.pan.pk, 3, 300)],
+                            'Area 47', 'cod')
+        self.assertEqual(sorted(order.items.values_list('product__slug', 'quantity', 'unit_price_mwk')),
+                         [('kettle', 2, 100), ('pan', 3, 300), ('pot', 1, 250)])
+        self.assertEqual((order.line_count, order.item_count, order.total_amount_mwk), (3, 6, 1350))
+        self.assertEqual(sorted(order.vendor_orders.values_list('subtotal_mwk', flat=True)), [450, 900])
+        self.assertEqual(self.stock(), {'kettle': 3, 'pot': 1, 'pan': 7})
+
+    def test_short_line_rolls_back_the_whole_order(self):
+        before = self.stock()
+        # the short line comes after lines that were already decremented
+        with self.assertRaises(OutOfStock) as raised:
+            place_order(self.customer, [(self.kettle.pk, 2, 100), (self.pan.pk, 1, 300), (self.pot.pk, 3, 250)],
+                        'Area 47', 'cod')
+        self.assertEqual(raised.exception.product.pk, self.pot.pk)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(self.stock(), before)
+
+
+class CodCollectedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        cls.other = User.objects.create_user('other', password='x', role=User.VENDOR, vendor_approved=True)
+        customer = User.objects.create_user('customer', password='x')
+        kettle = Product.objects.create(vendor=cls.vendor, name='Kettle', slug='kettle', price_mwk=100, stock_quantity=5)
+        pan = Product.objects.create(vendor=cls.other, name='Pan', slug='pan', price_mwk=300, stock_quantity=5)
+        cls.order = place_order(customer, [(kettle.pk, 2, 100), (pan.pk, 1, 300)], 'Area 47', 'cod')
+        cls.mine = cls.order.vendor_orders.get(vendor=cls.vendor)
+        cls.theirs = cls.order.vendor_orders.get(vendor=cls.other)
+
+    def collect(self, vendor_order, method='post'):
+        return getattr(self.client, method)(reverse('vendor_cod_collected', args=[vendor_order.pk]))
+
+    def test_get_changes_nothing(self):
+        self.client.force_login(self.vendor)
+        self.assertEqual(self.collect(self.mine, 'get').status_code, 405)
+        self.mine.refresh_from_db()
+        self.assertEqual(self.mine.status, 'pending')
+
+    def test_vendor_cannot_collect_another_vendors_sub_order(self):
+        self.client.force_login(self.vendor)
+        self.assertEqual(self.collect(self.theirs).status_code, 404)
+        self.theirs.refresh_from_db()
+        self.assertEqual(self.theirs.status, 'pending')
+
+    def test_order_is_paid_once_every_sub_order_is_collected(self):
+        self.client.force_login(self.vendor)
+        self.assertRedirects(self.collect(self.mine), reverse('vendor_orders'))
+        self.collect(self.mine)  # a second submit records nothing more
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'pending')
+        self.assertEqual(counters.read()[counters.UNPAID_COD], 1)
+
+        self.client.force_login(self.other)
+        self.collect(self.theirs)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'paid')
+        self.assertEqual(counters.read()[counters.UNPAID_COD], 0)
+        self.assertEqual(sorted(self.order.payments.filter(status='success').values_list('amount_mwk', flat=True)), [200, 300])
+        self.assertEqual(set(self.order.vendor_orders.values_list('status', flat=True)), {'paid'})
+
+
+class StockHoldTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        cls.customer = User.objects.create_user('customer', password='x')
+        cls.kettle = Product.objects.create(vendor=vendor, name='Kettle', slug='kettle', price_mwk=100, stock_quantity=5)
+
+    def available(self):
+        return with_availability(Product.objects.filter(pk=self.kettle.pk)).get().available_quantity
+
+    def test_holds_reduce_what_other_carts_can_have(self):
+        held, errors = reservations.place_holds('cart-a', {self.kettle.pk: 3})
+        self.assertEqual(([p.pk for p in held], errors), ([self.kettle.pk], []))
+        self.assertEqual(self.available(), 2)
+        held, errors = reservations.place_holds('cart-b', {self.kettle.pk: 3})
+        self.assertEqual((held, [e.product.pk for e in errors]), ([], [self.kettle.pk]))
+        reservations.place_holds('cart-a', {self.kettle.pk: 1})  # replaces the cart's hold
+        self.assertEqual(self.available(), 4)
+
+        with self.assertRaises(OutOfStock):
+            place_order(self.customer, [(self.kettle.pk, 5, 100)], 'Area 47', 'cod', cart_key='cart-b')
+        place_order(self.customer, [(self.kettle.pk, 5, 100)], 'Area 47', 'cod', cart_key='cart-a')
+        self.assertFalse(StockHold.objects.exists())  # consumed by the order
+
+    def test_expired_holds_stop_counting_and_are_swept(self):
+        reservations.place_holds('cart-a', {self.kettle.pk: 3})
+        reservations.place_holds('cart-b', {self.kettle.pk: 1})
+        StockHold.objects.filter(cart_key='cart-a').update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.available(), 4)
+        out = io.StringIO()
+        call_command('sweep_holds', batch_size=1, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Removed 1 expired holds.')
+        self.assertEqual(list(StockHold.objects.values_list('cart_key', flat=True)), ['cart-b'])
+
+
+class CounterTests(TestCase):
+    # every instrumented write path must leave the counters where a full recount would put them
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True, role=User.ADMIN)
+        cls.vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        cls.customer = User.objects.create_user('customer', password='x')
+        cls.product = Product.objects.create(vendor=cls.vendor, name='Kettle', slug='kettle', price_mwk=100,
+                                             stock_quantity=counters.LOW_STOCK + 2)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertCounts(self, **expected):
+        totals = counters.read()
+        self.assertEqual(totals, {name: rows().count() for name, rows in counters.SOURCES.items()})
+        for name, value in expected.items():
+            self.assertEqual(totals[name], value, name)
+
+    def test_write_paths(self):
+        self.assertCounts(pending_vendors=0, submitted_receipts=0, unpaid_cod=0, low_stock=0)
+        self.client.post(reverse('signup_vendor'), {'username': 'newshop', 'email': 'n@example.com', 'display_name': 'New',
+                                                    'password1': 'S3cret-pass!', 'password2': 'S3cret-pass!'})
+        self.assertCounts(pending_vendors=1)
+        self.client.force_login(self.admin)
+        pending = User.objects.get(username='newshop')
+        self.client.get(reverse('approve_vendor', args=[pending.pk]))
+        self.client.get(reverse('approve_vendor', args=[pending.pk]))
+        self.assertCounts(pending_vendors=0)
+
+        cod = place_order(self.customer, [(self.product.pk, 2, 100)], 'Area 47', 'cod')
+        manual = place_order(self.customer, [(self.product.pk, 1, 100)], 'Area 47', 'manual')
+        self.assertCounts(unpaid_cod=1, low_stock=1)
+        self.client.force_login(self.customer)
+        for order in (manual, cod):
+            self.client.post(reverse('manual_submit', args=[order.pk]), {
+                'payer_name': 'C', 'msisdn': '0999', 'method': 'mobile_money', 'reference_code': f'R{order.pk}'})
+        self.assertCounts(submitted_receipts=2)
+        self.client.force_login(self.admin)
+        self.client.post(reverse('manual_review'), {'action': 'claim'})
+        self.client.post(reverse('manual_review'), {'action': 'approve', 'ids': list(
+            ManualPayment.objects.values_list('id', flat=True))})
+        self.assertCounts(submitted_receipts=0, unpaid_cod=0)
+
+        self.client.force_login(self.vendor)
+        self.client.post(reverse('product_update', args=[self.product.pk]), {
+            'name': 'Kettle', 'slug': 'kettle', 'description': '', 'price_mwk': 100, 'stock_quantity': 50,
+            'category': 'Kitchen', 'images-TOTAL_FORMS': 0, 'images-INITIAL_FORMS': 0})
+        self.assertCounts(low_stock=0)
+
+    def test_recount_repairs_drift(self):
+        counters.bump(counters.UNPAID_COD, 7)
+        counters.recount()
+        self.assertCounts(unpaid_cod=0)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+
+    def add(self, name, description='', category='Kitchen'):
+        return Product.objects.create(vendor=self.vendor, name=name, slug=slugify(f'{name}-{Product.objects.count()}'),
+                                      description=description, price_mwk=100, stock_quantity=5, category=category)
+
+    def found(self, q, **kwargs):
+        return [p.pk for p in search_products(q, **kwargs).products]
+
+    def test_name_matches_rank_above_description_matches(self):
+        teapot = self.add('Teapot', 'Pours like a kettle, a kettle, a kettle')
+        kettle = self.add('Kettle', 'Stainless steel')
+        self.assertEqual(self.found('kettle'), [kettle.pk, teapot.pk])
+
+    def test_last_term_matches_as_a_prefix(self):
+        kettle = self.add('Electric kettle', 'Stainless steel')
+        self.add('Kettlebell', 'Cast iron', category='Sport')
+        self.assertEqual(set(self.found('kett')), set(Product.objects.values_list('pk', flat=True)))
+        self.assertEqual(self.found('stainless kett'), [kettle.pk])
+        self.assertEqual(self.found('kett stainless'), [])  # only the last term is a prefix
+
+    def test_category_facets_and_filtered_pages(self):
+        kitchen = [self.add(f'Lamp {i}') for i in range(5)]
+        garden = [self.add(f'Lamp {i}', category='Garden') for i in range(2)]
+        self.add('Chair', category='Garden')
+        result = search_products('lamp', per_page=2)
+        self.assertEqual((result.facets, result.total), ([('Kitchen', 5), ('Garden', 2)], 7))
+
+        seen, page = [], 1
+        while True:
+            result = search_products('lamp', category='Kitchen', page=page, per_page=2)
+            self.assertEqual(result.total, 5)
+            self.assertEqual(result.facets, [('Kitchen', 5), ('Garden', 2)])  # facets ignore the filter
+            seen += [p.pk for p in result.products]
+            if not result.has_next:
+                break
+            page = result.next_page_number
+        self.assertEqual((page, sorted(seen)), (3, sorted(p.pk for p in kitchen)))
+        self.assertFalse(set(seen) & {p.pk for p in garden})
+
+    def test_index_follows_updates_and_deletes(self):
+        product = self.add('Kettle', 'Stainless steel')
+        Product.objects.filter(pk=product.pk).update(name='Teapot', category='Tea')  # no signals, triggers only
+        self.assertEqual(self.found('kettle'), [])
+        self.assertEqual(self.found('teapot'), [product.pk])
+        self.assertEqual(search_products('teapot').facets, [('Tea', 1)])
+        Product.objects.filter(pk=product.pk).update(price_mwk=250)
+        self.assertEqual(self.found('steel'), [product.pk])
+        product.delete()
+        self.assertEqual(self.found('teapot'), [])
+
+
+class CategoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        Product.objects.bulk_create([
+            Product(vendor=cls.vendor, name=f'Phone {i}', slug=f'phone-{i}', price_mwk=(i % 7) * 100,
+                    stock_quantity=i % 3, category='Phones')
+            for i in range(30)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def assertCountsMatch(self):
+        grouped = {row['category']: (row['n'], row['s']) for row in Product.objects.values('category').annotate(
+            n=Count('id'), s=Count('id', filter=Q(stock_quantity__gt=0)))}
+        self.assertEqual({c.name: (c.products, c.in_stock) for c in CategoryCount.objects.all()}, grouped)
+
+    def test_triggers_follow_every_write(self):
+        self.assertCountsMatch()
+        kettle = Product.objects.create(vendor=self.vendor, name='Kettle', slug='kettle', price_mwk=5, category='Kitchen')
+        self.assertCountsMatch()
+        Product.objects.filter(category='Phones', stock_quantity=0).update(stock_quantity=4)
+        Product.objects.filter(slug='phone-1').update(category='Kitchen')
+        kettle.stock_quantity = 2
+        kettle.save()
+        self.assertCountsMatch()
+        Product.objects.filter(category='Kitchen').delete()
+        self.assertCountsMatch()
+        self.assertFalse(CategoryCount.objects.filter(name='Kitchen').exists())
+        self.assertEqual(categories.nav(), [('Phones', 29, 29)])
+
+    def test_filters_and_sorts_page_through(self):
+        filters = {'min_price': 200, 'in_stock': True, 'sort': '-price'}
+        expected = list(Product.objects.filter(category='Phones', price_mwk__gte=200, stock_quantity__gt=0)
+                        .order_by('-price_mwk', '-id'))
+        pages, params = [], {}
+        while True:
+            pages.append(categories.browse('Phones', filters, params, per_page=4))
+            if not pages[-1].has_next:
+                break
+            params = {'after': pages[-1].next_cursor}
+        self.assertEqual([p for page in pages for p in page], expected)
+        back = categories.browse('Phones', filters, {'before': pages[-1].previous_cursor}, per_page=4)
+        self.assertEqual(list(back), list(pages[-2]))
+        response = self.client.get(reverse('category', args=['Phones']), {'sort': 'price', 'max_price': 100})
+        self.assertEqual([p.price_mwk for p in response.context['page_obj']], [0] * 5 + [100] * 5)
+        self.assertEqual(self.client.get(reverse('category', args=['Nope'])).status_code, 404)
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        cls.products = Product.objects.bulk_create([
+            Product(vendor=vendor, name=f'Kettle {i}', slug=f'kettle-{i}', price_mwk=100 + i, stock_quantity=i,
+                    category='Kitchen' if i % 2 else 'Garden')
+            for i in range(30)
+        ])
+        ProductImage.objects.bulk_create([ProductImage(product=p, image=f'products/{p.slug}.jpg') for p in cls.products[:5]])
+
+    def get(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        return response.status_code, response.json()
+
+    def test_products_page_through(self):
+        with self.assertNumQueries(2):  # products with holds, images
+            status, body = self.get('api_products', limit=20)
+        self.assertEqual(status, 200)
+        newest = body['data'][0]
+        self.assertEqual(set(newest), set(api.DEFAULT_FIELDS))
+        self.assertEqual((newest['slug'], newest['available'], newest['url']), ('kettle-29', 29, '/p/kettle-29/'))
+        self.assertIsNone(body['previous'])
+        _, rest = self.get('api_products', limit=20, after=body['next'])
+        self.assertEqual([p['id'] for p in body['data'] + rest['data']], [p.pk for p in reversed(self.products)])
+        self.assertIsNone(rest['next'])
+        self.assertTrue(rest['data'][-1]['image'].endswith('/products/kettle-0.jpg'))
+
+    def test_sparse_fields_and_filters(self):
+        with self.assertNumQueries(1):
+            _, body = self.get('api_products', fields='name,price_mwk,vendor', category='Kitchen', limit=100)
+        self.assertEqual(len(body['data']), 15)
+        self.assertEqual(body['data'][0], {'name': 'Kettle 29', 'price_mwk': 129, 'vendor': 'vendor'})
+        self.assertEqual(self.get('api_products', fields='name,secret')[0], 400)
+        self.assertEqual(self.get('api_products', limit=1000)[0], 400)
+
+    def test_batch_keeps_order(self):
+        ids = [self.products[3].pk, 999999, self.products[1].pk]
+        _, body = self.get('api_products_batch', ids=','.join(map(str, ids)), fields='id,slug')
+        self.assertEqual(body, {'data': [{'id': ids[0], 'slug': 'kettle-3'}, {'id': ids[2], 'slug': 'kettle-1'}],
+                                'missing': [999999]})
+        self.assertEqual(self.get('api_products_batch', ids='1,x')[0], 400)
+        self.assertEqual(self.get('api_products_batch')[0], 400)
+
+    def test_categories_and_gzip(self):
+        self.assertEqual(self.get('api_categories')[1]['data'], [
+            {'name': 'Garden', 'products': 15, 'in_stock': 14}, {'name': 'Kitchen', 'products': 15, 'in_stock': 15}])
+        response = self.client.get(reverse('api_products'), {'limit': 30}, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content))['data'][0]['slug'], 'kettle-29')
+        self.assertEqual(self.client.post(reverse('api_products')).status_code, 405)
+
+
+class WalletTopUpTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        cls.customer = User.objects.create_user('customer', password='x')
+
+    def setUp(self):
+        self.client.force_login(self.customer)
+
+    def topup(self, amount, ref):
+        return self.client.post(reverse('topup_wallet'), {'amount_mwk': amount, 'payer_name': 'C', 'msisdn': '0999',
+                                                          'method': 'mobile_money', 'reference_code': ref})
+
+    def test_credited_only_when_approved(self):
+        self.assertRedirects(self.topup(5000, 'T1'), reverse('wallet_detail'))
+        self.topup(700, 'T2')
+        wallet = get_wallet(self.customer)
+        self.assertEqual((wallet.balance_mwk, wallet.entries.count()), (0, 0))
+        self.assertEqual(counters.read()[counters.SUBMITTED_RECEIPTS], 2)
+        first, second = ManualPayment.objects.order_by('id')
+        review.claim_batch(self.admin)
+        review.decide(self.admin, [first.pk], approve=True)
+        review.decide(self.admin, [first.pk, second.pk], approve=False)  # the approved one is not decided again
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance_mwk, 5000)
+        self.assertEqual(list(wallet.entries.values_list('kind', 'amount_mwk')), [(WalletEntry.TOPUP, 5000)])
+
+    def test_rejected_by_the_form(self):
+        self.assertEqual(self.topup(50, 'T3').status_code, 200)
+        self.assertFalse(ManualPayment.objects.exists())
+
+
+def _png():
+    buf = io.BytesIO()
+    Image.new('RGB', (4, 4)).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+class WalletLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        cls.customer = User.objects.create_user('customer', password='x')
+        cls.kettle = Product.objects.create(vendor=vendor, name='Kettle', slug='kettle', price_mwk=100, stock_quantity=5)
+
+    def setUp(self):
+        self.wallet = get_wallet(self.customer)
+
+    def buy(self, qty):
+        return place_order(self.customer, [(self.kettle.pk, qty, 100)], 'Area 47', 'wallet')
+
+    def test_top_up_then_pay_at_checkout(self):
+        post_entry(self.wallet.pk, 1000, WalletEntry.TOPUP)
+        order = self.buy(2)
+        self.wallet.refresh_from_db()
+        self.assertEqual((self.wallet.balance_mwk, self.wallet.entry_count), (800, 2))
+        self.assertEqual(list(self.wallet.entries.order_by('id').values_list('kind', 'amount_mwk', 'order')),
+                         [(WalletEntry.TOPUP, 1000, None), (WalletEntry.ORDER, -200, order.pk)])
+        self.assertEqual(order.payment_status, 'paid')
+        self.assertEqual(list(order.payments.values_list('provider', 'status')), [('wallet', 'success')])
+
+    def test_insufficient_funds_roll_the_order_back(self):
+        post_entry(self.wallet.pk, 100, WalletEntry.TOPUP)
+        with self.assertRaises(CheckoutError) as raised:
+            self.buy(2)
+        self.assertNotIsInstance(raised.exception, OutOfStock)
+        self.assertFalse(Order.objects.exists())
+        self.kettle.refresh_from_db()
+        self.wallet.refresh_from_db()
+        self.assertEqual((self.kettle.stock_quantity, self.wallet.balance_mwk, self.wallet.entries.count()), (5, 100, 1))
+        with self.assertRaises(InsufficientFunds):
+            post_entry(self.wallet.pk, -101, WalletEntry.ORDER)
+
+    @mock.patch('shop.wallet.SNAPSHOT_EVERY', 3)
+    def test_snapshots_and_replayed_balances(self):
+        amounts = [500, -120, 300, -80, 1000, -400, 50]
+        entries = [post_entry(self.wallet.pk, amount, WalletEntry.TOPUP if amount > 0 else WalletEntry.ORDER)
+                   for amount in amounts]
+        self.assertEqual(list(self.wallet.snapshots.order_by('entry_id').values_list('entry_id', 'balance_mwk')),
+                         [(entries[2].pk, 680), (entries[5].pk, 1200)])
+        for entry in entries:
+            replayed = sum(e.amount_mwk for e in entries if e.created_at <= entry.created_at)
+            self.assertEqual(balance_at(self.wallet, entry.created_at), replayed)
+        self.assertEqual(balance_at(self.wallet, entries[0].created_at - timedelta(seconds=1)), 0)
+
+        page = statement(self.wallet, {}, per_page=4)
+        older = statement(self.wallet, {'after': page.next_cursor}, per_page=4)
+        running = [(e.pk, e.balance_after_mwk) for e in list(page.object_list) + list(older.object_list)]
+        self.assertEqual(running, [(e.pk, sum(amounts[:i + 1])) for i, e in reversed(list(enumerate(entries)))])
+
+
+class ReviewLeaseTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='x', is_staff=True)
+        cls.bob = User.objects.create_user('bob', password='x', is_staff=True)
+        ManualPayment.objects.bulk_create([
+            ManualPayment(payer_name='C', msisdn='0999', method='mobile_money', reference_code=f'R{i}') for i in range(5)])
+
+    def batch(self, reviewer):
+        return set(review.my_batch(reviewer).values_list('id', flat=True))
+
+    def test_two_reviewers_never_claim_the_same_row(self):
+        review.claim_batch(self.alice, size=3)
+        review.claim_batch(self.bob, size=3)
+        review.claim_batch(self.alice, size=3)  # renewing a lease takes none of the other reviewer's rows
+        alice, bob = self.batch(self.alice), self.batch(self.bob)
+        self.assertEqual((len(alice), len(bob)), (3, 2))
+        self.assertFalse(alice & bob)
+
+    def test_expired_lease_is_claimed_again(self):
+        review.claim_batch(self.alice, size=5)
+        ManualPayment.objects.update(claimed_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.batch(self.alice), set())
+        review.claim_batch(self.bob, size=5)
+        self.assertEqual(len(self.batch(self.bob)), 5)
+        self.assertEqual(review.decide(self.alice, list(self.batch(self.bob)), approve=False), 0)
+
+    def test_decide_skips_rows_leased_by_someone_else(self):
+        review.claim_batch(self.alice, size=2)
+        review.claim_batch(self.bob, size=3)
+        alice, bob = self.batch(self.alice), self.batch(self.bob)
+        self.assertEqual(review.decide(self.alice, list(alice | bob), approve=False), 2)
+        self.assertEqual(set(ManualPayment.objects.filter(status='rejected').values_list('id', flat=True)), alice)
+        self.assertEqual(set(ManualPayment.objects.filter(status='submitted', reviewed_by=None).values_list('id', flat=True)), bob)
+        self.assertEqual(self.batch(self.bob), bob)
+
+
+
+class ReceiptTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        patcher = override_settings(MEDIA_ROOT=media.name)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        inline = mock.patch.object(imaging, 'WORKERS', 0)  # IMAGE_WORKERS=0: jobs run on commit, in this thread
+        inline.start()
+        self.addCleanup(inline.stop)
+        buf = io.BytesIO()
+        Image.new('RGB', (3200, 1200), 'navy').save(buf, 'PNG')
+        self.upload = buf.getvalue()
+
+    def submit(self, ref):
+        mp = ManualPayment.objects.create(payer_name='C', msisdn='0999', method='mobile_money', reference_code=ref,
+                                          receipt_image=SimpleUploadedFile('receipt.png', self.upload))
+        with self.captureOnCommitCallbacks(execute=True):
+            receipts.enqueue(mp)
+        mp.refresh_from_db()
+        return mp
+
+    def test_receipts_are_downscaled_hashed_and_linked(self):
+        first = self.submit('R1')
+        self.assertIsNotNone(first.receipt_processed_at)
+        self.assertEqual(first.receipt_sha256, hashlib.sha256(self.upload).hexdigest())
+        self.assertIsNone(first.duplicate_of_id)
+        with Image.open(first.receipt_image.path) as img:
+            self.assertEqual((img.format, img.size), ('JPEG', (receipts.MAX_PX, 600)))
+        with Image.open(first.receipt_thumb.path) as img:
+            self.assertEqual((img.format, img.size), ('JPEG', (receipts.THUMB_PX, 120)))
+        self.assertFalse(first.receipt_image.storage.exists('receipts/receipt.png'))  # the original is replaced
+
+        second = self.submit('R2')
+        self.assertEqual(second.duplicate_of_id, first.pk)
+        self.assertEqual(receipts.pending().count(), 0)
+
+
+class ImageDerivativeTests(TransactionTestCase):
+    # the backfill command builds on its own worker threads, which only see committed rows
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        patcher = override_settings(MEDIA_ROOT=media.name)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        cache.clear()
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        self.product = Product.objects.create(vendor=vendor, name='Kettle', slug='kettle', price_mwk=100, stock_quantity=5)
+        buf = io.BytesIO()
+        Image.new('RGB', (2400, 1200), 'teal').save(buf, 'PNG')
+        self.upload = buf.getvalue()
+
+    def sizes(self, image):
+        sizes = {}
+        for name in ProductImage.SIZES:
+            with Image.open(getattr(image, name).path) as img:
+                sizes[name] = img.size
+        return sizes
+
+    def test_upload_writes_every_derivative_and_pages_use_them(self):
+        image = ProductImage.objects.create(product=self.product, image=SimpleUploadedFile('kettle.png', self.upload))
+        image.refresh_from_db()
+        self.assertEqual(self.sizes(image), {'thumb': (160, 80), 'card': (480, 240), 'full': (1200, 600)})
+        home = self.client.get(reverse('home'))
+        self.assertContains(home, f'src="{image.card.url}" srcset="{image.thumb.url} 160w, {image.card.url} 480w"')
+        detail = self.client.get(reverse('product_detail', args=['kettle']))
+        self.assertContains(detail, f'src="{image.full.url}" srcset="{image.card.url} 480w, {image.full.url} 1200w"')
+        self.assertNotContains(detail, image.image.url)
+
+    def test_command_backfills_missing_derivatives(self):
+        name = ProductImage.image.field.storage.save('products/old.png', SimpleUploadedFile('old.png', self.upload))
+        old = ProductImage.objects.create(product=self.product, image=name)  # already stored: nothing is built
+        self.assertEqual((old.thumb.name, old.card.name, old.full.name), ('', '', ''))
+        out = io.StringIO()
+        call_command('build_image_derivatives', workers=2, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Built derivatives for 1 of 1 images.')
+        old.refresh_from_db()
+        self.assertEqual(self.sizes(old), {'thumb': (160, 80), 'card': (480, 240), 'full': (1200, 600)})
+
+
+class ProductImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+
+    def run_import(self, body, fmt):
+        return product_io.import_products(self.vendor, product_io.read_rows(io.BytesIO(body), fmt), batch_size=1)
+
+    def test_file_that_is_not_utf8_is_rejected_whole(self):
+        body = 'slug,name,price_mwk,stock_quantity,category\nkettle,Kettle,100,1,Home\ncafe,Café,200,1,Home\n'.encode('latin-1')
+        self.client.force_login(self.vendor)
+        response = self.client.post(reverse('product_import'), {'file': SimpleUploadedFile('products.csv', body)})
+        self.assertEqual(response.status_code, 200)
+        report = response.context['report']
+        self.assertEqual((report.created, report.failed), (0, 1))
+        self.assertEqual(report.errors[0][0], 3)
+        self.assertIn('not UTF-8', report.errors[0][2])
+        self.assertFalse(Product.objects.exists())  # not even the batch before the bad line
+
+    def test_unreadable_csv_lines_are_reported(self):
+        old = csv.field_size_limit(50)
+        self.addCleanup(csv.field_size_limit, old)
+        body = f'slug,name,price_mwk,stock_quantity,category\nkettle,Kettle,100,1,Home\npot,{"x" * 60},200,1,Home\npan,Pan,300,1,Home\n'.encode()
+        report = self.run_import(body, 'csv')
+        self.assertEqual((report.created, report.failed), (2, 1))
+        self.assertEqual(report.errors[0][0], 3)
+
+    def test_bad_jsonl_rows_are_reported(self):
+        lines = ['{"slug": "kettle", "name": "Kettle", "price_mwk": 100, "stock_quantity": 1, "category": "Home", "images": []}',
+                 '{"slug": "pot", "name": "Pot", "price_mwk": 100, "stock_quantity": 1, "category": "Home", "images": [1]}',
+                 '{"slug": "pan", "name": "Pan", "price_mwk": 100, "stock_quantity": 1, "category": "Home", "images": [null]}',
+                 '{"slug": "cup", ',
+                 '["not", "an", "object"]']
+        report = self.run_import('\n'.join(lines).encode(), 'jsonl')
+        self.assertEqual((report.created, report.failed), (1, 4))
+        self.assertEqual([(line, slug) for line, slug, _ in report.errors], [(2, 'pot'), (3, 'pan'), (4, ''), (5, '')])
+        self.assertEqual([message.split(':')[0] for _, _, message in report.errors],
+                         ['images', 'images', 'invalid JSON', 'not a JSON object'])
+
+
+@override_settings(PRODUCT_IMPORT_IMAGE_HOSTS=['cdn.example.com'])
+class ImportImageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        other = User.objects.create_user('other', password='x', role=User.VENDOR, vendor_approved=True)
+        cls.product = Product.objects.create(vendor=cls.vendor, name='Kettle', slug='kettle', price_mwk=100)
+        cls.spare = Product.objects.create(vendor=cls.vendor, name='Pot', slug='pot', price_mwk=100)
+        theirs = Product.objects.create(vendor=other, name='Pan', slug='pan', price_mwk=100)
+        ProductImage.objects.bulk_create([ProductImage(product=cls.product, image='products/kettle.jpg'),
+                                          ProductImage(product=cls.spare, image='products/pot.jpg'),
+                                          ProductImage(product=theirs, image='products/pan.jpg')])
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        patcher = override_settings(MEDIA_ROOT=media.name)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.fetched = []
+
+    def attach(self, value, body=b''):
+        def fetch(url, timeout):
+            self.fetched.append(url)
+            return io.BytesIO(body)
+        with mock.patch.object(product_io._opener, 'open', fetch), mock.patch.object(ProductImage, 'build_derivatives'):
+            product_io.attach_images(self.vendor.pk, [(self.product.pk, value)])
+        return list(ProductImage.objects.filter(product=self.product).values_list('image', flat=True))
+
+    def test_only_own_images_and_allowed_hosts(self):
+        rejected = ['products/pan.jpg', 'receipts/r1.jpg', '../../etc/passwd', 'file:///etc/passwd',
+                    'http://cdn.example.com/a.png', 'https://169.254.169.254/a.png', 'https://cdn.example.com.evil.io/a.png']
+        self.assertEqual(self.attach('|'.join(rejected)), ['products/kettle.jpg'])  # nothing stored: left alone
+        self.assertEqual(self.fetched, [])
+        self.assertEqual(self.attach('products/pot.jpg|https://cdn.example.com/x/../cat.png', _png()),
+                         ['products/pot.jpg', f'products/{hashlib.sha256(_png()).hexdigest()[:32]}.png'])
+
+    def test_downloads_must_be_small_images(self):
+        self.assertEqual(self.attach('https://cdn.example.com/a.png', b'<html>not an image</html>'), ['products/kettle.jpg'])
+        with mock.patch.object(product_io, 'MAX_IMAGE_BYTES', 10):
+            self.assertEqual(self.attach('https://cdn.example.com/a.png', _png()), ['products/kettle.jpg'])
+        self.assertEqual(len(self.fetched), 2)
+
+
+class FragmentTests(TransactionTestCase):
+    # outside a transaction, where the router would send catalog reads to the replica
+    def setUp(self):
+        cache.clear()
+
+    def test_misses_are_rendered_from_the_primary(self):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        product = Product.objects.create(vendor=vendor, name='Kettle', slug='kettle', price_mwk=100)
+        ProductImage.objects.create(product=product, image='products/kettle.jpg')
+        fragments.fragments([product], 'card')
+        Product.objects.filter(pk=product.pk).update(name='Electric kettle')
+        fragments.bump(product.pk)
+        product.refresh_from_db()  # the page's row, carrying the new version
+        # a replica alias that can't be opened: any read routed to it would raise
+        with mock.patch.dict(connections.settings, {REPLICA: {}}), reading_from_replica():
+            card = fragments.fragments([product], 'card')[product.pk]['card']
+        self.assertIn('Electric kettle', card)
+        self.assertIn('products/kettle.jpg', card)
+
+    def test_every_change_renews_the_version(self):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        product = Product.objects.create(vendor=vendor, name='Kettle', slug='kettle', price_mwk=100)
+        fragments.fragments([product], 'card')  # cached under the first version
+        seen = [product.fragment_version]
+        product.name = 'Electric kettle'
+        product.save()
+        seen.append(Product.objects.get(pk=product.pk).fragment_version)
+        ProductImage.objects.create(product=product, image='products/kettle.jpg')
+        seen.append(Product.objects.get(pk=product.pk).fragment_version)
+        self.assertEqual(len(set(seen)), 3)
+        # the version is on the row, so a worker whose cache never saw a bump still misses
+        self.assertIn('Electric kettle', fragments.fragments(Product.objects.all(), 'card')[product.pk]['card'])
+
+
+class RollupTests(TestCase):
+    def test_rebuild_matches_the_live_path_in_one_transaction(self):
+        admin = User.objects.create_user('admin', password='x', is_staff=True)
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        customer = User.objects.create_user('customer', password='x')
+        kettle = Product.objects.create(vendor=vendor, name='Kettle', slug='kettle', price_mwk=100, stock_quantity=50, category='Kitchen')
+        pot = Product.objects.create(vendor=vendor, name='Pot', slug='pot', price_mwk=250, stock_quantity=50, category='Kitchen')
+        with self.captureOnCommitCallbacks(execute=True):
+            orders = [place_order(customer, [(kettle.pk, 1 + i, 100), (pot.pk, 1, 250)], 'Area 47', 'manual') for i in range(5)]
+        for order in orders[:2]:
+            ManualPayment.objects.create(order=order, payer_name='C', msisdn='0999', method='mobile_money', reference_code=f'R{order.pk}')
+        review.claim_batch(admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            review.decide(admin, list(ManualPayment.objects.values_list('id', flat=True)), approve=True)
+        live = sorted(SalesRollup.objects.values_list(*rollups.COLUMNS))
+        self.assertTrue(live)
+
+        depth = len(connections['default'].atomic_blocks)
+        for _ in rollups.rebuild(batch_size=2):
+            self.assertEqual(len(connections['default'].atomic_blocks), depth + 1)
+        self.assertEqual(sorted(SalesRollup.objects.values_list(*rollups.COLUMNS)), live)
+
+    def test_top_products_keep_same_named_products_apart(self):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        customer = User.objects.create_user('customer', password='x')
+        small = Product.objects.create(vendor=vendor, name='Kettle', slug='kettle-1l', price_mwk=100, stock_quantity=50)
+        large = Product.objects.create(vendor=vendor, name='Kettle', slug='kettle-2l', price_mwk=300, stock_quantity=50)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(customer, [(small.pk, 4, 100), (large.pk, 1, 300)], 'Area 47', 'cod')
+        top = rollups.vendor_sales(vendor, 7)['top_products']
+        self.assertEqual([(p['product_id'], p['product__name'], p['units'], p['revenue']) for p in top],
+                         [(small.pk, 'Kettle', 4, 400), (large.pk, 'Kettle', 1, 300)])
+
+
+class FinanceExportTests(TestCase):
+    def test_order_counts_come_from_the_order_and_formulas_are_quoted(self):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        customer = User.objects.create_user('customer', password='x')
+        kettle = Product.objects.create(vendor=vendor, name='=HYPERLINK("http://x")', slug='kettle', price_mwk=100, stock_quantity=50)
+        pot = Product.objects.create(vendor=vendor, name='Pot', slug='pot', price_mwk=250, stock_quantity=50)
+        order = place_order(customer, [(kettle.pk, 3, 100), (pot.pk, 2, 250)], 'Area 47', 'cod')
+        start, end = finance.day_range(timezone.localdate(), timezone.localdate())
+
+        with self.assertNumQueries(2):  # the slice and the empty one that ends the walk; no item query
+            [row] = finance.order_rows(start, end)
+        self.assertEqual((row['line_count'], row['item_count']), (2, 5))
+        [row] = finance.order_rows(start, end, with_items=True)
+        self.assertEqual(sorted(i['quantity'] for i in row['items']), [2, 3])
+
+        body = ''.join(finance.export_lines('items', timezone.localdate(), timezone.localdate(), 'csv'))
+        self.assertIn("\"'=HYPERLINK(\"\"http://x\"\")\"", body)
+        self.assertNotIn(',=HYPERLINK', body)
+        self.assertIn(f'{order.pk},', body)
+
+
+class ProfilerTests(TestCase):
+    def test_in_lists_share_a_fingerprint(self):
+        self.assertEqual(fingerprint('SELECT 1 WHERE id IN (%s, %s, %s)'), fingerprint('SELECT 1 WHERE id IN (%s)'))
+
+    def test_repeated_shapes(self):
+        with profile_queries() as profile:
+            for i in range(3):
+                list(Product.objects.filter(pk=i))
+            Product.objects.count()
+        self.assertEqual(profile.count, 4)
+        self.assertEqual(list(profile.repeated.values()), [3])
+
+
+class ConditionalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        cls.product = Product.objects.create(vendor=vendor, name='Kettle', slug='k1', price_mwk=100, stock_quantity=5)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('product_detail', args=['k1'])
+        self.client.get(self.url)  # picks up the CSRF cookie the ETag covers
+        self.first = self.client.get(self.url)
+
+    def test_unchanged_page_is_not_modified(self):
+        self.assertEqual(self.first.status_code, 200)
+        self.assertNotIn('Last-Modified', self.first)
+        response = self.client.get(self.url, headers={'If-None-Match': self.first['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_a_hold_elsewhere_changes_the_page(self):
+        self.client_class().post(reverse('add_to_cart'), {'product_id': self.product.pk, 'qty': 2})
+        response = self.client.get(self.url, headers={'If-None-Match': self.first['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], self.first['ETag'])
+        since = self.client.get(self.url, headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        self.assertEqual(since.status_code, 200)
+
+
+class AsyncViewTests(TestCase):
+    # under ASGI the read pages resolve to shop.async_views and must behave like their sync twins
+    @classmethod
+    def setUpTestData(cls):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        cls.customer = User.objects.create_user('customer', password='x')
+        for i in range(3):
+            Product.objects.create(vendor=vendor, name=f'Kettle {i}', slug=f'kettle-{i}', price_mwk=100,
+                                   stock_quantity=5, category='Kitchen')
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_pages(self):
+        client = AsyncClient()
+        for name, args in (('home', ()), ('product_detail', ('kettle-1',)), ('search', ())):
+            response = await client.get(reverse(name, args=args), {'q': 'kettle'} if name == 'search' else {})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.resolver_match.func.__module__, 'shop.async_views')
+            self.assertContains(response, 'Kettle 1')
+        self.assertEqual((await client.get(reverse('product_detail', args=['nope']))).status_code, 404)
+        self.assertEqual((await client.get(reverse('wallet_detail'))).status_code, 302)
+        await client.aforce_login(self.customer)
+        self.assertEqual((await client.get(reverse('wallet_detail'))).status_code, 200)
+
+    async def test_not_modified(self):
+        client = AsyncClient()
+        await client.get(reverse('home'))  # picks up the CSRF cookie the ETag covers
+        response = await client.get(reverse('home'))
+        self.assertEqual((await client.get(reverse('home'), headers={'If-None-Match': response['ETag']})).status_code, 304)
+
+    def test_wsgi_keeps_sync_views(self):
+        self.assertEqual(self.client.get(reverse('home')).resolver_match.func.__module__, 'shop.views')
+
+
+class ReadReplicaRouterTests(SimpleTestCase):
+    databases = {'default'}
+    router = ReadReplicaRouter()
+
+    def setUp(self):
+        patcher = mock.patch.dict(connections.settings, {REPLICA: {}})  # routing only checks the alias exists
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_opt_in(self):
+        self.assertIsNone(self.router.db_for_read(Product))
+        with reading_from_replica():
+            self.assertEqual(self.router.db_for_read(Product), REPLICA)
+            self.assertIsNone(self.router.db_for_read(User))
+            self.assertIsNone(self.router.db_for_read(Session))
+            self.assertEqual(self.router.db_for_write(Product), 'default')
+
+    def test_transactions_stay_on_primary(self):
+        with reading_from_replica(), transaction.atomic():
+            self.assertIsNone(self.router.db_for_read(Product))
+
+
+class SessionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_carts_stay_out_of_the_database(self):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        product = Product.objects.create(vendor=vendor, name='Kettle', slug='kettle', price_mwk=100, stock_quantity=5)
+        for _ in range(3):
+            self.client.post(reverse('add_to_cart'), {'product_id': product.pk, 'qty': 1})
+        self.assertFalse(Session.objects.exists())
+        User.objects.create_user('customer', password='x')
+        self.client.post(reverse('login'), {'username': 'customer', 'password': 'x'})
+        self.assertEqual(Session.objects.count(), 1)  # the login is written through
+        self.assertContains(self.client.get(reverse('checkout')), 'Kettle')
+
+    def test_stale_cached_cart_is_not_saved_or_ordered(self):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        kettle, pot = (Product.objects.create(vendor=vendor, name=name, slug=name.lower(), price_mwk=100, stock_quantity=5)
+                       for name in ('Kettle', 'Pot'))
+        customer = User.objects.create_user('customer', password='x')
+        self.client.force_login(customer)
+        self.client.post(reverse('add_to_cart'), {'product_id': kettle.pk, 'qty': 1})
+        stale = Cart._cache_key(user_cart_key(customer))
+        cache.set(stale, [])  # what another worker's cache might still hold
+        self.client.post(reverse('add_to_cart'), {'product_id': pot.pk, 'qty': 2})
+        cache.set(stale, [])
+        self.client.post(reverse('checkout'), {'shipping_address': 'Area 47', 'payment_method': 'cod'})
+        self.assertEqual(sorted(Order.objects.get().items.values_list('product__name', 'quantity')), [('Kettle', 1), ('Pot', 2)])
+
+    def test_changes_are_deferred_and_unchanged_saves_skipped(self):
+        self.client.force_login(User.objects.create_user('customer', password='x'))
+        key = self.client.cookies['sessionid'].value
+        store = sessions.SessionStore(key)
+        store['seen'] = 1
+        store.save()
+        self.assertNotIn('seen', store.decode(Session.objects.get().session_data))
+        sessions.flush_pending()
+        self.assertIn('seen', store.decode(Session.objects.get().session_data))
+        store = sessions.SessionStore(key)
+        store['seen'] = 1
+        with self.assertNumQueries(0):
+            store.save()
+
+    def test_purge_expired_in_batches(self):
+        past = timezone.now() - timedelta(days=1)
+        Session.objects.bulk_create([Session(session_key=f'old{i}', session_data='', expire_date=past) for i in range(25)])
+        Session.objects.create(session_key='live', session_data='', expire_date=timezone.now() + timedelta(days=1))
+        self.assertEqual(sessions.purge_expired(batch_size=10), 25)
+        self.assertEqual(list(Session.objects.values_list('pk', flat=True)), ['live'])
+
+
+class SessionFlushTests(TransactionTestCase):
+    # the timer flushes from its own thread and connection, so nothing may hold the write lock
+    def setUp(self):
+        cache.clear()
+
+    def test_deferred_changes_are_flushed_without_another_save(self):
+        self.client.force_login(User.objects.create_user('customer', password='x'))
+        store = sessions.SessionStore(self.client.cookies['sessionid'].value)
+        store['seen'] = 1
+        with mock.patch.object(sessions, 'PERSIST_AFTER', 0.05):
+            store.save()
+        deadline = time.monotonic() + 5
+        while 'seen' not in store.decode(Session.objects.get().session_data) and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertIn('seen', store.decode(Session.objects.get().session_data))
+        self.assertIsNone(sessions._timer)
+
+
+def _fail(reason):
+    raise RuntimeError(reason)
+
+
+class JobTests(TestCase):
+    def test_email_batch_over_one_claim(self):
+        for i in range(3):
+            jobs.queue_mail(f'Hello {i}', 'Body', 'noreply@example.com', ['admin@example.com'])
+        batch = jobs.claim('email', 'test')
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(jobs.claim('email', 'test'), [])  # concurrency 1: one batch at a time
+        jobs.run_batch(batch)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 3)
+
+    def test_retry_with_backoff_then_fail(self):
+        job = jobs.enqueue(_fail, 'boom', max_attempts=2)
+        jobs.run_batch(jobs.claim('default', 'test'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        jobs.run_batch(jobs.claim('default', 'test'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('boom', job.last_error)
+
+    def test_expired_lease_is_claimed_again(self):
+        jobs.enqueue(jobs.purge_finished)
+        jobs.claim('default', 'dead-worker')
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([job.attempts for job in jobs.claim('default', 'test')], [2])
+
+
+class IdempotencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vendor = User.objects.create_user('vendor', password='x', role=User.VENDOR, vendor_approved=True)
+        cls.customer = User.objects.create_user('customer', password='x')
+        cls.product = Product.objects.create(vendor=vendor, name='Kettle', slug='kettle', price_mwk=100, stock_quantity=5)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.customer)
+
+    def checkout(self, key):
+        return self.client.post(reverse('checkout'), {'shipping_address': 'Area 47', 'payment_method': 'cod',
+                                                      idempotency.FIELD: key})
+
+    def test_replayed_checkout_places_one_order(self):
+        self.client.post(reverse('add_to_cart'), {'product_id': self.product.pk, 'qty': 2})
+        first = self.checkout('k1')
+        self.assertEqual(first.status_code, 302)
+        with self.assertNumQueries(2):  # user, stored response
+            replay = self.checkout('k1')
+        self.assertEqual((replay.status_code, replay['Location']), (302, first['Location']))
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 3)
+
+    def test_view_runs_outside_a_transaction(self):
+        depth = len(connections['default'].atomic_blocks)  # TestCase's own blocks
+        seen = []
+
+        def view(request):
+            seen.append(len(connections['default'].atomic_blocks))
+            return HttpResponseRedirect('/done/')
+        request = RequestFactory().post('/x/', {idempotency.FIELD: 'k4'})
+        request.user = self.customer
+        self.assertEqual(idempotency.idempotent(view)(request).status_code, 302)
+        self.assertEqual(seen, [depth])
+        self.assertEqual(IdempotencyKey.objects.get(key='k4').location, '/done/')
+
+    def test_unfinished_requests_release_the_key(self):
+        self.assertEqual(self.checkout('k2').status_code, 200)  # empty cart: nothing done
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.client.post(reverse('add_to_cart'), {'product_id': self.product.pk, 'qty': 1})
+        self.assertEqual(self.checkout('k2').status_code, 302)
+
+    def test_key_reused_elsewhere_and_expiry(self):
+        self.client.post(reverse('add_to_cart'), {'product_id': self.product.pk, 'qty': 1})
+        order = Order.objects.get(pk=self.client.get(self.checkout('k3')['Location']).context['order'].pk)
+        response = self.client.post(reverse('manual_submit', args=[order.pk]), {idempotency.FIELD: 'k3'})
+        self.assertEqual(response.status_code, 422)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(idempotency.purge_expired(), 1)
@@ -0,0 +1,13 @@
+# shop/triggers.py - SQLite triggers on shop_product that keep derived tables current
+# (search.FTS_TABLE, categories.COUNT_TABLE), including through bulk writes that send no signals.
+# Each module owns its trigger SQL; this installs it.
+
+
+def install(conn, table, statements):
+    # idempotent; run on post_migrate because SQLite table rebuilds (AlterField) drop triggers.
+    # Skipped until `table` exists (before its migration) and on backends without the triggers.
+    if conn.vendor != 'sqlite' or table not in conn.introspection.table_names():
+        return
+    with conn.cursor() as cur:
+        for sql in statements:
+            cur.execute(sql)
@@ -1,22 +1,38 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views
+from . import api
 from .views import (
-    ProductCreateView, ProductDeleteView, ProductUpdateView, approve_vendor, home, product_detail, add_to_cart, checkout, thank_you, manual_submit, topup_wallet,
+    ProductCreateView, ProductDeleteView, ProductUpdateView, approve_vendor, home, category_index, category_detail, search, product_detail, add_to_cart, cart_update, checkout, thank_you, order_detail, manual_submit, topup_wallet,
     vendor_orders, vendor_cod_collected, manual_review, manual_review_action,
-    signup_customer, signup_vendor, dashboard_customer, dashboard_vendor, dashboard_admin, logout_success, custom_logout, vendor_product_list, wallet_detail
+    signup_customer, signup_vendor, dashboard_customer, dashboard_vendor, dashboard_admin, admin_worklist, logout_success, custom_logout, vendor_product_list, wallet_detail,
+    product_import, product_export, finance_export
 )
 
 urlpatterns = [
     path('', home, name='home'),
+    path('search/', search, name='search'),
     path('p/<slug:slug>/', product_detail, name='product_detail'),
+    path('c/', category_index, name='categories'),
+    path('c/<str:name>/', category_detail, name='category'),
+    # JSON API (see api.py)
+    path('api/v1/products/', api.products, name='api_products'),
+    path('api/v1/products/batch/', api.products_batch, name='api_products_batch'),
+    path('api/v1/categories/', api.category_list, name='api_categories'),
     path('cart/add/', add_to_cart, name='add_to_cart'),
+    path('cart/update/', cart_update, name='cart_update'),
     path('checkout/', checkout, name='checkout'),
+    path('orders/<int:order_id>/', order_detail, name='order_detail'),
     path('orders/<int:order_id>/thank-you/', thank_you, name='thank_you'),
 
+    # vendor orders
+    path('vendor/orders/', vendor_orders, name='vendor_orders'),
+    path('vendor/orders/<int:vendor_order_id>/cod-collected/', vendor_cod_collected, name='vendor_cod_collected'),
+
     # manual payments
     path('payments/manual/<int:order_id>/submit/', manual_submit, name='manual_submit'),
     path('admin/manual/review/', manual_review, name='manual_review'),
     path('admin/manual/review/<int:mp_id>/<str:action>/', manual_review_action, name='manual_review_action'),
+    path('admin/finance/export/', finance_export, name='finance_export'),
 
     # auth
     path('accounts/login/', auth_views.LoginView.as_view(template_name='auth/login.html'), name='login'),
@@ -30,10 +46,13 @@ urlpatterns = [
     path('dashboard/customer/', dashboard_customer, name='dashboard_customer'),
     path('dashboard/vendor/', dashboard_vendor, name='dashboard_vendor'),
     path('dashboard/admin/', dashboard_admin, name='dashboard_admin'),
+    path('dashboard/admin/<slug:name>/', admin_worklist, name='admin_worklist'),
 
     # Vendor product management
     path('vendor/products/', vendor_product_list, name='vendor_product_list'),
     path('vendor/products/add/', ProductCreateView.as_view(), name='product_create'),
+    path('vendor/products/import/', product_import, name='product_import'),
+    path('vendor/products/export/', product_export, name='product_export'),
     path('vendor/products/<int:pk>/edit/', ProductUpdateView.as_view(), name='product_update'),
     path('vendor/products/<int:pk>/delete/', ProductDeleteView.as_view(), name='product_delete'),
     
@@ -1,17 +1,35 @@
 # shop/views.py (updated, added formset handling)
+from django.http import Http404, StreamingHttpResponse
+from django.utils.http import urlencode
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.views.decorators.http import require_POST
 from django.db import transaction
+from django.db.models import Prefetch
 from django.utils import timezone
-from django.core.paginator import Paginator
 from django.contrib.auth import logout
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
 from django.forms import inlineformset_factory  # Added for formsets
 from django.contrib import messages
-from .models import Product, Order, OrderItem, Payment, ManualPayment, User, Wallet, ProductImage  # Added ProductImage
-from .forms import CheckoutForm, ManualPaymentForm, CustomerSignUpForm, VendorSignUpForm
+from .models import Product, Order, OrderItem, Payment, ManualPayment, User, ProductImage, VendorOrder  # Added ProductImage
+from .forms import CategoryFilterForm, CheckoutForm, ManualPaymentForm, CustomerSignUpForm, VendorSignUpForm, CartAddForm, WalletTopUpForm, ProductImportForm, FinanceExportForm
+from .catalog import dated_keyset_page, keyset_page, product_count, with_availability, with_primary_image
+from .search import search_products
+from .fragments import fragments, stats as fragment_stats
+from .conditional import conditional_products
+from .routers import replica_reads
+from .checkout import CartChanged, CheckoutError, place_order
+from .cart import Cart, MAX_QTY
+from .rollups import after_commit, record_payments, vendor_sales
+from .wallet import get_wallet, statement
+from .receipts import enqueue as enqueue_receipt
+from .jobs import queue_mail
+from .idempotency import idempotent, new_key as new_idempotency_key
+from .review import claim_batch, decide, my_batch
+from .product_io import export_lines, guess_format, import_products, read_rows
+from . import categories, counters, finance
 
 # Inline formset for product images (allows multiple uploads)
 ProductImageFormSet = inlineformset_factory(
@@ -19,24 +37,92 @@ ProductImageFormSet = inlineformset_factory(
 )
 
 # Public views
+def _catalog_page(request):
+    if not hasattr(request, 'catalog_page'):
+        request.catalog_page = keyset_page(with_availability(Product.objects.all()), request.GET, 12)
+    return request.catalog_page
+
+def _detail_product(request, slug):
+    if not hasattr(request, 'product'):
+        request.product = get_object_or_404(with_availability(Product.objects.all()), slug=slug)
+    return request.product
+
+def _with_cards(page_obj):
+    # card markup comes from the fragment cache; only availability is read per request
+    cards = fragments(page_obj, 'card')
+    for p in page_obj:
+        p.card_html = cards.get(p.pk, {}).get('card', '')
+    return page_obj
+
+@replica_reads
+@conditional_products(lambda request: _catalog_page(request).object_list)
 def home(request):
-    qs = Product.objects.order_by('-id')
-    paginator = Paginator(qs, 12)
-    page = request.GET.get('page')
-    return render(request, 'home.html', {'page_obj': paginator.get_page(page)})
-
+    page_obj = _with_cards(_catalog_page(request))
+    return render(request, 'home.html', {'page_obj': page_obj, 'product_count': product_count()})
+
+@replica_reads
+def category_index(request):
+    return render(request, 'categories.html', {'categories': categories.nav()})
+
+@replica_reads
+def category_detail(request, name):
+    nav = categories.nav()  # counts come from CategoryCount, never a GROUP BY over products
+    current = next((c for c in nav if c[0] == name), None)
+    if current is None:
+        raise Http404
+    form = CategoryFilterForm(request.GET)
+    form.is_valid()  # invalid fields are left out of cleaned_data and so not applied
+    filters = form.cleaned_data
+    page_obj = _with_cards(categories.browse(name, filters, request.GET))
+    query = urlencode({k: 'on' if v is True else v for k, v in filters.items() if v not in (None, '', False)})
+    return render(request, 'category.html', {
+        'category': current, 'categories': nav, 'form': form, 'page_obj': page_obj, 'query': query,
+    })
+
+@replica_reads
+def search(request):
+    q = request.GET.get('q', '').strip()
+    category = request.GET.get('category') or None
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 1
+    result = search_products(q, category=category, page=page)
+    return render(request, 'search.html', {'q': q, 'category': category, 'result': result})
+
+@replica_reads
+@conditional_products(lambda request, slug: [_detail_product(request, slug)])
 def product_detail(request, slug):
-    obj = get_object_or_404(Product, slug=slug)
-    return render(request, 'product_detail.html', {'object': obj})
+    obj = _detail_product(request, slug)
+    parts = fragments([obj], 'gallery', 'summary').get(obj.pk, {})
+    return render(request, 'product_detail.html', {'object': obj, 'parts': parts})
 
-# session cart
+# server-side cart (see cart.Cart)
 def add_to_cart(request):
     if request.method == 'POST':
-        pid = str(request.POST.get('product_id'))
-        qty = int(request.POST.get('qty', 1))
-        cart = request.session.get('cart', {})
-        cart[pid] = cart.get(pid, 0) + qty
-        request.session['cart'] = cart
+        form = CartAddForm(request.POST)
+        if form.is_valid():
+            cart = Cart.for_request(request, fresh=True)
+            for error in cart.add(form.cleaned_data['product_id'], form.cleaned_data['qty']):
+                messages.error(request, str(error))
+        else:
+            messages.error(request, 'Please choose a valid product and quantity.')
+    return redirect('checkout')
+
+def cart_update(request):
+    # one POST sets several lines: qty_<product_id>=<new qty>, 0 removes the line
+    if request.method == 'POST':
+        changes = {}
+        for name, value in request.POST.items():
+            if not name.startswith('qty_'):
+                continue
+            try:
+                pid, qty = int(name[4:]), int(value)
+            except ValueError:
+                continue
+            changes[pid] = max(0, min(qty, MAX_QTY))
+        for error in Cart.for_request(request, fresh=True).apply(changes):
+            messages.error(request, str(error))
     return redirect('checkout')
 
 # Signup flows
@@ -63,57 +149,46 @@ def signup_vendor(request):
             user.role = User.VENDOR
             user.is_active = True
             user.vendor_approved = False
-            user.save()
-            # notify admin by email (console backend prints it)
-            from django.core.mail import send_mail
-            send_mail('New vendor signup', f'Vendor {user.username} signed up. Approve in admin.', 'noreply@example.com', ['admin@example.com'])
+            with transaction.atomic():
+                user.save()
+                counters.bump(counters.PENDING_VENDORS)
+            # notify admin by email, sent by the job worker (console backend prints it)
+            queue_mail('New vendor signup', f'Vendor {user.username} signed up. Approve in admin.', 'noreply@example.com', ['admin@example.com'])
             login(request, user)
             return redirect('dashboard_vendor')
     else:
         form = VendorSignUpForm()
     return render(request, 'auth/signup_vendor.html', {'form': form})
 
-# Checkout & orders (unchanged)
+# Checkout & orders
 @login_required
-@transaction.atomic
+@idempotent
 def checkout(request):
-    cart = request.session.get('cart', {})
-    products = Product.objects.select_for_update().filter(id__in=cart.keys())
-    lines, total = [], 0
-    for p in products:
-        qty = int(cart.get(str(p.id), 0))
-        if qty <= 0: continue
-        lines.append({'product': p, 'qty': qty, 'line_total': p.price_mwk*qty})
-        total += p.price_mwk*qty
+    cart = Cart.for_request(request, fresh=request.method == 'POST')
 
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
-        if form.is_valid() and products:
-            order = Order.objects.create(
-                customer=request.user,
-                shipping_address=form.cleaned_data['shipping_address'],
-                payment_method=form.cleaned_data['payment_method'],
-                total_amount_mwk=0,
-            )
-            for p in products:
-                qty = int(cart.get(str(p.id), 0))
-                if qty <= 0: continue
-                OrderItem.objects.create(order=order, product=p, quantity=qty, unit_price_mwk=p.price_mwk)
-                p.stock_quantity = max(0, p.stock_quantity - qty)
-                p.save(update_fields=['stock_quantity'])
-            order.total_amount_mwk = total
-            order.save(update_fields=['total_amount_mwk'])
-
-            if order.payment_method == 'cod':
-                Payment.objects.create(order=order, provider='cod', amount_mwk=total, status='pending')
+        if form.is_valid() and len(cart):
+            try:
+                order = place_order(
+                    request.user, cart.items(),
+                    shipping_address=form.cleaned_data['shipping_address'],
+                    payment_method=form.cleaned_data['payment_method'],
+                    cart_key=cart.key,
+                )
+            except CartChanged as e:
+                cart.refresh(e.products)
+                messages.warning(request, str(e))
+            except CheckoutError as e:
+                messages.error(request, str(e))
             else:
-                Payment.objects.create(order=order, provider='manual', amount_mwk=total, status='initiated')
-            request.session['cart'] = {}
-            return redirect('thank_you', order_id=order.id)
+                cart.clear()
+                return redirect('thank_you', order_id=order.id)
     else:
         form = CheckoutForm()
 
-    return render(request, 'checkout.html', {'form': form, 'lines': lines, 'total': total})
+    return render(request, 'checkout.html', {'form': form, 'lines': cart.display_lines(), 'total': cart.total,
+                                             'idempotency_key': new_idempotency_key()})
 
 @login_required
 def thank_you(request, order_id):
@@ -122,6 +197,7 @@ def thank_you(request, order_id):
 
 # Manual payments
 @login_required
+@idempotent
 def manual_submit(request, order_id):
     order = get_object_or_404(Order, id=order_id, customer=request.user)
     if request.method == 'POST':
@@ -129,77 +205,138 @@ def manual_submit(request, order_id):
         if form.is_valid():
             mp = form.save(commit=False)
             mp.order = order
-            mp.save()
+            with transaction.atomic():
+                mp.save()
+                counters.bump(counters.SUBMITTED_RECEIPTS)
+            enqueue_receipt(mp)
             return redirect('thank_you', order_id=order.id)
     else:
         form = ManualPaymentForm()
-    return render(request, 'manual_submit.html', {'form': form, 'order': order})
+    return render(request, 'manual_submit.html', {'form': form, 'order': order, 'idempotency_key': new_idempotency_key()})
 
-# Vendor views
+# Vendor views (read the per-vendor VendorOrder rows written at checkout)
 @login_required
 def vendor_orders(request):
     if not getattr(request.user, 'is_vendor', False):
         return redirect('home')
-    qs = Order.objects.filter(items__product__vendor=request.user).distinct().order_by('-id')
-    return render(request, 'vendor_orders.html', {'orders': qs})
+    qs = VendorOrder.objects.filter(vendor=request.user).select_related('order')
+    return render(request, 'vendor_orders.html', {'page_obj': keyset_page(qs, request.GET, 25)})
 
 @login_required
-def vendor_cod_collected(request, order_id):
+@require_POST
+def vendor_cod_collected(request, vendor_order_id):
     if not getattr(request.user, 'is_vendor', False):
         return redirect('home')
-    o = get_object_or_404(Order, id=order_id)
-    if o.payment_method == 'cod' and o.payment_status != 'paid':
-        Payment.objects.create(order=o, provider='cod', amount_mwk=o.total_amount_mwk, status='success')
-        o.payment_status = 'paid'
-        o.save(update_fields=['payment_status'])
+    vo = get_object_or_404(VendorOrder.objects.select_related('order'), id=vendor_order_id, vendor=request.user)
+    o = vo.order
+    if o.payment_method == 'cod':
+        with transaction.atomic():
+            if VendorOrder.objects.filter(pk=vo.pk).exclude(status='paid').update(status='paid'):
+                Payment.objects.create(order=o, provider='cod', amount_mwk=vo.subtotal_mwk, status='success')
+                after_commit(record_payments, [o.pk], vendor=request.user)
+                if not VendorOrder.objects.filter(order=o).exclude(status='paid').exists():
+                    if Order.objects.filter(pk=o.pk).exclude(payment_status='paid').update(payment_status='paid'):
+                        counters.bump(counters.UNPAID_COD, -1)
     return redirect('vendor_orders')
 
-# Admin manual payment review
+# Admin manual payment review (see review.py)
 @user_passes_test(lambda u: u.is_staff or getattr(u,'is_admin',False))
 def manual_review(request):
-    q = ManualPayment.objects.filter(status='submitted').order_by('-id')
-    return render(request, 'manual_review.html', {'items': q})
+    if request.method == 'POST':
+        if request.POST.get('action') == 'claim':
+            claim_batch(request.user)
+        elif request.POST.get('action') in ('approve', 'reject'):
+            ids = [int(i) for i in request.POST.getlist('ids') if i.isdigit()]
+            n = decide(request.user, ids, approve=request.POST['action'] == 'approve')
+            messages.success(request, f"{n} payment{'s' if n != 1 else ''} {request.POST['action']}d.")
+        return redirect('manual_review')
+    queue = ManualPayment.objects.filter(status='submitted').select_related('order', 'claimed_by')
+    return render(request, 'manual_review.html', {
+        'mine': my_batch(request.user),
+        'page_obj': keyset_page(queue, request.GET, 50),
+        'now': timezone.now(),
+    })
 
 @user_passes_test(lambda u: u.is_staff or getattr(u,'is_admin',False))
 def manual_review_action(request, mp_id, action):
-    mp = get_object_or_404(ManualPayment, id=mp_id)
-    if action == 'approve':
-        mp.status = 'approved'
-        mp.reviewed_by = request.user
-        mp.reviewed_at = timezone.now()
-        mp.save(update_fields=['status','reviewed_by','reviewed_at'])
-        if mp.order:
-            o = mp.order
-            o.payment_status = 'paid'
-            o.save(update_fields=['payment_status'])
-    elif action == 'reject':
-        mp.status = 'rejected'
-        mp.reviewed_by = request.user
-        mp.reviewed_at = timezone.now()
-        mp.save(update_fields=['status','reviewed_by','reviewed_at'])
+    if action in ('approve', 'reject'):
+        decide(request.user, [mp_id], approve=action == 'approve')
     return redirect('manual_review')
 
+# Finance exports (see finance.py)
+@user_passes_test(lambda u: u.is_staff or getattr(u,'is_admin',False))
+def finance_export(request):
+    form = FinanceExportForm(request.GET or None)
+    if not form.is_valid():
+        return render(request, 'finance_export.html', {'form': form})
+    d = form.cleaned_data
+    response = StreamingHttpResponse(finance.export_lines(d['kind'], d['start'], d['end'], d['format']),
+                                     content_type='application/x-ndjson' if d['format'] == 'jsonl' else 'text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{d["kind"]}-{d["start"]}_{d["end"]}.{d["format"]}"'
+    return response
+
 # Dashboards
+def _with_items(orders):
+    # line items and their products in one query each, for any number of orders
+    return orders.prefetch_related(Prefetch('items', OrderItem.objects.select_related('product').order_by('id')))
+
 @login_required
 def dashboard_customer(request):
-    orders = Order.objects.filter(customer=request.user).order_by('-created_at')
-    return render(request, 'dashboards/customer.html', {'orders': orders})
+    # newest first, 20 a page; counts and totals are columns on Order, so nothing is aggregated
+    page_obj = dated_keyset_page(_with_items(Order.objects.filter(customer=request.user)), request.GET, 20)
+    return render(request, 'dashboards/customer.html', {'page_obj': page_obj})
 
 @login_required
+def order_detail(request, order_id):
+    order = get_object_or_404(_with_items(Order.objects.all()), id=order_id, customer=request.user)
+    return render(request, 'order_detail.html', {'order': order})
+
+@login_required
+@replica_reads
 def dashboard_vendor(request):
     if not getattr(request.user, 'is_vendor', False):
         return redirect('home')
     products = Product.objects.filter(vendor=request.user)
-    orders = Order.objects.filter(items__product__vendor=request.user).distinct().order_by('-id')
-    return render(request, 'dashboards/vendor.html', {'products': products, 'orders': orders})
+    orders = VendorOrder.objects.filter(vendor=request.user).select_related('order').order_by('-id')[:10]
+    days = 90 if request.GET.get('days') == '90' else 30
+    return render(request, 'dashboards/vendor.html', {
+        'products': products, 'orders': orders, 'sales': vendor_sales(request.user, days),
+    })
+
+# admin work lists: {counter: (title, relation shown on each row)}
+WORKLISTS = {
+    counters.PENDING_VENDORS: ('Vendors awaiting approval', None),
+    counters.SUBMITTED_RECEIPTS: ('Manual payments pending review', 'order'),
+    counters.UNPAID_COD: ('Unpaid cash-on-delivery orders', 'customer'),
+    counters.LOW_STOCK_PRODUCTS: ('Low-stock products', 'vendor'),
+}
 
 @login_required
+@replica_reads
 def dashboard_admin(request):
     if not request.user.is_staff:
         return redirect('home')
-    vendors_pending = User.objects.filter(role=User.VENDOR, vendor_approved=False)
-    manual_payments = ManualPayment.objects.filter(status='submitted')
-    return render(request, 'dashboards/admin.html', {'vendors_pending': vendors_pending, 'manual_payments': manual_payments})
+    # totals come from the maintained counters (one query); the rows behind them are paged in admin_worklist
+    totals = counters.read()
+    tiles = [(name, title, totals[name]) for name, (title, _) in WORKLISTS.items()]
+    return render(request, 'dashboards/admin.html', {'tiles': tiles, 'fragment_stats': fragment_stats()})
+
+@login_required
+@replica_reads
+def admin_worklist(request, name):
+    if not request.user.is_staff:
+        return redirect('home')
+    if name not in WORKLISTS:
+        raise Http404
+    title, related = WORKLISTS[name]
+    rows = counters.SOURCES[name]()
+    if related:
+        rows = rows.select_related(related)
+    page_obj = keyset_page(rows, request.GET, 25)
+    return render(request, 'dashboards/admin_worklist.html', {
+        'name': name, 'title': title, 'page_obj': page_obj, 'total': counters.read()[name],
+        'low_stock': counters.LOW_STOCK,
+    })
 
 def custom_logout(request):
     logout(request)
@@ -212,9 +349,36 @@ def logout_success(request):
 def vendor_product_list(request):
     if not request.user.is_vendor:
         return redirect('home')
-    products = Product.objects.filter(vendor=request.user)
+    products = with_primary_image(Product.objects.filter(vendor=request.user))
     return render(request, 'vendor_product_list.html', {'products': products})
 
+# bulk catalog import/export (see product_io)
+@login_required
+def product_import(request):
+    if not request.user.is_vendor:
+        return redirect('home')
+    report = None
+    if request.method == 'POST':
+        form = ProductImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            report = import_products(request.user, read_rows(upload.file, guess_format(upload.name)))
+            messages.success(request, f'{report.created} created, {report.updated} updated, '
+                                      f'{report.unchanged} unchanged, {report.failed} rejected.')
+    else:
+        form = ProductImportForm()
+    return render(request, 'product_import.html', {'form': form, 'report': report})
+
+@login_required
+def product_export(request):
+    if not request.user.is_vendor:
+        return redirect('home')
+    fmt = 'jsonl' if request.GET.get('format') == 'jsonl' else 'csv'
+    response = StreamingHttpResponse(export_lines(request.user, fmt),
+                                     content_type='application/x-ndjson' if fmt == 'jsonl' else 'text/csv')
+    response['Content-Disposition'] = f'attachment; filename="products.{fmt}"'
+    return response
+
 class ProductCreateView(CreateView):
     model = Product
     fields = ['name', 'slug', 'description', 'price_mwk', 'stock_quantity', 'category']
@@ -232,7 +396,9 @@ class ProductCreateView(CreateView):
     def form_valid(self, form):
         self.object = form.save(commit=False)
         self.object.vendor = self.request.user
-        self.object.save()
+        with transaction.atomic():
+            self.object.save()
+            counters.bump(counters.LOW_STOCK_PRODUCTS, counters.low_stock_change(after=self.object.stock_quantity))
         formset = ProductImageFormSet(self.request.POST, self.request.FILES, instance=self.object)
         if formset.is_valid():
             formset.save()
@@ -258,7 +424,10 @@ class ProductUpdateView(UpdateView):
         return context
 
     def form_valid(self, form):
-        form.save()
+        with transaction.atomic():
+            form.save()
+            counters.bump(counters.LOW_STOCK_PRODUCTS,
+                          counters.low_stock_change(form.initial['stock_quantity'], self.object.stock_quantity))
         formset = ProductImageFormSet(self.request.POST, self.request.FILES, instance=self.object)
         if formset.is_valid():
             formset.save()
@@ -274,29 +443,41 @@ class ProductDeleteView(DeleteView):
     def get_queryset(self):
         return Product.objects.filter(vendor=self.request.user)
 
+    def form_valid(self, form):
+        with transaction.atomic():
+            counters.bump(counters.LOW_STOCK_PRODUCTS, counters.low_stock_change(before=self.object.stock_quantity))
+            return super().form_valid(form)
+
 @login_required
 def approve_vendor(request, user_id):
     if not request.user.is_admin:
         return redirect('home')
     vendor = get_object_or_404(User, id=user_id, role=User.VENDOR)
-    vendor.vendor_approved = True
-    vendor.save()
+    with transaction.atomic():
+        # conditional, so approving twice doesn't count twice
+        if User.objects.filter(pk=vendor.pk, vendor_approved=False).update(vendor_approved=True):
+            counters.bump(counters.PENDING_VENDORS, -1)
     messages.success(request, f"Vendor {vendor.username} has been approved successfully!")
     return redirect('dashboard_admin')
 
-# views.py
+# Wallet (see wallet.py; balances only move through ledger entries)
 @login_required
 def wallet_detail(request):
-    wallet, created = Wallet.objects.get_or_create(user=request.user)
-    return render(request, 'wallet_detail.html', {'wallet': wallet})
+    wallet = get_wallet(request.user)
+    return render(request, 'wallet_detail.html', {'wallet': wallet, 'page_obj': statement(wallet, request.GET)})
 
 @login_required
+@idempotent
 def topup_wallet(request):
-    if request.method == 'POST':
-        amount = int(request.POST.get('amount', 0))
-        if amount > 0:
-            wallet = Wallet.objects.get(user=request.user)
-            wallet.balance_mwk += amount
-            wallet.save()
-            return redirect('wallet_detail')
-    return render(request, 'topup_wallet.html')
\ No newline at end of file
+    # queued for manual payment review like an order receipt; the wallet is credited on approval
+    form = WalletTopUpForm(request.POST or None, request.FILES or None)
+    if request.method == 'POST' and form.is_valid():
+        mp = form.save(commit=False)
+        mp.wallet = get_wallet(request.user)
+        with transaction.atomic():
+            mp.save()
+            counters.bump(counters.SUBMITTED_RECEIPTS)
+        enqueue_receipt(mp)
+        messages.success(request, f'Your top-up of MWK {mp.amount_mwk} will be added to your wallet once the payment is verified.')
+        return redirect('wallet_detail')
+    return render(request, 'topup_wallet.html', {'form': form, 'idempotency_key': new_idempotency_key()})
\ No newline at end of file
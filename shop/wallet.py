@@ -0,0 +1,87 @@
+# shop/wallet.py - wallet ledger
+# Every balance change is one conditional UPDATE on Wallet (debits require balance >= amount)
+# plus one immutable WalletEntry, in the same transaction. Every SNAPSHOT_EVERY entries the
+# resulting balance is stored as a WalletSnapshot, so balance-at-a-point and statement running
+# balances replay at most SNAPSHOT_EVERY entries instead of the whole history.
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .catalog import akeyset_page, keyset_page
+from .models import Wallet, WalletEntry, WalletSnapshot
+
+SNAPSHOT_EVERY = 100
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+def get_wallet(user):
+    return Wallet.objects.get_or_create(user=user)[0]
+
+
+def post_entry(wallet_id, amount, kind, order=None):
+    with transaction.atomic():
+        wallets = Wallet.objects.filter(pk=wallet_id)
+        if amount < 0:
+            wallets = wallets.filter(balance_mwk__gte=-amount)
+        if not wallets.update(balance_mwk=F('balance_mwk') + amount, entry_count=F('entry_count') + 1,
+                              updated_at=timezone.now()):
+            raise InsufficientFunds()
+        balance, count = Wallet.objects.filter(pk=wallet_id).values_list('balance_mwk', 'entry_count').get()
+        entry = WalletEntry.objects.create(wallet_id=wallet_id, amount_mwk=amount, kind=kind, order=order)
+        if count % SNAPSHOT_EVERY == 0:
+            WalletSnapshot.objects.create(wallet_id=wallet_id, entry=entry, balance_mwk=balance,
+                                          created_at=entry.created_at)
+    return entry
+
+
+def _replay(snapshots, entries):
+    snap = snapshots.order_by('-entry_id').first()
+    base = 0
+    if snap is not None:
+        base = snap.balance_mwk
+        entries = entries.filter(id__gt=snap.entry_id)
+    return base + (entries.aggregate(n=Sum('amount_mwk'))['n'] or 0)
+
+
+async def _areplay(snapshots, entries):
+    snap = await snapshots.order_by('-entry_id').afirst()
+    base = 0
+    if snap is not None:
+        base = snap.balance_mwk
+        entries = entries.filter(id__gt=snap.entry_id)
+    return base + ((await entries.aaggregate(n=Sum('amount_mwk')))['n'] or 0)
+
+
+def balance_through(wallet, entry_id):
+    # balance right after entry_id was posted
+    return _replay(wallet.snapshots.filter(entry_id__lte=entry_id), wallet.entries.filter(id__lte=entry_id))
+
+
+def balance_at(wallet, when):
+    return _replay(wallet.snapshots.filter(created_at__lte=when), wallet.entries.filter(created_at__lte=when))
+
+
+def _running_balances(page, balance):
+    for entry in page.object_list:
+        entry.balance_after_mwk = balance
+        balance -= entry.amount_mwk
+    return page
+
+
+def statement(wallet, params, per_page=20):
+    # newest-first keyset page of entries, each with the running balance after it
+    page = keyset_page(wallet.entries.all(), params, per_page)
+    if page.object_list:
+        _running_balances(page, balance_through(wallet, page.object_list[0].pk))
+    return page
+
+
+async def astatement(wallet, params, per_page=20):
+    page = await akeyset_page(wallet.entries.all(), params, per_page)
+    if page.object_list:
+        entry_id = page.object_list[0].pk
+        _running_balances(page, await _areplay(wallet.snapshots.filter(entry_id__lte=entry_id),
+                                               wallet.entries.filter(id__lte=entry_id)))
+    return page